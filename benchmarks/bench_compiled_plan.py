@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark loading a repair plan.
+
+Builds a synthetic host with --vnodes primary ranges cut into --steps steps
+and compares what it takes to get at the steps: regenerating them into
+pending_repairs dicts, as a run or --resume without a plan file does, and
+opening a file written with --compile-plan and reading random steps from it.
+Peak Python memory is measured with tracemalloc.
+
+Example:
+    ./bench_compiled_plan.py --vnodes 256 --steps 4000
+"""
+from __future__ import print_function
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import range_repair
+
+
+def build_options(steps):
+    """
+    :param int steps: Steps per range.
+
+    :return: OptionParser result.
+    """
+    options, _ = range_repair.build_option_parser().parse_args(['-k', 'ks', '-s', str(steps)])
+    return options
+
+
+def build_container(vnodes, seed=0):
+    """
+    Build a TokenContainer for a host of a synthetic ring without calling
+    nodetool.
+
+    :param int vnodes: Number of tokens owned by the host.
+    :param int seed: Random seed.
+
+    :rtype: range_repair.TokenContainer
+    """
+    rng = random.Random(seed)
+    tokens = range_repair.TokenContainer.__new__(range_repair.TokenContainer)
+    tokens.ring_tokens = sorted(rng.randint(range_repair.TokenContainer.RANGE_MIN, range_repair.TokenContainer.RANGE_MAX)
+                                for _ in range(vnodes * 4))
+    tokens.host_tokens = sorted(rng.sample(tokens.ring_tokens, vnodes))
+    tokens.host_token_count = vnodes
+    tokens.host_ranges = []
+    tokens.build_host_ranges()
+    return tokens
+
+
+def pending_dicts(options, tokens, filename, lookups):
+    """
+    Generate every step and keep it as a pending_repairs entry.
+
+    :return: Number of steps.
+    """
+    pending = {}
+    for start, end, step, nodeposition in range_repair.host_sub_ranges(options, tokens):
+        task = range_repair.RepairTask('', step, start, end, nodeposition, options.keyspace, options.columnfamily)
+        pending[task.key] = task
+    return len(pending)
+
+
+def compiled(options, tokens, filename, lookups):
+    """
+    Open a compiled plan and read random steps from it.
+
+    :return: Number of steps.
+    """
+    plan = range_repair.CompiledPlan(filename)
+    for index in lookups:
+        plan[index % len(plan)]
+    count = len(plan)
+    plan.close()
+    return count
+
+
+def bench(load, options, tokens, filename, lookups):
+    """
+    Time one way of loading the plan and measure its peak memory.
+
+    :rtype: tuple
+    :return: seconds, peak MiB, number of steps
+    """
+    # tracemalloc slows allocation down, so time an untraced run
+    started = time.time()
+    load(options, tokens, filename, lookups)
+    seconds = time.time() - started
+    tracemalloc.start()
+    count = load(options, tokens, filename, lookups)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / 2.0 ** 20, count
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark loading a repair plan')
+    parser.add_argument('--vnodes', type=int, default=256, help='Number of tokens owned by the host')
+    parser.add_argument('--steps', type=int, default=4000, help='Steps per range')
+    parser.add_argument('--lookups', type=int, default=10000, help='Random steps read from the compiled plan')
+    args = parser.parse_args()
+
+    options = build_options(args.steps)
+    tokens = build_container(args.vnodes)
+    lookups = [random.randrange(2 ** 31) for _ in range(args.lookups)]
+    with tempfile.NamedTemporaryFile(suffix='.plan') as f:
+        started = time.time()
+        range_repair.CompiledPlan.write(f.name, 8, [(None, len(tokens.host_ranges))],
+                                        ((0,) + step for step in range_repair.host_sub_ranges(options, tokens)))
+        print('compiled in {0:.2f}s, {1:.1f} MiB'.format(time.time() - started, os.path.getsize(f.name) / 2.0 ** 20))
+        print('{0:>10} {1:>10} {2:>12} {3:>10}'.format('plan', 'seconds', 'peak (MiB)', 'steps'))
+        for name, load in (('dicts', pending_dicts), ('compiled', compiled)):
+            print('{0:>10} {1:>10.2f} {2:>12.1f} {3:>10}'.format(name, *bench(load, options, tokens, f.name, lookups)))
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of a repair run against a fake nodetool.
+
+Runs repair() with benchmarks/fake_nodetool as nodetool for every
+combination of --workers, --steps and --vnodes, each case in a fresh
+process. The fake cluster, repair latency and failure rate are set with
+--nodes, --latency and --failure-rate (see fake_nodetool for the latency
+distributions). For every case it reports:
+
+- steps per second of wall time
+- CPU seconds of the controller process during the run, and separately of its children
+  (nodetool, and worker processes with --executor process)
+- peak RSS of the controller process
+- number of status snapshot writes and journal records, the seconds spent
+  in them and their share of the wall time
+
+Results are printed as a table and, with --output, written as JSON so they
+can be compared from run to run. Every nodetool call starts a Python
+interpreter, so with a zero latency the steps per second are bounded by
+that rather than by the controller; compare controller CPU per step.
+
+Example:
+    ./bench_end_to_end.py --workers 1 4 16 --steps 10 --vnodes 16 64 --output results.json
+"""
+from __future__ import print_function
+import functools
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, SUPPRESS
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import range_repair
+
+FAKE_NODETOOL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_nodetool')
+
+
+def timed(totals, method):
+    """
+    Wrap a RepairStatus method to count its calls and the time they take.
+
+    :param dict totals: Calls and seconds, updated in place.
+    :param method: Method to wrap.
+    """
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.time()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            totals['calls'] += 1
+            totals['seconds'] += time.time() - started
+    return wrapper
+
+
+def run_case(case):
+    """
+    Run one repair in this process and measure it.
+
+    :param dict case: Benchmark case, as built by the main program.
+
+    :rtype: dict
+    :return: The case with its results.
+    """
+    tmpdir = tempfile.mkdtemp()
+    output_status = os.path.join(tmpdir, 'status.json')
+    options, _ = range_repair.build_option_parser().parse_args([
+        '--nodetool', FAKE_NODETOOL, '-H', '127.0.0.1', '-k', 'ks0', '-s', str(case['steps']),
+        '-w', str(case['workers']), '--executor', case['executor'], '--max-sleep-before-run', '0',
+        '--max-tries', str(case['max_tries']), '--initial-sleep', '0',
+        '--output-status', output_status] + case['args'])
+    writes = {'calls': 0, 'seconds': 0.0}
+    records = {'calls': 0, 'seconds': 0.0}
+    range_repair.RepairStatus.write = timed(writes, range_repair.RepairStatus.write)
+    range_repair.RepairStatus._record = timed(records, range_repair.RepairStatus._record)
+
+    # Failed repairs would be logged one by one
+    logging.disable(logging.CRITICAL)
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.time()
+    range_repair.repair(options)
+    wall = time.time() - started
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = usage.ru_utime + usage.ru_stime - before.ru_utime - before.ru_stime
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with open(output_status) as f:
+        status = json.load(f)
+    shutil.rmtree(tmpdir)
+
+    steps = status['successful_count'] + status['failed_count']
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss_unit = 1 if platform.system() == 'Darwin' else 1024
+    return dict(case, **{
+        'repairs': steps,
+        'failed': status['failed_count'],
+        'seconds': wall,
+        'steps_per_second': steps / wall if wall else None,
+        'controller_cpu': cpu,
+        'controller_cpu_per_step': cpu / steps if steps else None,
+        'children_cpu': children.ru_utime + children.ru_stime,
+        'peak_rss_mib': usage.ru_maxrss * rss_unit / 2.0 ** 20,
+        'status_writes': writes['calls'],
+        'status_write_seconds': writes['seconds'],
+        'journal_records': records['calls'],
+        'journal_seconds': records['seconds'],
+        'status_overhead': (writes['seconds'] + records['seconds']) / wall if wall else None,
+    })
+
+
+def spawn_case(case, environment):
+    """
+    Run a case in a fresh process, so that its CPU time and peak RSS are its own.
+
+    :param dict case: Benchmark case.
+    :param dict environment: Fake nodetool settings.
+
+    :rtype: dict
+    :return: The case with its results.
+    """
+    env = dict(os.environ, **environment)
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)],
+                                     env=env, universal_newlines=True)
+    return json.loads(output.splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='End-to-end benchmark of a repair run against a fake nodetool')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4], help='Worker counts')
+    parser.add_argument('--steps', type=int, nargs='+', default=[10], help='Steps per range')
+    parser.add_argument('--vnodes', type=int, nargs='+', default=[4, 16], help='Tokens per node')
+    parser.add_argument('--nodes', type=int, default=3, help='Nodes in the ring')
+    parser.add_argument('--partitioner', choices=('murmur3', 'random'), default='murmur3', help='Token partitioner')
+    parser.add_argument('--latency', default='fixed:0', help='Repair latency distribution, see fake_nodetool')
+    parser.add_argument('--failure-rate', type=float, default=0, help='Fraction of repairs that fail')
+    parser.add_argument('--max-tries', type=int, default=1, help='Tries per repair, retried without sleeping')
+    parser.add_argument('--executor', default='thread', help='range_repair.py --executor')
+    parser.add_argument('--range-repair-args', default='',
+                        help='More range_repair.py options for every case, e.g. "--status-format compact"')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--case', help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        sys.exit(0)
+
+    results = []
+    print('{0:>8} {1:>7} {2:>7} {3:>8} {4:>9} {5:>10} {6:>12} {7:>10} {8:>9}'.format(
+        'workers', 'steps', 'vnodes', 'repairs', 'steps/s', 'ctrl cpu', 'cpu/step (ms)', 'rss (MiB)',
+        'status %'))
+    for vnodes in args.vnodes:
+        for steps in args.steps:
+            for workers in args.workers:
+                environment = {
+                    'FAKE_NODETOOL_NODES': str(args.nodes),
+                    'FAKE_NODETOOL_VNODES': str(vnodes),
+                    'FAKE_NODETOOL_PARTITIONER': args.partitioner,
+                    'FAKE_NODETOOL_LATENCY': args.latency,
+                    'FAKE_NODETOOL_FAILURE_RATE': str(args.failure_rate),
+                }
+                case = {'workers': workers, 'steps': steps, 'vnodes': vnodes, 'nodes': args.nodes,
+                        'partitioner': args.partitioner, 'latency': args.latency,
+                        'failure_rate': args.failure_rate, 'max_tries': args.max_tries, 'executor': args.executor,
+                        'args': args.range_repair_args.split()}
+                result = spawn_case(case, environment)
+                results.append(result)
+                print('{0:>8} {1:>7} {2:>7} {3:>8} {4:>9.1f} {5:>10.2f} {6:>12.2f} {7:>10.1f} {8:>9.1f}'.format(
+                    workers, steps, vnodes, result['repairs'], result['steps_per_second'], result['controller_cpu'],
+                    result['controller_cpu_per_step'] * 1000, result['peak_rss_mib'],
+                    result['status_overhead'] * 100))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'started': datetime.now().isoformat(), 'python': platform.python_version(),
+                       'results': results}, f, indent=2)
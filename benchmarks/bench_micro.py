@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks of the controller's hot paths, checked against stored
+baselines.
+
+Times token math (get_preceding_token on a large ring, sub_range_generator
+over Murmur3 and RandomPartitioner wrap-around ranges) and status
+bookkeeping (create_key, building a RepairTask and its status file dict,
+serializing the snapshot RepairStatus.write writes, is_excluded and
+parse_exclude_step). Each time is divided by the time of a fixed
+pure-Python calibration loop run in turns with it, so that baselines taken
+on one machine can be checked on another, and compared with the baseline
+in micro_baselines.json. The script exits with status 1 if
+any benchmark is more than --threshold slower than its baseline, measured
+twice. After an intended change in speed, store new baselines with --update.
+
+Example:
+    ./bench_micro.py --threshold 0.3
+    ./bench_micro.py --update
+"""
+from __future__ import print_function
+import json
+import os
+import random
+import sys
+import timeit
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import range_repair
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'micro_baselines.json')
+
+
+def build_tokens(ring_size=0, random_partitioner=False, seed=0):
+    """
+    Build a TokenContainer for a synthetic ring without calling nodetool.
+
+    :param int ring_size: Number of tokens in the ring.
+    :param bool random_partitioner: Use RandomPartitioner tokens.
+    :param int seed: Random seed.
+
+    :rtype: range_repair.TokenContainer
+    """
+    tokens = range_repair.TokenContainer.__new__(range_repair.TokenContainer)
+    tokens.ring_tokens = [1] if random_partitioner else [-1]
+    tokens.check_for_MD5_tokens()
+    rng = random.Random(seed)
+    tokens.ring_tokens = range_repair.token_array(
+        sorted(rng.randint(tokens.RANGE_MIN, tokens.RANGE_MAX) for _ in range(ring_size)))
+    return tokens
+
+
+def calibration():
+    total = 0
+    for i in range(1000):
+        total += i * i % 7
+    return total
+
+
+def get_preceding_token(ring_size):
+    tokens = build_tokens(ring_size)
+    rng = random.Random(1)
+    queries = [rng.randint(tokens.RANGE_MIN, tokens.RANGE_MAX) for _ in range(1000)]
+
+    def run():
+        for token in queries:
+            tokens.get_preceding_token(token)
+    return run
+
+
+def sub_range_generator(random_partitioner):
+    tokens = build_tokens(random_partitioner=random_partitioner)
+    start, stop = tokens.RANGE_MAX - 10 ** 12, tokens.RANGE_MIN + 10 ** 12
+
+    def run():
+        for _ in tokens.sub_range_generator(start, stop, 1000):
+            pass
+    return run
+
+
+def create_key():
+    def run():
+        for step in range(1000):
+            range_repair.create_key(step, '-01872588326932481783', '-01465195632138975614', '12/256', 'ks', ['t1'])
+    return run
+
+
+def repair_task():
+    def run():
+        for step in range(1000):
+            range_repair.RepairTask('nodetool repair', step, '-01872588326932481783', '-01465195632138975614',
+                                    '12/256', 'ks', ['t1']).to_dict()
+    return run
+
+
+def status_snapshot():
+    repair_status = range_repair.RepairStatus()
+    for step in range(1000):
+        repair_status.add_pending_repair(range_repair.RepairTask('', step, str(step), str(step + 1), '1/1', 'ks'))
+
+    def run():
+        # What RepairStatus.write serializes; the file write and fsync time the disk rather than the code
+        json.dumps(repair_status.to_dict())
+    return run
+
+
+def is_excluded():
+    options, _ = range_repair.build_option_parser().parse_args(
+        [arg for node in range(1, 21) for arg in ('--exclude-step', 'ks,{0},7'.format(node))])
+
+    def run():
+        for step in range(1000):
+            range_repair.is_excluded(options, 'a', 'b', step % 10, '12/256')
+    return run
+
+
+def parse_exclude_step():
+    parser = range_repair.build_option_parser()
+    parser.values = parser.get_default_values()
+    option = parser.get_option('--exclude-step')
+
+    def run():
+        parser.values.exclude_step = None
+        for step in range(1000):
+            range_repair.parse_exclude_step(option, '--exclude-step', 'ks,t1,12,{0}'.format(step), parser)
+    return run
+
+
+def build_benchmarks():
+    """
+    :rtype: list
+    :return: (name, function timed) of every benchmark.
+    """
+    return [
+        ('get_preceding_token', get_preceding_token(100000)),
+        ('sub_range_generator_murmur3_wrap', sub_range_generator(False)),
+        ('sub_range_generator_random_wrap', sub_range_generator(True)),
+        ('create_key', create_key()),
+        ('repair_task', repair_task()),
+        ('status_snapshot', status_snapshot()),
+        ('is_excluded', is_excluded()),
+        ('parse_exclude_step', parse_exclude_step()),
+    ]
+
+
+def measure(function, repeat):
+    """
+    Time a benchmark in turns with the calibration loop, each run long
+    enough to rise above timer noise, and keep the best run of each.
+
+    :rtype: tuple
+    :return: Seconds per call of function, and those seconds relative to the calibration loop.
+    """
+    timer = timeit.Timer(function)
+    calibration_timer = timeit.Timer(calibration)
+    number, _ = timer.autorange()
+    calibration_number, _ = calibration_timer.autorange()
+    best = best_calibration = float('inf')
+    for _ in range(repeat):
+        best = min(best, timer.timeit(number) / number)
+        best_calibration = min(best_calibration, calibration_timer.timeit(calibration_number) / calibration_number)
+    return best, best / best_calibration
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Micro-benchmarks of the controller's hot paths")
+    parser.add_argument('--threshold', type=float, default=0.3,
+                        help='Fail when a benchmark is this much slower than its baseline (0.3 is 30%%)')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each benchmark, the best one counts')
+    parser.add_argument('--only', nargs='+', help='Benchmarks to run')
+    parser.add_argument('--baselines', default=BASELINES, help='Baselines file')
+    parser.add_argument('--update', action='store_true', help='Store the results as the new baselines')
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    benchmarks = [(name, function) for name, function in build_benchmarks() if not args.only or name in args.only]
+    results = {}
+    regressions = []
+    print('{0:>34} {1:>10} {2:>10} {3:>10} {4:>8}'.format('benchmark', 'ms', 'relative', 'baseline', 'change'))
+    for name, function in benchmarks:
+        seconds, relative = measure(function, args.repeat)
+        baseline = baselines.get(name)
+        if baseline is not None and relative > baseline * (1 + args.threshold):
+            # Measure again before reporting a regression, in case the machine was busy
+            seconds, relative = min((seconds, relative), measure(function, args.repeat), key=lambda r: r[1])
+        results[name] = round(relative, 2)
+        if baseline is None:
+            change = ''
+        else:
+            change = '{0:+.0%}'.format(relative / baseline - 1)
+            if relative > baseline * (1 + args.threshold):
+                regressions.append(name)
+                change += ' REGRESSED'
+        print('{0:>34} {1:>10.3f} {2:>10.2f} {3:>10} {4:>8}'.format(
+            name, seconds * 1000, relative, '{0:.2f}'.format(baseline) if baseline else '-', change))
+
+    if args.update:
+        baselines.update(results)
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Stored baselines in {0}'.format(args.baselines))
+    elif regressions:
+        print('{0} regressed by more than {1:.0%}: {2}'.format(
+            len(regressions), args.threshold, ', '.join(regressions)))
+        sys.exit(1)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark cutting a host's primary ranges into steps.
+
+Builds a synthetic host with --vnodes primary ranges cut into --steps steps
+and times the ways the planner produces them: the per-boundary generator
+sub_range_generator used to be, the current one that strides the boundaries
+with range() and formats each of them once, the unformatted tokens that
+--compile-plan writes, and the whole plan that --status-format=compact keeps
+in memory, as a list of formatted steps and as PlannedSteps. Peak Python
+memory is measured with tracemalloc.
+
+Example:
+    ./bench_plan_generation.py --vnodes 256 --steps 10000
+"""
+from __future__ import print_function
+import os
+import random
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import range_repair
+
+
+def build_options(steps):
+    """
+    :param int steps: Steps per range.
+
+    :return: OptionParser result.
+    """
+    options, _ = range_repair.build_option_parser().parse_args(['-k', 'ks', '-s', str(steps)])
+    return options
+
+
+def build_container(vnodes, random_partitioner=False, seed=0):
+    """
+    Build a TokenContainer for a host of a synthetic ring without calling
+    nodetool.
+
+    :param int vnodes: Number of tokens owned by the host.
+    :param bool random_partitioner: Use RandomPartitioner tokens.
+    :param int seed: Random seed.
+
+    :rtype: range_repair.TokenContainer
+    """
+    rng = random.Random(seed)
+    tokens = range_repair.TokenContainer.__new__(range_repair.TokenContainer)
+    tokens.ring_tokens = [1] if random_partitioner else [-1]
+    tokens.check_for_MD5_tokens()
+    tokens.ring_tokens = sorted(rng.randint(tokens.RANGE_MIN, tokens.RANGE_MAX) for _ in range(vnodes * 4))
+    tokens.host_tokens = sorted(rng.sample(tokens.ring_tokens, vnodes))
+    tokens.host_token_count = vnodes
+    tokens.host_ranges = []
+    tokens.build_host_ranges()
+    return tokens
+
+
+def boundary_generator(tokens, start, stop, steps):
+    """
+    sub_range_generator as it was: every boundary computed by a Python
+    function call and formatted on its own.
+    """
+    layout = tokens.sub_range_layout(start, stop, steps)
+    if layout is None:
+        yield tokens.format(start), tokens.format(stop), 1
+        return
+    step_increment, upper_count, boundary_count = layout
+
+    def boundary(index):
+        if index < upper_count:
+            return start + index * step_increment
+        return tokens.RANGE_MIN + (index - upper_count) * step_increment
+
+    if boundary_count < 1:
+        return
+    previous = tokens.format(boundary(0))
+    for step in range(1, boundary_count):
+        current = tokens.format(boundary(step))
+        yield previous, current, step
+        previous = current
+    yield previous, tokens.format(stop), boundary_count
+
+
+def per_boundary(options, tokens):
+    return sum(1 for start, stop in tokens.host_ranges
+               for _ in boundary_generator(tokens, start, stop, options.steps))
+
+
+def strided(options, tokens):
+    return sum(1 for _ in range_repair.host_sub_ranges(options, tokens))
+
+
+def unformatted(options, tokens):
+    return sum(1 for _ in range_repair.host_sub_range_tokens(options, tokens))
+
+
+def step_list(options, tokens):
+    return len(list(range_repair.host_sub_ranges(options, tokens)))
+
+
+def planned_steps(options, tokens):
+    return len(range_repair.PlannedSteps(options, tokens))
+
+
+def bench(plan, options, tokens):
+    """
+    Time one way of planning and measure its peak memory.
+
+    :rtype: tuple
+    :return: seconds, peak MiB, number of steps
+    """
+    # tracemalloc slows allocation down, so time an untraced run
+    started = time.time()
+    plan(options, tokens)
+    seconds = time.time() - started
+    tracemalloc.start()
+    count = plan(options, tokens)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / 2.0 ** 20, count
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Benchmark cutting a host's primary ranges into steps")
+    parser.add_argument('--vnodes', type=int, default=256, help='Number of tokens owned by the host')
+    parser.add_argument('--steps', type=int, default=10000, help='Steps per range')
+    parser.add_argument('--random-partitioner', action='store_true', help='Use RandomPartitioner tokens')
+    args = parser.parse_args()
+
+    options = build_options(args.steps)
+    tokens = build_container(args.vnodes, args.random_partitioner)
+    print('{0:>14} {1:>10} {2:>12} {3:>10}'.format('plan', 'seconds', 'peak (MiB)', 'steps'))
+    for name, plan in (('per boundary', per_boundary), ('strided', strided), ('unformatted', unformatted),
+                       ('step list', step_list), ('PlannedSteps', planned_steps)):
+        print('{0:>14} {1:>10.2f} {2:>12.1f} {3:>10}'.format(name, *bench(plan, options, tokens)))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Benchmark the memory the repair status holds for the steps of a plan.
+
+Records --steps steps as pending and then runs each of them through start
+and success, the way a repair run does, with two representations of a step:
+the one the repair status used to keep, a dict with a timestamp string
+under a formatted key string, and RepairTask, a slotted object with interned
+names under a tuple key that is only formatted when the status file is
+written. Peak Python memory and the number of memory blocks still allocated
+at the end are measured with tracemalloc, and the time to build the status
+file snapshot from each is reported as well.
+
+Example:
+    ./bench_repair_task.py --steps 100000 --tables 1 10
+"""
+from __future__ import print_function
+import json
+import os
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import range_repair
+
+
+def synthetic_steps(count, tables):
+    """
+    Generate step arguments without a ring, every table of a sub-range in turn.
+
+    :param int count: Number of steps.
+    :param int tables: Number of tables.
+
+    :return: Iterator of (start, end, step, nodeposition, keyspace, column_families).
+    """
+    for i in range(count):
+        position = i // tables
+        yield (str(position * 10), str(position * 10 + 10), position % 100 + 1,
+               '{0}/{1}'.format(position // 100 + 1, count // tables // 100 + 1),
+               'keyspace', ['table{0}'.format(i % tables)])
+
+
+def build_repair_dict(cmd, step, start, end, nodeposition, keyspace, column_families):
+    """
+    Repair step dict as RepairStatus kept them before RepairTask.
+
+    :rtype: dict
+    """
+    return {
+        'time': datetime.now().isoformat(),
+        'step': step,
+        'start': start,
+        'end': end,
+        'nodeposition': nodeposition,
+        'keyspace': keyspace or '<all>',
+        'column_families': column_families or '<all>',
+        'cmd': cmd
+    }
+
+
+def run_dicts(steps):
+    """
+    Run steps through pending, start and success as dicts under string keys.
+
+    :return: Finished repairs.
+    """
+    pending, current, finished = {}, {}, {}
+    for start, end, step, nodeposition, keyspace, column_families in steps:
+        k = range_repair.create_key(step, start, end, nodeposition, keyspace, column_families)
+        pending[k] = build_repair_dict('', step, start, end, nodeposition, keyspace, column_families)
+    for repair in list(pending.values()):
+        args = (repair['step'], repair['start'], repair['end'], repair['nodeposition'], repair['keyspace'],
+                repair['column_families'])
+        k = range_repair.create_key(*args)
+        current[k] = build_repair_dict('nodetool repair', *args)
+        finished[k] = current.pop(k) or pending.pop(k)
+        pending.pop(k, None)
+    return finished
+
+
+def run_tasks(steps):
+    """
+    Run steps through pending, start and success as RepairTasks under tuple keys.
+
+    :return: Finished repairs.
+    """
+    pending, current, finished = {}, {}, {}
+    for start, end, step, nodeposition, keyspace, column_families in steps:
+        task = range_repair.RepairTask('', step, start, end, nodeposition, keyspace, column_families)
+        pending[task.key] = task
+    for repair in list(pending.values()):
+        task = range_repair.RepairTask('nodetool repair', repair.step, repair.start, repair.end,
+                                       repair.nodeposition, repair.keyspace, repair.column_families)
+        current[task.key] = task
+        finished[task.key] = current.pop(task.key) or pending.pop(task.key)
+        pending.pop(task.key, None)
+    return finished
+
+
+def snapshot_dicts(finished):
+    return json.dumps({'finished_repairs': finished})
+
+
+def snapshot_tasks(finished):
+    return json.dumps({'finished_repairs': range_repair.RepairStatus._repair_dicts(finished)})
+
+
+def bench(run, snapshot, count, tables):
+    """
+    Time one representation and measure its memory.
+
+    :rtype: tuple
+    :return: seconds, peak MiB, retained blocks, retained bytes per step, snapshot seconds
+    """
+    # tracemalloc slows allocation down, so time an untraced run
+    started = time.time()
+    finished = run(synthetic_steps(count, tables))
+    seconds = time.time() - started
+    started = time.time()
+    snapshot(finished)
+    snapshot_seconds = time.time() - started
+    del finished
+    tracemalloc.start()
+    finished = run(synthetic_steps(count, tables))
+    current, peak = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+    return seconds, peak / 2.0 ** 20, blocks, current // count, snapshot_seconds
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the memory the repair status holds for the steps of a plan')
+    parser.add_argument('--steps', type=int, default=100000, help='Number of steps')
+    parser.add_argument('--tables', type=int, nargs='+', default=[1, 10], help='Tables repaired one at a time')
+    args = parser.parse_args()
+
+    print('{0:>8} {1:>8} {2:>10} {3:>12} {4:>10} {5:>10} {6:>12}'.format(
+        'tables', 'step', 'seconds', 'peak (MiB)', 'blocks', 'bytes/step', 'snapshot (s)'))
+    for tables in args.tables:
+        for name, run, snapshot in (('dict', run_dicts, snapshot_dicts), ('task', run_tasks, snapshot_tasks)):
+            print('{0:>8} {1:>8} {2:>10.2f} {3:>12.1f} {4:>10} {5:>10} {6:>12.2f}'.format(
+                tables, name, *bench(run, snapshot, args.steps, tables)))
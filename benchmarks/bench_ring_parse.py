@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Benchmark parsing of `nodetool ring` output.
+
+Writes a synthetic multi-datacenter ring to a temporary file and feeds it to
+both the old parser, which buffered the whole of stdout and split it into
+lists, and the streaming TokenContainer.parse_ring_tokens, through `cat`.
+Peak Python memory is measured with tracemalloc.
+
+Example:
+    ./bench_ring_parse.py --lines 1000000 --datacenters 4
+"""
+from __future__ import print_function
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import range_repair
+
+ROW = '{address:<14} rack1       Up     Normal  1.2 TB          {owns:<19} {token}\n'
+
+
+def write_ring(f, lines, datacenters, vnodes, seed=0):
+    """
+    Write synthetic ring output.
+
+    :param f: Open file.
+    :param int lines: Number of token rows.
+    :param int datacenters: Number of datacenters.
+    :param int vnodes: Number of tokens per node.
+    :param int seed: Random seed.
+
+    :rtype: list
+    :return: Addresses of the nodes in the first datacenter.
+    """
+    rng = random.Random(seed)
+    per_dc = lines // datacenters
+    local_nodes = []
+    for dc in range(datacenters):
+        f.write('\nDatacenter: dc{0}\n==========\n'.format(dc))
+        f.write('Address        Rack        Status State   Load            Owns                Token\n')
+        for i in range(per_dc):
+            node = i % (per_dc // vnodes or 1)
+            address = '10.{0}.{1}.{2}'.format(dc, node // 256 % 256, node % 256)
+            if dc == 0 and i == node:
+                local_nodes.append(address)
+            f.write(ROW.format(address=address, owns='{0:.2f}%'.format(100.0 / datacenters),
+                               token=rng.randint(range_repair.TokenContainer.RANGE_MIN,
+                                                 range_repair.TokenContainer.RANGE_MAX)))
+    return local_nodes
+
+
+def build_container(datacenter, local_nodes):
+    """
+    Build an empty TokenContainer without calling nodetool.
+
+    :param datacenter: Datacenter to filter on, or None.
+    :param list local_nodes: Addresses of the nodes in the datacenter.
+
+    :rtype: range_repair.TokenContainer
+    :return: Token container.
+    """
+    tokens = range_repair.TokenContainer.__new__(range_repair.TokenContainer)
+    tokens.options, _ = range_repair.build_option_parser().parse_args([])
+    tokens.options.datacenter = datacenter
+    tokens.local_nodes = local_nodes
+    tokens.ring_tokens = []
+    return tokens
+
+
+def buffered_parse(tokens, filename):
+    """
+    The pre-streaming implementation: buffer stdout, split it, keep a list.
+    Local nodes are looked up in a set, as they are now, so that only the
+    buffering differs.
+
+    :param tokens: TokenContainer.
+    :param str filename: Ring output file.
+    """
+    success, _, stdout, stderr = range_repair.ProcessBackend().run('cat', filename)
+    local_nodes = frozenset(tokens.local_nodes)
+    for line in stdout.split("\n")[4:]:
+        segments = line.split()
+        if (len(segments) != 8) or (segments[3] == "Joining"):
+            continue
+        if tokens.options.datacenter and not segments[0] in local_nodes:
+            continue
+        tokens.ring_tokens.append(range_repair.longish(segments[-1]))
+    tokens.ring_tokens.sort()
+
+
+def streaming_parse(tokens, filename):
+    """
+    The current implementation.
+
+    :param tokens: TokenContainer.
+    :param str filename: Ring output file.
+    """
+    tokens.parse_ring_tokens(range_repair.ProcessBackend().stream('cat', filename))
+
+
+def bench(parse, filename, datacenter, local_nodes):
+    """
+    Time one parser and measure its peak memory.
+
+    :param parse: buffered_parse or streaming_parse.
+    :param str filename: Ring output file.
+    :param datacenter: Datacenter to filter on, or None.
+    :param list local_nodes: Addresses of the nodes in the datacenter.
+
+    :rtype: tuple
+    :return: seconds, peak MiB, number of tokens
+    """
+    # tracemalloc slows allocation down, so time an untraced run
+    tokens = build_container(datacenter, local_nodes)
+    started = time.time()
+    parse(tokens, filename)
+    seconds = time.time() - started
+    tokens = build_container(datacenter, local_nodes)
+    tracemalloc.start()
+    parse(tokens, filename)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / 2.0 ** 20, len(tokens.ring_tokens)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark nodetool ring parsing')
+    parser.add_argument('--lines', type=int, default=1000000, help='Number of token rows')
+    parser.add_argument('--datacenters', type=int, default=4, help='Number of datacenters')
+    parser.add_argument('--vnodes', type=int, default=256, help='Number of tokens per node')
+    parser.add_argument('--no-filter', action='store_true', help='Keep the tokens of every datacenter')
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile('w', suffix='.ring') as f:
+        local_nodes = write_ring(f, args.lines, args.datacenters, args.vnodes)
+        f.flush()
+        datacenter = None if args.no_filter else 'dc0'
+        print('{0:>10} {1:>10} {2:>12} {3:>10}'.format('parser', 'seconds', 'peak (MiB)', 'tokens'))
+        for name, parse in (('buffered', buffered_parse), ('streaming', streaming_parse)):
+            print('{0:>10} {1:>10.2f} {2:>12.1f} {3:>10}'.format(name, *bench(parse, f.name, datacenter, local_nodes)))
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark how fast the controller can push repair steps through its workers.
+
+Compares the old design, where every worker called a RepairStatus living in a
+multiprocessing manager process through a proxy and every task pickled the
+full options, with the current one, where workers receive the options once
+through the pool initializer and send status events to the parent over a
+queue. `true` is used as nodetool, so the numbers are pure controller
+overhead.
+
+Example:
+    ./bench_status_ipc.py --steps 2000 --workers 1 4 16
+"""
+from __future__ import print_function
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from multiprocessing.managers import BaseManager
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import range_repair
+
+
+class StatusManager(BaseManager):
+    pass
+StatusManager.register('RepairStatus', range_repair.RepairStatus)
+
+
+def build_options(workers, output_status):
+    """
+    Build range_repair options for a no-op nodetool.
+
+    :param int workers: Number of workers.
+    :param str output_status: Status filename.
+
+    :return: Parsed options.
+    """
+    options, _ = range_repair.build_option_parser().parse_args([
+        '--nodetool', 'true', '-k', 'bench', '-w', str(workers), '--max-sleep-before-run', '0',
+        '--output-status', output_status])
+    return options
+
+
+def synthetic_steps(count):
+    """
+    Generate step arguments without a ring.
+
+    :param int count: Number of steps.
+
+    :return: Iterator of (start, end, step, nodeposition).
+    """
+    for i in range(count):
+        yield str(i * 10), str(i * 10 + 10), i % 100 + 1, '{0}/{1}'.format(i // 100 + 1, count // 100 + 1)
+
+
+def add_pending(repair_status, options, steps):
+    """
+    Record every step as pending, as repair() does while planning.
+
+    :param repair_status: RepairStatus or proxy.
+    :param options: Parsed options.
+    :param steps: Iterator of step arguments.
+
+    :return: Iterator of step arguments.
+    """
+    for start, end, step, nodeposition in steps:
+        repair_status.add_pending_repair(range_repair.RepairTask(
+            '', step, start, end, nodeposition, options.keyspace, options.columnfamily))
+        yield start, end, step, nodeposition
+
+
+def run_manager(options, count):
+    """
+    Run steps with the manager proxy design.
+
+    :param options: Parsed options.
+    :param int count: Number of steps.
+    """
+    manager = StatusManager()
+    manager.start()
+    repair_status = manager.RepairStatus()
+    repair_status.start(options)
+    worker_pool = multiprocessing.Pool(options.workers)
+    results = [worker_pool.apply_async(range_repair.repair_range, (options,) + step + (repair_status,))
+               for step in add_pending(repair_status, options, synthetic_steps(count))]
+    for r in results:
+        r.get()
+    repair_status.finish()
+    worker_pool.close()
+    worker_pool.join()
+    manager.shutdown()
+
+
+def run_queue(options, count):
+    """
+    Run steps with the worker to parent event queue design.
+
+    :param options: Parsed options.
+    :param int count: Number of steps.
+    """
+    repair_status = range_repair.RepairStatus()
+    repair_status.start(options)
+    range_repair.run_repair_steps(options, add_pending(repair_status, options, synthetic_steps(count)), repair_status)
+    repair_status.finish()
+
+
+def bench(runner, workers, count):
+    """
+    Time one design.
+
+    :param runner: run_manager or run_queue.
+    :param int workers: Number of workers.
+    :param int count: Number of steps.
+
+    :rtype: float
+    :return: Tasks per second.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        options = build_options(workers, os.path.join(tmpdir, 'status.json'))
+        started = time.time()
+        runner(options, count)
+        return count / (time.time() - started)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark repair step dispatch and status reporting')
+    parser.add_argument('--steps', type=int, default=2000, help='Number of steps to run')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16], help='Worker counts to benchmark')
+    args = parser.parse_args()
+
+    print('{0:>8} {1:>16} {2:>16}'.format('workers', 'manager (t/s)', 'queue (t/s)'))
+    for workers in args.workers:
+        print('{0:>8} {1:>16.1f} {2:>16.1f}'.format(
+            workers, bench(run_manager, workers, args.steps), bench(run_queue, workers, args.steps)))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark repair planning time against large token rings.
+
+Builds a synthetic Murmur3 ring, picks a host that owns --vnodes of its tokens
+and measures how long it takes to work out the primary range of every host
+token, using both the old linear scan and the bisect-indexed TokenContainer.
+
+Example:
+    ./bench_token_ring.py --sizes 10000 100000 1000000
+"""
+from __future__ import print_function
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import range_repair
+
+
+def build_container(ring_size, vnodes, seed=0):
+    """
+    Build a TokenContainer for a synthetic ring without calling nodetool.
+
+    :param int ring_size: Number of tokens in the ring.
+    :param int vnodes: Number of tokens owned by the host.
+    :param int seed: Random seed.
+
+    :rtype: range_repair.TokenContainer
+    :return: Populated token container.
+    """
+    rng = random.Random(seed)
+    tokens = range_repair.TokenContainer.__new__(range_repair.TokenContainer)
+    tokens.ring_tokens = sorted(rng.randint(range_repair.TokenContainer.RANGE_MIN, range_repair.TokenContainer.RANGE_MAX)
+                                for _ in range(ring_size))
+    tokens.host_tokens = sorted(rng.sample(tokens.ring_tokens, vnodes))
+    tokens.host_token_count = vnodes
+    tokens.host_ranges = []
+    return tokens
+
+
+def linear_preceding_token(ring_tokens, token):
+    """
+    The pre-index implementation of TokenContainer.get_preceding_token.
+
+    :param list ring_tokens: Sorted ring tokens.
+    :param int token: Reference token.
+
+    :rtype: int
+    :return: Preceding token.
+    """
+    for i in reversed(ring_tokens):
+        if token > i:
+            return i
+    return ring_tokens[-1]
+
+
+def bench(ring_size, vnodes):
+    """
+    Time planning for one ring size.
+
+    :param int ring_size: Number of tokens in the ring.
+    :param int vnodes: Number of tokens owned by the host.
+
+    :rtype: tuple
+    :return: linear seconds, indexed seconds
+    """
+    tokens = build_container(ring_size, vnodes)
+
+    started = time.time()
+    linear = [(linear_preceding_token(tokens.ring_tokens, t), t) for t in tokens.host_tokens]
+    linear_seconds = time.time() - started
+
+    started = time.time()
+    tokens.build_host_ranges()
+    indexed_seconds = time.time() - started
+
+    if linear != tokens.host_ranges:
+        raise Exception('Indexed ranges differ from linear scan for ring size {0}'.format(ring_size))
+    return linear_seconds, indexed_seconds
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark primary range planning')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='Ring sizes to benchmark')
+    parser.add_argument('--vnodes', type=int, default=256, help='Number of tokens owned by the host')
+    args = parser.parse_args()
+
+    print('{0:>10} {1:>12} {2:>12} {3:>10}'.format('ring', 'linear (s)', 'indexed (s)', 'speedup'))
+    for size in args.sizes:
+        linear_seconds, indexed_seconds = bench(size, args.vnodes)
+        print('{0:>10} {1:>12.4f} {2:>12.6f} {3:>9.0f}x'.format(
+            size, linear_seconds, indexed_seconds, linear_seconds / max(indexed_seconds, 1e-9)))
@@ -5,6 +5,8 @@ from setuptools import setup
 setup (
     setup_requires=['pbr', 'mock'],
     pbr=True,
+    # range_repair.py uses async def and concurrent.futures initializers
+    python_requires='>=3.7',
     package_dir={ 'cassandra_range_repair':'src' },
     packages=['cassandra_range_repair' ],
     test_suite='tests',
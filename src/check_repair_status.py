@@ -3,10 +3,12 @@
 Script to check repair status on multiple nodes.
 
 Uses SSH to connect to nodes and look for range_repair.py status output file. Aggregates status information for all
-nodes.
+nodes. With --consolidated, reads the local status file of a range_repair.py --cluster run instead, which already holds
+the status of every node.
 
 Example:
     ./check_repair_status.py status.json cass-1.example.com cass-2.example.com cass-3.example.com
+    ./check_repair_status.py --consolidated cluster_status.json
 """
 import json
 import os
@@ -31,13 +33,14 @@ ssh = paramiko.SSHClient()
 ssh_config = paramiko.SSHConfig()
 
 
-def build_cluster(nodes, filename, hang_timeout=DEFAULT_HANG_TIMEOUT):
+def build_cluster(nodes, filename, hang_timeout=DEFAULT_HANG_TIMEOUT, consolidated=None):
     """
     Build cluster status object.
 
     :param list nodes: List of nodes to check.
     :param str filename: Status filename.
     :param int hang_timeout: Repair hang timeout in seconds.
+    :param dict consolidated: Status of a range_repair.py --cluster run, read node statuses from it instead of SSH.
 
     :rtype: dict
     :return: Cluster status object.
@@ -57,8 +60,13 @@ def build_cluster(nodes, filename, hang_timeout=DEFAULT_HANG_TIMEOUT):
 
     for host in nodes:
         try:
-            status_str = ssh_get_file(host, filename)
-            status = json.loads(status_str)
+            if consolidated is not None:
+                status = consolidated.get('nodes', {}).get(host)
+                if status is None:
+                    raise Exception('No status for {0} in {1}'.format(host, filename))
+            else:
+                status_str = ssh_get_file(host, filename)
+                status = json.loads(status_str)
             cluster['nodes'][host] = build_node(status, hang_timeout)
             cluster['nodes'][host]['raw'] = status
         except Exception as e:
@@ -162,21 +170,22 @@ def build_node(node_status, hang_timeout=DEFAULT_HANG_TIMEOUT):
     :return: Node status object.
     """
     num_failed = len(node_status['failed_repairs'])
-    started = datetime.strptime(node_status['started'], '%Y-%m-%dT%H:%M:%S.%f')
-    updated = datetime.strptime(node_status['updated'], '%Y-%m-%dT%H:%M:%S.%f')
+    started = datetime.fromisoformat(node_status['started'])
+    updated = datetime.fromisoformat(node_status['updated'])
     if node_status['finished']:
         # Hacky
         node_position = '256/256'
         finished_on = node_status['finished']
         current_step_time = None
-        finished = datetime.strptime(node_status['finished'], '%Y-%m-%dT%H:%M:%S.%f')
+        finished = datetime.fromisoformat(node_status['finished'])
         total_repair_time = (finished - started).total_seconds()
         if num_failed > 0:
             status = STATUS_FINISHED_WITH_ERRORS
         else:
             status = STATUS_FINISHED
     else:
-        node_position = node_status['current_repair']['nodeposition']
+        # Steps of a range_repair.py --cluster run are prefixed with their host
+        node_position = node_status['current_repair']['nodeposition'].rpartition(':')[2]
         current_step_time = (datetime.utcnow() - updated).total_seconds()
         finished_on = None
         total_repair_time = None
@@ -189,7 +198,7 @@ def build_node(node_status, hang_timeout=DEFAULT_HANG_TIMEOUT):
     percentage_complete = int(float(current_vnode - num_failed) / float(total_vnodes) * 100)
     # Calculate average time taken to repair 1 vnode
     current_duration = (updated - started).total_seconds()
-    avg_vnode_time = current_duration / float(current_vnode - 1)
+    avg_vnode_time = current_duration / float(max(1, current_vnode - 1))
     return {
         'status': status,
         'nodeposition': node_position,
@@ -274,8 +283,8 @@ def write_csv(data, file_=sys.stdout):
         has_errors = int(host['num_failed'] > 0)
         is_hung = int(host['status'] == STATUS_HUNG)
         current_vnode = int(host['nodeposition'].split('/')[0])
-        started = datetime.strptime(host['started'], '%Y-%m-%dT%H:%M:%S.%f')
-        finished = datetime.strptime(host['finished'], '%Y-%m-%dT%H:%M:%S.%f') if host['finished'] else None
+        started = datetime.fromisoformat(host['started'])
+        finished = datetime.fromisoformat(host['finished']) if host['finished'] else None
         # Calculate totals
         totals['in_progress'] += in_progress
         totals['has_errors'] += has_errors
@@ -313,8 +322,11 @@ if __name__ == '__main__':
     parser = ArgumentParser(description='Check range repair status on multiple nodes')
     parser.add_argument('filename',
                         help='Path to range repair status output file')
-    parser.add_argument('nodes', nargs='+',
-                        help='List of nodes to check repair status on')
+    parser.add_argument('nodes', nargs='*',
+                        help='List of nodes to check repair status on [default with --consolidated: every node in the '
+                             'status file]')
+    parser.add_argument('--consolidated', action='store_true', default=False,
+                        help='Read the status of every node from a local range_repair.py --cluster status file')
     parser.add_argument('--hang-timeout', dest='hang_timeout', default=DEFAULT_HANG_TIMEOUT,
                         help='Timeout in seconds to assume repair has hung')
     parser.add_argument('--format', choices=['summary', 'csv', 'json'], default='json',
@@ -324,14 +336,23 @@ if __name__ == '__main__':
 
     logging.basicConfig()
 
-    # Load SSH
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    user_config_file = os.path.expanduser('~/.ssh/config')
-    if os.path.exists(user_config_file):
-        with open(user_config_file) as f:
-            ssh_config.parse(f)
+    if args.consolidated:
+        with open(args.filename) as f:
+            consolidated = json.load(f)
+        cluster = build_cluster(args.nodes or consolidated.get('hosts') or [], args.filename, args.hang_timeout,
+                                consolidated)
+    else:
+        if not args.nodes:
+            parser.error('nodes are required without --consolidated')
+
+        # Load SSH
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        user_config_file = os.path.expanduser('~/.ssh/config')
+        if os.path.exists(user_config_file):
+            with open(user_config_file) as f:
+                ssh_config.parse(f)
 
-    cluster = build_cluster(args.nodes, args.filename, args.hang_timeout)
+        cluster = build_cluster(args.nodes, args.filename, args.hang_timeout)
 
     if args.format == 'summary':
         write_summary(cluster)
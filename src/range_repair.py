@@ -5,29 +5,52 @@ This script will allow for smaller repairs of Cassandra ranges.
 Source: https://github.com/onzra/cassandra_range_repair
 """
 from __future__ import print_function
+import ast
+import asyncio
+import base64
 import collections
+import itertools
+import concurrent.futures
+import copy
+import cProfile
+import functools
+import hashlib
 import json
 import logging
 import logging.handlers
+import mmap
 import multiprocessing
 import os
 import platform
+import pstats
 import re
+import shlex
+import signal
 import six
+import socket
 import stat
+import struct
 import subprocess
 import sys
+import tempfile
+import threading
 import time
+import zlib
+from array import array
+from bisect import bisect_left
 from datetime import datetime
-from multiprocessing.managers import BaseManager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from optparse import OptionParser, OptionGroup
-from multiprocessing import Lock
 import random
 
-write_status_lock = Lock()
-
 longish = six.integer_types[-1]
 
+# Keyspaces with LocalStrategy replication, which nodetool repair skips.
+LOCAL_KEYSPACES = ('system', 'system_schema')
+
+# A TokenRange(...) entry of nodetool describering output
+DESCRIBERING_RANGE = re.compile(r'end_token:\s*(-?\d+),\s*endpoints:\s*\[([^\]]*)\]')
+
 ExponentialBackoffRetryerConfig = collections.namedtuple(
     'ExponentialBackoffRetryerConfig', (
         'max_tries',
@@ -37,6 +60,17 @@ ExponentialBackoffRetryerConfig = collections.namedtuple(
     )
 )
 
+# Number of journal records RepairStatus appends before compacting them into
+# a fresh status snapshot.
+DEFAULT_STATUS_COMPACT_INTERVAL = 1000
+
+# Minimum number of milliseconds between two rewrites of the status snapshot.
+DEFAULT_STATUS_FLUSH_INTERVAL = 1000
+
+# Upper bounds, in seconds, of the buckets of the phase timing histograms.
+# Anything slower lands in one last bucket without a bound.
+TIMING_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
 
 def create_key(step, start, end, nodeposition, keyspace, column_families):
     """
@@ -51,6 +85,83 @@ def create_key(step, start, end, nodeposition, keyspace, column_families):
     return key
 
 
+def format_timestamp(timestamp):
+    """
+    Format a time.time() timestamp the way the status file has them.
+
+    :param timestamp: Seconds since the epoch, or a timestamp formatted already.
+
+    :rtype: str
+    :return: ISO 8601 timestamp.
+    """
+    if isinstance(timestamp, float):
+        return datetime.fromtimestamp(timestamp).isoformat()
+    return timestamp
+
+
+def format_nodeposition(count, total, host=None):
+    """
+    Build the node position of a step: which of the host's ranges it is in.
+    Steps of a --cluster repair are prefixed with the host they repair.
+
+    :param int count: Range number, from 1.
+    :param int total: Number of ranges.
+    :param str host: Host, for a --cluster repair.
+
+    :rtype: str
+    :return: Node position.
+    """
+    nodeposition = "{count}/{total}".format(count=count, total=total)
+    if host:
+        return host + ':' + nodeposition
+    return nodeposition
+
+
+def split_nodeposition(nodeposition):
+    """
+    Split a node position into its host and position.
+
+    :param str nodeposition: Node position.
+
+    :rtype: tuple
+    :return: Host, or None if the node position has none, and position.
+    """
+    host, _, position = nodeposition.rpartition(':')
+    return host or None, position
+
+
+def token_array(tokens):
+    """
+    Store tokens compactly: in a packed array of 64-bit integers when they
+    fit, as Murmur3 tokens do, and in a list for 128-bit RandomPartitioner
+    tokens.
+
+    :param tokens: Iterable of tokens.
+
+    :rtype: array or list
+    :return: Tokens, in the same order.
+    """
+    tokens = list(tokens)
+    try:
+        return array('q', tokens)
+    except OverflowError:
+        return tokens
+
+
+def numbered_pairs(bounds):
+    """
+    Pair every bound with the next one, numbering the pairs from 1.  Each
+    bound is only taken from the iterable once.
+
+    :param bounds: Iterable of bounds.
+
+    :return: Iterator of (bound, next bound, number).
+    """
+    starts, ends = itertools.tee(bounds)
+    next(ends, None)
+    return zip(starts, ends, itertools.count(1))
+
+
 class ExponentialBackoffRetryer:
 
     def __init__(self, config, success_checker, executor, sleeper=lambda x: time.sleep(x)):
@@ -66,10 +177,15 @@ class ExponentialBackoffRetryer:
         self.success_checker = success_checker
         self.executor = executor
         self.sleeper = sleeper
+        # Calls made and seconds slept by the last run
+        self.tries = 0
+        self.slept = 0
 
     def __call__(self, *args, **kwargs):
         next_sleep = self.config.initial_sleep
+        self.tries, self.slept = 0, 0
         for i in range(self.config.max_tries):
+            self.tries += 1
             result = self.executor(*args, **kwargs)
             if self.success_checker(result):
                 return result
@@ -79,9 +195,46 @@ class ExponentialBackoffRetryer:
                 if not last_iteration:
                     # Not reason to sleep if we aren't about to retry.
                     logging.info("Sleeping %d seconds until retrying again.", next_sleep)
-                    self.sleeper(next_sleep
-                                 if self.config.max_sleep <= 0
-                                 else min(next_sleep, self.config.max_sleep))
+                    self.sleeper(self.capped_sleep(next_sleep))
+                    self.slept += self.capped_sleep(next_sleep)
+                    next_sleep *= self.config.sleep_factor
+                else:
+                    logging.warning("Giving up execution. Failed too many times.")
+
+        return result
+
+    def capped_sleep(self, seconds):
+        """Apply the configured max_sleep to a sleep time.
+
+        Params:
+        seconds -- uncapped number of seconds to sleep.
+        """
+        return seconds if self.config.max_sleep <= 0 else min(seconds, self.config.max_sleep)
+
+
+class AsyncExponentialBackoffRetryer(ExponentialBackoffRetryer):
+    """ExponentialBackoffRetryer for coroutines: both the executor and the
+    sleeper are awaited, so waiting for a retry does not block the event loop.
+    """
+
+    def __init__(self, config, success_checker, executor, sleeper=asyncio.sleep):
+        ExponentialBackoffRetryer.__init__(self, config, success_checker, executor, sleeper)
+
+    async def __call__(self, *args, **kwargs):
+        next_sleep = self.config.initial_sleep
+        self.tries, self.slept = 0, 0
+        for i in range(self.config.max_tries):
+            self.tries += 1
+            result = await self.executor(*args, **kwargs)
+            if self.success_checker(result):
+                return result
+            else:
+                logging.warning("Execution failed.")
+                last_iteration = (i == self.config.max_tries-1)
+                if not last_iteration:
+                    logging.info("Sleeping %d seconds until retrying again.", next_sleep)
+                    await self.sleeper(self.capped_sleep(next_sleep))
+                    self.slept += self.capped_sleep(next_sleep)
                     next_sleep *= self.config.sleep_factor
                 else:
                     logging.warning("Giving up execution. Failed too many times.")
@@ -105,32 +258,127 @@ class TokenContainer:
         self.local_nodes = []
         self.host_tokens = []
         self.ring_tokens = []
+        self.host_ranges = []
         self.host_token_count = -1
-        self.get_local_nodes()
-        self.get_host_tokens()
-        self.get_ring_tokens()
+        # With --cluster or --replica-aware, the ring members and the index
+        # into ring_nodes of the owner of every ring token
+        self.ring_nodes = []
+        self.ring_owners = []
+        self.discovery_timings = {}
+        cache = TopologyCache.from_options(options)
+        cache_name = 'cluster_tokens' if self.tracks_owners() else 'tokens'
+        if not (cache and self.load_topology(cache, cache_name)):
+            self.discover_topology()
+            if cache:
+                cached = {'local_nodes': self.local_nodes,
+                          'host_tokens': self.host_tokens,
+                          'ring_tokens': list(self.ring_tokens)}
+                if self.tracks_owners():
+                    cached['ring_nodes'] = self.ring_nodes
+                    cached['ring_owners'] = list(self.ring_owners)
+                cache.put(cache_name, cached)
         self.check_for_MD5_tokens()
+        self.build_host_ranges()
+        if options.coalesce_ranges:
+            self.coalesce_host_ranges(options.steps)
+        return
+
+    def tracks_owners(self):
+        """Whether the node owning each ring token is needed, to repair other
+        hosts or to know the replicas of every range.
+        :returns: bool
+        """
+        return self.options.cluster or self.options.replica_aware
+
+    def load_topology(self, cache, name='tokens'):
+        """Use the token lists from the topology cache, if it has fresh ones.
+        :param TopologyCache cache: Topology cache.
+        :param name: Cache entry.
+        :returns: True if the cached tokens were used.
+        """
+        cached = cache.get(name)
+        if cached is None:
+            return False
+        self.local_nodes = cached['local_nodes']
+        self.host_tokens = cached['host_tokens']
+        self.ring_tokens = token_array(cached['ring_tokens'])
+        self.ring_nodes = cached.get('ring_nodes', [])
+        self.ring_owners = cached.get('ring_owners', [])
+        self.host_token_count = len(self.host_tokens)
+        logging.info("Using cached topology: {0} host tokens, {1} ring tokens".format(
+            self.host_token_count, len(self.ring_tokens)))
+        return True
+
+    def discover_topology(self):
+        """Run the gossipinfo, info and ring discovery commands concurrently.
+        The ring output is parsed as it arrives, which needs the local nodes
+        for datacenter filtering, so it is only read once gossipinfo is done.
+        :returns: None
+        """
+        started = time.time()
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            gossipinfo = executor.submit(self.timed_phase, 'gossipinfo', self.fetch_local_nodes)
+            info = executor.submit(self.timed_phase, 'info', self.fetch_host_tokens)
+            ring = self.fetch_ring_tokens()
+            try:
+                self.parse_local_nodes(gossipinfo.result())
+                self.timed_phase('ring', lambda: self.parse_ring_tokens(ring), started)
+            finally:
+                ring.close()
+            self.parse_host_tokens(info.result())
+        self.discovery_timings['total'] = time.time() - started
+        logging.info("Topology discovery took {0:.3f}s".format(self.discovery_timings['total']))
         return
 
+    def timed_phase(self, name, function, started=None):
+        """Run one discovery phase and log how long it took.
+        :param name: Phase name.
+        :param function: Callable running the phase.
+        :param started: When the phase started, if before function is called.
+        :returns: Result of function.
+        """
+        if started is None:
+            started = time.time()
+        try:
+            return function()
+        finally:
+            self.discovery_timings[name] = time.time() - started
+            logging.info("Discovery phase {0} took {1:.3f}s".format(name, self.discovery_timings[name]))
+
     def get_local_nodes(self):
         '''In a multi-DC environment, it is important to *only* consider tokens on
         members of the local ring.
 
         '''
+        self.parse_local_nodes(self.fetch_local_nodes())
+        return
+
+    def fetch_local_nodes(self):
+        """Run nodetool gossipinfo, if a datacenter was specified
+        :returns: gossipinfo output, or None
+        """
         if not self.options.datacenter:
             logging.debug("No datacenter specified, all ring members' tokens will be considered")
-            return
+            return None
         logging.debug("Determining local ring members")
         cmd = [self.options.nodetool, "-h", self.options.host, "-p", self.options.port, "gossipinfo"]
         success, _, stdout, stderr = run_command(*cmd)
 
         if not success:
             raise Exception("Died in get_ring_tokens because: " + stderr)
+        return stdout
 
+    def parse_local_nodes(self, stdout):
+        """Find the members of the local datacenter in nodetool gossipinfo output
+        :param stdout: gossipinfo output, or None if no datacenter was specified
+        :returns: None
+        """
+        if stdout is None:
+            return
         # This is a really well-specified value.  If the format of the
         # output of 'nodetool gossipinfo' changes, this will have to be
         # revisited.
-        search_regex = "DC(?::\d+)?:{datacenter}".format(datacenter=self.options.datacenter)
+        search_regex = r"DC(?::\d+)?:{datacenter}".format(datacenter=self.options.datacenter)
         for paragraph in stdout.split("/"):
             if not re.search(search_regex, paragraph):
                 continue
@@ -156,15 +404,35 @@ class TokenContainer:
         """Gets the token information for the ring
         :returns: None
         """
+        ring = self.fetch_ring_tokens()
+        try:
+            self.parse_ring_tokens(ring)
+        finally:
+            ring.close()
+        return
+
+    def fetch_ring_tokens(self):
+        """Start nodetool ring
+        :returns: iterator over the lines of ring output
+        """
         logging.info("running nodetool ring, this will take a little bit of time")
         cmd = [self.options.nodetool, "-h", self.options.host, "-p", self.options.port, "ring"]
-        success, _, stdout, stderr = run_command(*cmd)
-
-        if not success:
-            raise Exception("Died in get_ring_tokens because: " + stderr)
+        return stream_command(*cmd)
 
+    def parse_ring_tokens(self, lines):
+        """Build the sorted ring token list from nodetool ring output.  Only
+        the tokens are kept, in a packed array unless they are too large for
+        64 bits.
+        :param lines: iterable over the lines of ring output
+        :returns: None
+        """
         logging.debug("ring tokens found, creating ring token list...")
-        for line in stdout.split("\n")[4:]:
+        tokens = array('q')
+        local_nodes = frozenset(self.local_nodes)
+        keep_owners = self.tracks_owners()
+        owners = array('i')
+        node_index = collections.OrderedDict()
+        for line in itertools.islice(lines, 4, None):
             segments = line.split()
             # Filter tokens from joining nodes
             if (len(segments) != 8) or (segments[3] == "Joining"):
@@ -186,13 +454,27 @@ class TokenContainer:
 
             # If a datacenter has been specified, filter nodes that are in
             # different datacenters.
-            if self.options.datacenter and not segments[0] in self.local_nodes:
+            if self.options.datacenter and not segments[0] in local_nodes:
                 logging.debug("Discarding node/token %s/%s", segments[0], segments[-1])
                 continue
-            self.ring_tokens.append(longish(segments[-1]))
+            token = longish(segments[-1])
+            try:
+                tokens.append(token)
+            except OverflowError:
+                # RandomPartitioner tokens do not fit in 64 bits
+                tokens = list(tokens)
+                tokens.append(token)
+            if keep_owners:
+                owners.append(node_index.setdefault(segments[0], len(node_index)))
             # Excessive logging
             # logging.debug(str(self.ring_tokens))
-        self.ring_tokens.sort()
+        if keep_owners:
+            order = sorted(range(len(tokens)), key=tokens.__getitem__)
+            self.ring_tokens = token_array(tokens[i] for i in order)
+            self.ring_owners = array('i', (owners[i] for i in order))
+            self.ring_nodes = list(node_index)
+        else:
+            self.ring_tokens = token_array(sorted(tokens))
         logging.info("Found {0} tokens".format(len(self.ring_tokens)))
         logging.debug(self.ring_tokens)
         return
@@ -201,12 +483,25 @@ class TokenContainer:
         """Gets the tokens ranges for the target host
         :returns: None
         """
+        self.parse_host_tokens(self.fetch_host_tokens())
+        return
+
+    def fetch_host_tokens(self):
+        """Run nodetool info -T
+        :returns: info output
+        """
         cmd = [self.options.nodetool, "-h", self.options.host, "-p", self.options.port, "info", "-T"]
         success, _, stdout, stderr = run_command(*cmd)
         if not success or stdout.find("Token") == -1:
             logging.error(stdout)
             raise Exception("Died in get_host_tokens, success: %d, stderr: %s" % (success, stderr))
+        return stdout
 
+    def parse_host_tokens(self, stdout):
+        """Build the sorted host token list from nodetool info -T output
+        :param stdout: info output
+        :returns: None
+        """
         for line in stdout.split("\n"):
             if not line.startswith("Token"): continue
             parts = line.split()
@@ -227,12 +522,138 @@ class TokenContainer:
         :param token: Reference token
         :returns: The token that falls immediately before the argument token
         """
-        for i in reversed(self.ring_tokens):
-            if token > i:
-                return i
-        # token is the smallest value in the ring.  Since the rings wrap around,
-        # return the last value.
-        return self.ring_tokens[-1]
+        # ring_tokens is kept sorted, so the insertion point of the token is
+        # one past the token that precedes it.
+        index = bisect_left(self.ring_tokens, token)
+        if index == 0:
+            # token is the smallest value in the ring.  Since the rings wrap
+            # around, return the last value.
+            return self.ring_tokens[-1]
+        return self.ring_tokens[index - 1]
+
+    def build_host_ranges(self):
+        """Precompute the primary range of every host token.  Each host token
+        is responsible for the part of the ring between the preceding ring
+        token (exclusive) and itself (inclusive).
+        :returns: None
+        """
+        self.host_ranges = [(self.get_preceding_token(token), token) for token in self.host_tokens]
+        return
+
+    def for_host(self, address):
+        """Token container for another member of the ring, with its tokens
+        taken from the ring owners found by --cluster.
+        :param address: Address of the ring member.
+        :returns: TokenContainer
+        """
+        tokens = copy.copy(self)
+        index = self.ring_nodes.index(address)
+        tokens.host_tokens = [token for token, owner in zip(self.ring_tokens, self.ring_owners) if owner == index]
+        tokens.host_token_count = len(tokens.host_tokens)
+        tokens.build_host_ranges()
+        if self.options.coalesce_ranges:
+            tokens.coalesce_host_ranges(self.options.steps)
+        return tokens
+
+    def coalesce_host_ranges(self, steps):
+        """Merge primary ranges that follow each other in the ring, which
+        happens when the host owns consecutive ring tokens, so that each run
+        of them is split into steps as a single range.  Ranges are never
+        merged into one covering the full ring.
+        :param steps: number of sub-ranges each range is split into
+        :returns: number of repair sessions saved
+        """
+        merged = []
+        for start, end in self.host_ranges:
+            if merged and merged[-1][1] == start and merged[-1][0] != end:
+                merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        # The last range may run on into the first one, across the wrap.
+        if len(merged) > 1 and merged[-1][1] == merged[0][0] and merged[-1][0] != merged[0][1]:
+            merged[0] = (merged.pop()[0], merged[0][1])
+
+        sessions_before = sum(self.count_sub_ranges(start, end, steps) for start, end in self.host_ranges)
+        sessions_after = sum(self.count_sub_ranges(start, end, steps) for start, end in merged)
+        logging.info("Coalesced {0} host ranges into {1}, saving {2} of {3} repair sessions".format(
+            len(self.host_ranges), len(merged), sessions_before - sessions_after, sessions_before))
+        self.host_ranges = merged
+        return sessions_before - sessions_after
+
+    def count_sub_ranges(self, start, stop, steps):
+        """Count the sub-ranges sub_range_generator creates for a range
+        :param start: beginning token in the range
+        :param stop: first token of the next range
+        :param steps: number of sub-ranges to create
+        :returns: number of sub-ranges
+        """
+        layout = self.sub_range_layout(start, stop, steps)
+        return 1 if layout is None else layout[2]
+
+    def sub_range_layout(self, start, stop, steps):
+        """Work out how sub_range_generator cuts a range, without generating
+        the sub-ranges.
+        :param start: beginning token in the range
+        :param stop: first token of the next range
+        :param steps: number of sub-ranges to create
+        :returns: step increment, number of boundaries before the range wraps
+                  around the end of the ring and number of sub-ranges, or None
+                  if the range is repaired as a single step
+        """
+        # This first case works for all but the highest-valued token.
+        if stop > start:
+            if not start+steps < stop+1:
+                return None
+            step_increment = ((stop - start) // steps)
+            # We would have an extra, tiny step in the event the range
+            # is not evenly divisible by the number of steps.  This may
+            # give us one larger step at the end.
+            return step_increment, steps, steps
+        # This is the wrap-around case
+        distance = (self.RANGE_MAX - start) + (stop - self.RANGE_MIN)
+        if not distance > steps-1:
+            return None
+        step_increment = distance // steps
+        # Boundaries run from start up to RANGE_MAX, then restart at
+        # RANGE_MIN and run up to stop, each leg in step_increment strides.
+        upper_count = max(0, (self.RANGE_MAX - start + step_increment - 1) // step_increment)
+        lower_count = max(0, (stop - self.RANGE_MIN + step_increment - 1) // step_increment)
+        boundary_count = upper_count + lower_count
+        if boundary_count > steps-1:
+            # Drop the last boundary so the final step runs up to stop.
+            boundary_count -= 1
+        return step_increment, upper_count, max(0, boundary_count)
+
+    def sub_range_bounds(self, start, stop, steps):
+        """Every token at which sub_range_generator cuts a range, from start
+        to stop.  The bounds are strided in two legs, up to the end of the
+        ring and on from its start, that range() computes in C as they are
+        consumed, for big RandomPartitioner tokens as well as Murmur3 ones.
+        :param start: beginning token in the range
+        :param stop: first token of the next range
+        :param steps: number of sub-ranges to create
+        :returns: iterable of tokens
+        """
+        layout = self.sub_range_layout(start, stop, steps)
+        if layout is None:
+            return start, stop
+        step_increment, upper_count, boundary_count = layout
+        upper_count = min(upper_count, boundary_count)
+        lower_count = boundary_count - upper_count
+        return itertools.chain(
+            range(start, start + upper_count * step_increment, step_increment),
+            range(self.RANGE_MIN, self.RANGE_MIN + lower_count * step_increment, step_increment),
+            (stop,))
+
+    def sub_range_tokens(self, start, stop, steps):
+        """Generate the sub-ranges of sub_range_generator with their tokens
+        left unformatted.
+        :param start: beginning token in the range
+        :param stop: first token of the next range
+        :param steps: number of sub-ranges to create
+        :returns: start token, end token, current step number
+        """
+        return numbered_pairs(self.sub_range_bounds(start, stop, steps))
 
     def sub_range_generator(self, start, stop, steps=100):
         """Generate $step subranges between $start and $stop
@@ -242,510 +663,3268 @@ class TokenContainer:
         :returns: string-formatted start value, string-formatted end value, current step number
         There is special-case handling for when there are more steps than there
         are keys in the range: just return the start and stop values.
+
+        Boundaries are computed and formatted as they are consumed, each one
+        once, so memory use does not grow with the number of steps.
         """
-        step = 0
-        # This first case works for all but the highest-valued token.
-        if stop > start:
-            if start+steps < stop+1:
-                step_increment = ((stop - start) // steps)
-                # We would have an extra, tiny step in the event the range
-                # is not evenly divisible by the number of steps.  This may
-                # give us one larger step at the end.
-                step_list = [self.format(x) for x in range(start, stop, step_increment)][0:steps]
-            else:
-                step += 1
-                yield self.format(start), self.format(stop), step
-        else:                     # This is the wrap-around case
-            distance = (self.RANGE_MAX - start) + (stop - self.RANGE_MIN)
-            if distance > steps-1:
-                step_increment = distance // steps
-                # Can't use xrange here because the numbers are too large!
-                step_list = [self.format(x) for x in range(start, self.RANGE_MAX, step_increment)]
-                step_list.extend([self.format(x) for x in range(self.RANGE_MIN, stop, step_increment)])
-                if len(step_list) > steps-1:
-                    step_list.pop()
-            else:
-                step += 1
-                yield self.format(start), self.format(stop), step
-        step_list.append(self.format(stop)) # Add the final number to the list
-        # Now iterate pair-wise over the list
-        while len(step_list) > 1:
-            step += 1
-            yield step_list[0], step_list[1], step
-            step_list.pop(0)
+        return numbered_pairs(map(self.FORMAT_TEMPLATE.format, self.sub_range_bounds(start, stop, steps)))
 
 
-class RepairStatus(object):
+class TopologyCache(object):
     """
-    Record repair status and write to a file.
+    On-disk cache of parsed nodetool output (token lists, keyspaces), so that
+    resumed and repeated runs do not have to query the cluster again.  There
+    is one JSON file per host/port/datacenter combination, and every entry
+    in it expires ttl seconds after it was written.
     """
 
-    def __init__(self):
+    def __init__(self, directory, host, port, datacenter, ttl, refresh=False):
         """
         Init.
-        """
-        # Repair settings
-        self.filename = None
-        self.log_status = None
-        self.steps = None
-        # Timestamps
-        self.started = None
-        self.updated = None
-        self.finished = None
-        self.last_resumed_at = None
-        # Counters
-        self.successful_count = 0
-        self.failed_count = 0
-        # Repair operations
-        self.failed_repairs = {}
-        self.current_repairs = {}
-        self.finished_repairs = {}
-        self.pending_repairs = {}
 
-    def start(self, options):
+        :param str directory: Directory holding the cache files.
+        :param str host: Host nodetool talks to.
+        :param port: JMX port nodetool talks to.
+        :param str datacenter: Datacenter the ring is filtered on.
+        :param int ttl: Seconds a cached entry stays valid.
+        :param bool refresh: Ignore cached entries, but still store new ones.
         """
-        Start recording repair status.
+        self.ttl = ttl
+        self.refresh = refresh
+        key = json.dumps([host, str(port), datacenter])
+        self.filename = os.path.join(directory, 'topology-{0}.json'.format(
+            hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
+    @classmethod
+    def from_options(cls, options):
+        """
+        Build the cache requested on the command line.
 
-        :param options: Range repair options.
+        :param options: OptionParser result
+
+        :rtype: TopologyCache
+        :return: Topology cache, or None if caching was not requested.
         """
-        self.filename = options.output_status
-        self.log_status = options.logfile
-        self.steps = options.steps
-        self.reset()
-        self.started = datetime.now().isoformat()
-        self.write()
+        if not options.topology_cache:
+            return None
+        return cls(options.topology_cache, options.host, options.port, options.datacenter,
+                   options.topology_cache_ttl, options.refresh_topology)
 
-    def add_pending_repair(self, k, p):
-        self.pending_repairs[k] = p
+    def get(self, name):
+        """
+        Get a cached entry.
 
-    def gp(self):
-        return self.pending_repairs
+        :param str name: Entry name.
 
-    def resume(self, options, tokens):
+        :return: Cached value, or None if it is missing or expired.
         """
-        Resume a hung or canceled range repair.
+        if self.refresh:
+            return None
+        entry = self._read().get(name)
+        if entry is None or time.time() - entry['time'] > self.ttl:
+            return None
+        return entry['value']
+
+    def put(self, name, value):
+        """
+        Store an entry.
 
-        :param options: Range repair options.
-        :param TokenContainer tokens: Tokens.
+        :param str name: Entry name.
+        :param value: JSON serialisable value.
+        """
+        entries = self._read()
+        entries[name] = {'time': time.time(), 'value': value}
+        if not os.path.isdir(os.path.dirname(self.filename)):
+            os.makedirs(os.path.dirname(self.filename))
+        tmp_filename = '{0}.{1}.tmp'.format(self.filename, os.getpid())
+        with open(tmp_filename, 'w') as f:
+            json.dump(entries, f)
+        os.rename(tmp_filename, self.filename)
+
+    def _read(self):
+        """
+        Read every entry of the cache file.
 
-        :rtype: int
-        :return: Token offset to resume repairs at.
+        :rtype: dict
+        :return: Entries by name.
         """
-        # Repair settings
-        self.filename = options.output_status
-        self.steps = options.steps
-        # Load existing data from output status file
-        f = open(self.filename, 'r')
-        status = json.load(f)
-        f.close()
-        if status['finished']:
-            raise Exception('Cannot resume, repair status indicates it has already finished at {0}'
-                            .format(status['finished']))
-        self._from_output_status(status)
-        # Set resumed data
-        self.last_resumed_at = datetime.now().isoformat()
-        self.write()
-        return True
+        try:
+            with open(self.filename) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
 
-    def reset(self):
+
+class StepProgress(object):
+    """
+    Completion bitmap over the indices of the steps of a plan, with the
+    indices of the steps that failed, and a fingerprint of the plan the
+    indices refer to.
+    """
+
+    def __init__(self, total, done=None, failed=(), plan=None):
         """
-        Reset all repair status values.
+        Init.
+
+        :param int total: Number of steps in the plan.
+        :param bytes done: Bitmap of the finished steps, bit i % 8 of byte i // 8 for step i.
+        :param failed: Indices of the failed steps.
+        :param str plan: Fingerprint of the plan, see plan_fingerprint.
         """
-        self.started = None
-        self.updated = None
-        self.finished = None
-        self.failed_repairs = {}
-        self.current_repairs = {}
-        self.finished_repairs = {}
-        self.pending_repairs = {}
-        self.failed_count = 0
-        self.successful_count = 0
-        self.last_resumed_at = None
+        self.total = total
+        self.plan = plan
+        self.done = bytearray((total + 7) // 8) if done is None else bytearray(done)
+        self.failed = set(failed)
+        self.done_count = sum(bin(byte).count('1') for byte in self.done)
 
-    def repair_start(self, cmd, step, start, end, nodeposition, keyspace=None, column_families=None):
+    def is_done(self, index):
         """
-        Record when a repair step starts.
+        :param int index: Step index.
 
-        :param cmd: Repair command.
-        :param step: Step number.
-        :param start: Start range.
-        :param end: End range.
-        :param nodeposition: Node position.
-        :param keyspace: Keyspace being repaired.
-        :param column_families: Column families being repaired.
+        :return: Whether the step succeeded.
         """
-        k = create_key(step, start, end, nodeposition, keyspace, column_families)
-        self.current_repairs[k] = self._build_repair_dict(cmd, step, start, end, nodeposition, keyspace, column_families)
-        self.write()
+        return bool(self.done[index >> 3] & (1 << (index & 7)))
 
-    def repair_fail(self, cmd, step, start, end, nodeposition, keyspace=None, column_families=None):
+    def is_settled(self, index):
         """
-        Record when a repair step fails.
+        :param int index: Step index.
 
-        :param cmd: Repair command.
-        :param step: Step number.
-        :param start: Start range.
-        :param end: End range.
-        :param nodeposition: Node position.
-        :param keyspace: Keyspace being repaired.
-        :param column_families: Column families being repaired.
+        :return: Whether the step succeeded or failed, so that --resume skips it.
         """
-        k = create_key(step, start, end, nodeposition, keyspace, column_families)
-        self.current_repairs[k] = self._build_repair_dict(cmd, step, start, end, nodeposition, keyspace, column_families)
-        self.failed_repairs[k] = self.current_repairs[k]
-        del self.current_repairs[k]
-        del self.pending_repairs[k]
+        return self.is_done(index) or index in self.failed
 
-        self.failed_repairs.append(
-            self._build_repair_dict(cmd, step, start, end, nodeposition, keyspace, column_families)
-        )
-        self.failed_count += 1
-        self.write()
+    def mark(self, index, success):
+        """
+        Take note of a finished step.
 
-    def repair_success(self, cmd, step, start, end, nodeposition, keyspace=None, column_families=None):
+        :param int index: Step index.
+        :param bool success: Whether the step succeeded.
         """
-        Record when a repair step succeeds.
+        if not success:
+            self.failed.add(index)
+        elif not self.is_done(index):
+            self.done[index >> 3] |= 1 << (index & 7)
+            self.done_count += 1
 
-        :param cmd: Repair command.
-        :param step: Step number.
-        :param start: Start range.
-        :param end: End range.
-        :param nodeposition: Node position.
-        :param keyspace: Keyspace being repaired.
-        :param column_families: Column families being repaired.
+    @property
+    def pending_count(self):
+        return self.total - self.done_count - len(self.failed)
+
+    def check_plan(self, total, plan):
         """
-        k = create_key(step, start, end, nodeposition, keyspace, column_families)
-        self.finished_repairs[k] = self.current_repairs[k]
-        del self.current_repairs[k]
-        del self.pending_repairs[k]
-        self.successful_count += 1
-        self.write()
+        Make sure a resumed repair planned the same steps as the one that
+        recorded the progress, so that every index still names the same step.
 
-    def finish(self):
+        :param int total: Number of steps in the resumed plan.
+        :param str plan: Fingerprint of the resumed plan.
         """
-        Set repair session as finished.
+        if total != self.total:
+            raise Exception('Cannot resume, the plan has {0} steps but the repair status tracks {1}; '
+                            'the ring or the options changed'.format(total, self.total))
+        if self.plan is None:
+            logging.warning('Repair status has no plan fingerprint, only the number of steps was checked')
+        elif plan != self.plan:
+            raise Exception('Cannot resume, the plan differs from the one the repair status tracks; '
+                            'the ring or the options changed')
+
+    def to_dict(self):
         """
-        self.finished = datetime.now().isoformat()
-        self.write()
+        :rtype: dict
+        :return: JSON view, the bitmap compressed and base64 encoded.
+        """
+        return {
+            'total': self.total,
+            'done_count': self.done_count,
+            'done': base64.b64encode(zlib.compress(bytes(self.done))).decode('ascii'),
+            'failed': sorted(self.failed),
+            'plan': self.plan,
+        }
 
-    def write(self):
+    @classmethod
+    def from_dict(cls, progress):
         """
-        Write repair status to file, if requested.
+        :param dict progress: What to_dict returned.
+
+        :rtype: StepProgress
         """
-        json_status = json.dumps({
-            'started': self.started,
-            'updated': self.updated,
-            'finished': self.finished,
-            'failed_repairs': self.failed_repairs,
-            'pending_repairs': self.pending_repairs,
-            'current_repairs': self.current_repairs,
-            'finished_repairs': self.finished_repairs,
-            'successful_count': self.successful_count,
-            'failed_count': self.failed_count,
-            'steps': self.steps,
-            'last_resumed_at': self.last_resumed_at,
-        })
+        return cls(progress['total'], zlib.decompress(base64.b64decode(progress['done'])), progress['failed'],
+                   progress.get('plan'))
 
-        # No filename indicates output status was not requested
 
-        with write_status_lock:
-            if self.filename:
-                self.updated = datetime.now().isoformat()
-                file = open(self.filename, 'w')
-                file.write(json_status)
-                file.close()
-                os.chmod(self.filename, stat.S_IWUSR | stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+def add_timing(timings, phase, seconds):
+    """Add time to a phase of the timings of a repair, if they are kept.
+    :param dict timings: Seconds by phase, or None.
+    :param phase: Phase name.
+    :param seconds: Seconds spent in the phase.
+    :returns: None
+    """
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0) + seconds
+
 
-        if self.log_status:
-            logging.critical('Repair status: {0}'.format(json_status))
+class PhaseTimings(object):
+    """
+    Where the time of a repair run goes: histograms of the seconds repairs
+    spend in each phase, the number of retried nodetool repair calls, and
+    the seconds the run spent discovering the topology and planning steps.
+
+    The phases of a repair are queued (waiting for a worker), sleep (the
+    random --max-sleep-before-run pause), spawn (starting nodetool, or
+    handing the command to the session helper), nodetool (waiting for it to
+    finish) and backoff (waiting to retry).  The status bookkeeping adds
+    journal (appending a record) and snapshot (rewriting the status file).
+    """
+
+    def __init__(self, run=None, phases=None, retries=0):
+        """
+        Init.
+
+        :param dict run: Seconds of the run phases, by name.
+        :param dict phases: Histograms by phase name, as to_dict returns them.
+        :param int retries: Number of retried nodetool repair calls.
+        """
+        self.run = dict(run or {})
+        self.phases = dict(phases or {})
+        self.retries = retries
+
+    def observe(self, phase, seconds):
+        """
+        Count the seconds one repair spent in a phase.
+
+        :param str phase: Phase name.
+        :param float seconds: Seconds spent in the phase.
+        """
+        histogram = self.phases.get(phase)
+        if histogram is None:
+            histogram = self.phases[phase] = {'count': 0, 'sum': 0.0, 'max': 0.0,
+                                              'counts': [0] * (len(TIMING_BUCKETS) + 1)}
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+        histogram['max'] = max(histogram['max'], seconds)
+        histogram['counts'][bisect_left(TIMING_BUCKETS, seconds)] += 1
+
+    def observe_repair(self, timings):
+        """
+        Count the timings of one repair.
+
+        :param dict timings: Seconds by phase, and the number of retries under 'retries'.
+        """
+        for phase, seconds in six.iteritems(timings):
+            if phase == 'retries':
+                self.retries += seconds
+            else:
+                self.observe(phase, seconds)
+
+    def summary(self):
+        """
+        :rtype: str
+        :return: Mean and maximum seconds of every phase, for the log.
+        """
+        return ', '.join('{0} {1:.3f}s mean {2:.3f}s max'.format(
+            phase, histogram['sum'] / histogram['count'], histogram['max'])
+            for phase, histogram in sorted(self.phases.items()))
+
+    def to_dict(self):
+        """
+        :rtype: dict
+        :return: JSON view.  counts[i] of a phase is the number of repairs
+                 that took at most buckets[i] seconds and more than
+                 buckets[i - 1], the last count the number that took longer
+                 than every bucket.
+        """
+        return {
+            'buckets': list(TIMING_BUCKETS),
+            'run': self.run,
+            'phases': self.phases,
+            'retries': self.retries,
+        }
+
+    @classmethod
+    def from_dict(cls, timings):
+        """
+        :param dict timings: What to_dict returned.
+
+        :rtype: PhaseTimings
+        """
+        phases = timings['phases']
+        if timings['buckets'] != list(TIMING_BUCKETS):
+            logging.warning('Repair status timing histograms have different buckets, starting them over')
+            phases = None
+        return cls(timings['run'], phases, timings['retries'])
+
+
+class RepairTask(object):
+    """
+    A repair step in the repair status.
+
+    A repair status holds a task for every step of the plan, so tasks have
+    slots rather than a dict, keyspaces and node positions are interned and
+    column families are a tuple shared by every task of the same tables.
+    Tasks are identified by a tuple and only turned into the dicts and key
+    strings of the status file when it is written.
+    """
+
+    __slots__ = ('cmd', 'step', 'start', 'end', 'nodeposition', 'keyspace', 'column_families', 'time')
+
+    # Column family tuples in use, so that equal ones are shared
+    interned_column_families = {}
+
+    def __init__(self, cmd, step, start, end, nodeposition, keyspace=None, column_families=None, timestamp=None):
+        """
+        Init.
+
+        :param cmd: Repair command.
+        :param step: Step number.
+        :param start: Start range.
+        :param end: End range.
+        :param nodeposition: Node position.
+        :param keyspace: Keyspace being repaired, None for every keyspace.
+        :param column_families: Column families being repaired, None for every column family.
+        :param float timestamp: When the step got to this state, now if not given.
+        """
+        self.cmd = cmd
+        self.step = step
+        self.start = start
+        self.end = end
+        self.nodeposition = sys.intern(nodeposition)
+        self.keyspace = self.intern_keyspace(keyspace)
+        self.column_families = self.intern_column_families(column_families)
+        self.time = time.time() if timestamp is None else timestamp
+
+    @staticmethod
+    def intern_keyspace(keyspace):
+        """
+        :param keyspace: Keyspace, or None, '<all>' or 'None' for every keyspace.
+
+        :rtype: str
+        :return: Interned keyspace, or None.
+        """
+        if not keyspace or keyspace in ('<all>', 'None'):
+            return None
+        return sys.intern(keyspace)
+
+    @classmethod
+    def intern_column_families(cls, column_families):
+        """
+        :param column_families: List of column families, their string form
+                                from a status file, or None or '<all>' for
+                                every column family.
+
+        :rtype: tuple
+        :return: Shared tuple of interned column families, empty for every column family.
+        """
+        if not column_families or column_families == '<all>':
+            return ()
+        if isinstance(column_families, six.string_types):
+            column_families = ast.literal_eval(column_families)
+        column_families = tuple(sys.intern(str(column_family)) for column_family in column_families)
+        return cls.interned_column_families.setdefault(column_families, column_families)
+
+    @classmethod
+    def identity(cls, step, start, end, nodeposition, keyspace=None, column_families=None):
+        """
+        Key of a step in the repair status dicts, without building its task.
+
+        :rtype: tuple
+        """
+        return (step, start, end, nodeposition, cls.intern_keyspace(keyspace),
+                cls.intern_column_families(column_families))
+
+    @property
+    def key(self):
+        """
+        :rtype: tuple
+        :return: Key of the task in the repair status dicts.
+        """
+        return self.step, self.start, self.end, self.nodeposition, self.keyspace, self.column_families
+
+    def status_key(self):
+        """
+        :rtype: str
+        :return: Key of the task in the status file.
+        """
+        return create_key(self.step, self.start, self.end, self.nodeposition, self.keyspace,
+                          list(self.column_families))
+
+    def to_dict(self):
+        """
+        :rtype: dict
+        :return: Repair step dict of the status file.
+        """
+        return {
+            'time': format_timestamp(self.time),
+            'step': self.step,
+            'start': self.start,
+            'end': self.end,
+            'nodeposition': self.nodeposition,
+            'keyspace': self.keyspace or '<all>',
+            'column_families': str(list(self.column_families)) if self.column_families else '<all>',
+            'cmd': self.cmd,
+        }
+
+    @classmethod
+    def from_dict(cls, repair):
+        """
+        :param dict repair: Repair step dict of the status file.
+
+        :rtype: RepairTask
+        """
+        return cls(repair['cmd'], repair['step'], repair['start'], repair['end'], repair['nodeposition'],
+                   repair['keyspace'], repair['column_families'], datetime.fromisoformat(repair['time']).timestamp())
+
+    def to_list(self):
+        """
+        :rtype: list
+        :return: Compact form of the task, for the journal.
+        """
+        return [self.cmd, self.step, self.start, self.end, self.nodeposition, self.keyspace,
+                list(self.column_families), self.time]
+
+    @classmethod
+    def from_list(cls, values):
+        """
+        :param list values: What to_list returned.
+
+        :rtype: RepairTask
+        """
+        return cls(*values)
+
+
+class RepairStatus(object):
+    """
+    Record repair status and write to a file.
+
+    Every state transition is appended to a JSONL journal next to the status
+    file.  The full JSON snapshot, which is what other tools read, is only
+    rewritten on compaction: at start, resume and finish, and in between at
+    most once every flush_interval seconds while there are unwritten changes.
+    The snapshot is replaced atomically, so readers never see a partial file.
+    """
+
+    def __init__(self):
+        """
+        Init.
+        """
+        # Repair settings
+        self.filename = None
+        self.log_status = None
+        self.steps = None
+        self.compact_interval = DEFAULT_STATUS_COMPACT_INTERVAL
+        self.flush_interval = DEFAULT_STATUS_FLUSH_INTERVAL / 1000.0
+        # Timestamps
+        self.started = None
+        self.updated = None
+        self.finished = None
+        self.last_resumed_at = None
+        # Counters
+        self.successful_count = 0
+        self.failed_count = 0
+        # Repair operations
+        self.failed_repairs = {}
+        self.current_repairs = {}
+        self.finished_repairs = {}
+        self.pending_repairs = {}
+        # Progress of ranges cut into steps as the repair goes, by nodeposition
+        self.plans = {}
+        # Steps allowed to run at once, when adjusted by AdaptiveConcurrency
+        self.concurrency = None
+        # Parallelism and time blocked on busy replicas, with --replica-aware
+        self.scheduling = None
+        # Compiled plan the steps come from, with --plan-file
+        self.plan_file = None
+        # Completion bitmap, with --status-format=compact
+        self.progress = None
+        # Hosts of a --cluster repair
+        self.hosts = None
+        # Where the time of the run goes
+        self.timings = PhaseTimings()
+        # Steps by keyspace, pending and by result, for the metrics endpoint
+        self.keyspace_pending = collections.Counter()
+        self.keyspace_repairs = collections.Counter()
+        # Journal
+        self.journal = None
+        self.journal_seq = 0
+        self.journal_records = 0
+        # Coalesced snapshot writes
+        self.dirty = False
+        self.last_flush = 0
+        self.flush_timer = None
+        self.unwritten_changes = 0
+        self.writes_saved = 0
+        self.lock = threading.RLock()
+
+    def start(self, options, hosts=None):
+        """
+        Start recording repair status.
+
+        :param options: Range repair options.
+        :param list hosts: Hosts of a --cluster repair.
+        """
+        self.filename = options.output_status
+        self.log_status = options.logfile
+        self.steps = options.steps
+        self.compact_interval = options.status_compact_interval
+        self.flush_interval = options.status_flush_interval / 1000.0
+        self.reset()
+        self.hosts = hosts
+        self.started = datetime.now().isoformat()
+        self.write()
+
+    def add_pending_repair(self, task):
+        """
+        Record a step of the plan before it is handed out.
+
+        :param RepairTask task: Step.
+        """
+        self._record({'event': 'pending', 'task': task})
+
+    def gp(self):
+        return self.pending_repairs
+
+    def update_plan(self, nodeposition, plan):
+        """
+        Record how far a range cut by DynamicStepPlan has got.
+
+        :param nodeposition: Node position of the range.
+        :param dict plan: Range plan, or None once every step has been handed out.
+        """
+        self._record({'event': 'plan', 'key': nodeposition, 'plan': plan})
+
+    def set_concurrency(self, level):
+        """
+        Record a change in the number of steps allowed to run at once.
+
+        :param int level: Steps allowed to run at once.
+        """
+        self._record({'event': 'concurrency', 'key': None, 'concurrency': level})
+
+    def set_plan_file(self, filename, steps):
+        """
+        Record the compiled plan a repair runs.  Its steps are not recorded
+        as pending, --resume reads them from the plan again.
+
+        :param str filename: Plan file.
+        :param int steps: Number of steps in the plan.
+        """
+        self._record({'event': 'plan_file', 'key': None, 'plan_file': {'filename': filename, 'steps': steps}})
+
+    def track_progress(self, total, plan=None):
+        """
+        Track steps by their index in the plan, in a completion bitmap,
+        rather than as pending and finished repairs.
+
+        :param int total: Number of steps in the plan.
+        :param str plan: Fingerprint of the plan, checked on resume.
+        """
+        self._record({'event': 'progress', 'key': None, 'total': total, 'plan': plan})
+
+    def step_done(self, index, success):
+        """
+        Record a finished step in the completion bitmap.
+
+        :param int index: Step index.
+        :param bool success: Whether every repair of the step succeeded.
+        """
+        self._record({'event': 'step_done', 'key': None, 'index': index, 'success': success})
+
+    def set_scheduling(self, stats):
+        """
+        Record how well ReplicaStepPlan kept repair sessions apart.
+
+        :param dict stats: Scheduling statistics.
+        """
+        self._record({'event': 'scheduling', 'key': None, 'scheduling': stats})
+
+    def set_run_timings(self, timings):
+        """
+        Record how long topology discovery and planning took.
+
+        :param dict timings: Seconds by run phase.
+        """
+        self._record({'event': 'run_timings', 'key': None, 'run_timings': timings})
+
+    def resume(self, options, tokens):
+        """
+        Resume a hung or canceled range repair.
+
+        :param options: Range repair options.
+        :param TokenContainer tokens: Tokens.
+
+        :rtype: int
+        :return: Token offset to resume repairs at.
+        """
+        # Repair settings
+        self.filename = options.output_status
+        self.steps = options.steps
+        self.compact_interval = options.status_compact_interval
+        self.flush_interval = options.status_flush_interval / 1000.0
+        # Load existing data from output status file and its journal
+        status = self.load(self.filename)
+        if status['finished']:
+            raise Exception('Cannot resume, repair status indicates it has already finished at {0}'
+                            .format(status['finished']))
+        self._from_output_status(status)
+        # Set resumed data
+        self.last_resumed_at = datetime.now().isoformat()
+        self.write()
+        return True
+
+    def reset(self):
+        """
+        Reset all repair status values.
+        """
+        self.started = None
+        self.updated = None
+        self.finished = None
+        self.failed_repairs = {}
+        self.current_repairs = {}
+        self.finished_repairs = {}
+        self.pending_repairs = {}
+        self.plans = {}
+        self.concurrency = None
+        self.scheduling = None
+        self.plan_file = None
+        self.progress = None
+        self.hosts = None
+        self.timings = PhaseTimings()
+        self.keyspace_pending = collections.Counter()
+        self.keyspace_repairs = collections.Counter()
+        self.failed_count = 0
+        self.successful_count = 0
+        self.last_resumed_at = None
+        self.writes_saved = 0
+
+    def repair_start(self, cmd, step, start, end, nodeposition, keyspace=None, column_families=None):
+        """
+        Record when a repair step starts.
+
+        :param cmd: Repair command.
+        :param step: Step number.
+        :param start: Start range.
+        :param end: End range.
+        :param nodeposition: Node position.
+        :param keyspace: Keyspace being repaired.
+        :param column_families: Column families being repaired.
+        """
+        self._record({'event': 'start', 'task': RepairTask(cmd, step, start, end, nodeposition, keyspace, column_families)})
+
+    def repair_fail(self, cmd, step, start, end, nodeposition, keyspace=None, column_families=None, timings=None):
+        """
+        Record when a repair step fails.
+
+        :param cmd: Repair command.
+        :param step: Step number.
+        :param start: Start range.
+        :param end: End range.
+        :param nodeposition: Node position.
+        :param keyspace: Keyspace being repaired.
+        :param column_families: Column families being repaired.
+        :param dict timings: Seconds the repair spent in each phase, see PhaseTimings.
+        """
+        self._record_outcome('fail', RepairTask(cmd, step, start, end, nodeposition, keyspace, column_families), timings)
+
+    def repair_success(self, cmd, step, start, end, nodeposition, keyspace=None, column_families=None,
+                       timings=None):
+        """
+        Record when a repair step succeeds.
+
+        :param cmd: Repair command.
+        :param step: Step number.
+        :param start: Start range.
+        :param end: End range.
+        :param nodeposition: Node position.
+        :param keyspace: Keyspace being repaired.
+        :param column_families: Column families being repaired.
+        :param dict timings: Seconds the repair spent in each phase, see PhaseTimings.
+        """
+        self._record_outcome('success', RepairTask(cmd, step, start, end, nodeposition, keyspace, column_families),
+                             timings)
+
+    def _record_outcome(self, event, task, timings):
+        """
+        Record a finished repair step, with its timings if there are any.
+
+        :param str event: success or fail.
+        :param RepairTask task: Step.
+        :param dict timings: Seconds the repair spent in each phase, or None.
+        """
+        record = {'event': event, 'task': task}
+        if timings:
+            record['timings'] = timings
+        self._record(record)
+
+    def finish(self):
+        """
+        Set repair session as finished.
+        """
+        self.finished = datetime.now().isoformat()
+        self.write()
+        if self.filename:
+            logging.info('Repair status: {0} status file writes saved by coalescing'.format(self.writes_saved))
+        if self.timings.phases:
+            logging.info('Repair phases: {0}; {1} retries'.format(self.timings.summary(), self.timings.retries))
+
+    def flush(self):
+        """
+        Write the status snapshot now if there are unwritten changes.
+        """
+        with self.lock:
+            if self.dirty:
+                self.write()
+
+    def write(self):
+        """
+        Write the full repair status snapshot to file, if requested, and
+        truncate the journal it supersedes.
+
+        The snapshot is written to a temporary file, synced and renamed over
+        the status file.
+        """
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            self.writes_saved += max(0, self.unwritten_changes - 1)
+            self.unwritten_changes = 0
+            self.dirty = False
+            self.last_flush = time.time()
+            if not self.filename and not self.log_status:
+                return
+            started = time.time()
+            self.updated = datetime.now().isoformat()
+            json_status = json.dumps(self.to_dict())
+
+            # No filename indicates output status was not requested
+            if self.filename:
+                tmp_filename = self.filename + '.tmp'
+                file = open(tmp_filename, 'w')
+                file.write(json_status)
+                file.flush()
+                os.fsync(file.fileno())
+                file.close()
+                os.chmod(tmp_filename, stat.S_IWUSR | stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                os.rename(tmp_filename, self.filename)
+                self._truncate_journal()
+
+            if self.log_status:
+                logging.critical('Repair status: {0}'.format(json_status))
+            # Shows in the next snapshot
+            self.timings.observe('snapshot', time.time() - started)
+
+    def to_dict(self):
+        """
+        Build the JSON snapshot of the repair status.
+
+        :rtype: dict
+        :return: Repair status.
+        """
+        status = {
+            'started': self.started,
+            'updated': format_timestamp(self.updated),
+            'finished': self.finished,
+            'failed_repairs': self._repair_dicts(self.failed_repairs),
+            'pending_repairs': self._repair_dicts(self.pending_repairs),
+            'plans': self.plans,
+            'concurrency': self.concurrency,
+            'scheduling': self.scheduling,
+            'plan_file': self.plan_file,
+            'progress': self.progress.to_dict() if self.progress is not None else None,
+            'pending_count': self.pending_count(),
+            'current_repairs': self._repair_dicts(self.current_repairs),
+            'finished_repairs': self._repair_dicts(self.finished_repairs),
+            'successful_count': self.successful_count,
+            'failed_count': self.failed_count,
+            'steps': self.steps,
+            'last_resumed_at': self.last_resumed_at,
+            'journal_seq': self.journal_seq,
+            'writes_saved': self.writes_saved,
+            'current_repair': self._repair_dict(self._latest(self.current_repairs.values())),
+            'timings': self.timings.to_dict(),
+        }
+        if self.hosts is not None:
+            status['hosts'] = self.hosts
+            status['nodes'] = self.node_statuses()
+        return status
+
+    def pending_count(self):
+        """
+        Number of steps that have not finished or failed yet.  Steps of a
+        --plan-file run are not recorded as pending, so they are counted
+        from the size of the plan.
+
+        :rtype: int
+        :return: Pending steps.
+        """
+        if self.progress is not None:
+            return self.progress.pending_count
+        if self.plan_file is not None:
+            return max(0, self.plan_file['steps'] - len(self.finished_repairs) - len(self.failed_repairs))
+        return len(self.pending_repairs)
+
+    def node_statuses(self):
+        """
+        Split the status of a --cluster repair by host, in the format of the
+        status of a single host repair, so that check_repair_status.py can
+        read it.  Hosts with no started step yet are left out.
+
+        :rtype: dict
+        :return: Status of every host.
+        """
+        nodes = {}
+        for state in ('pending_repairs', 'current_repairs', 'finished_repairs', 'failed_repairs'):
+            for task in six.itervalues(getattr(self, state)):
+                host, position = split_nodeposition(task.nodeposition)
+                node = nodes.setdefault(host, {'pending_repairs': 0, 'current_repairs': {},
+                                               'finished_repairs': 0, 'failed_repairs': {}})
+                if state == 'pending_repairs':
+                    node[state] += 1
+                    continue
+                if state == 'finished_repairs':
+                    node[state] += 1
+                else:
+                    node[state][task.status_key()] = task
+                node['started'] = min(node.get('started') or task.time, task.time)
+                node['updated'] = max(node.get('updated') or task.time, task.time)
+                node['last'] = self._latest(filter(None, (node.get('last'), task)))
+
+        def host_view(task):
+            # The step as the host sees it, without the host prefix
+            if task is None:
+                return None
+            return dict(task.to_dict(), nodeposition=split_nodeposition(task.nodeposition)[1])
+
+        statuses = {}
+        for host in self.hosts:
+            node = nodes.get(host)
+            if not node or 'started' not in node:
+                continue
+            done = not (node['pending_repairs'] or node['current_repairs'])
+            statuses[host] = {
+                'started': format_timestamp(node['started']),
+                'updated': format_timestamp(node['updated']),
+                'finished': format_timestamp(node['updated']) if done else None,
+                'failed_repairs': {k: host_view(task) for k, task in six.iteritems(node['failed_repairs'])},
+                'current_repairs': {k: host_view(task) for k, task in six.iteritems(node['current_repairs'])},
+                # Between two steps of a host, report the last one it ran
+                'current_repair': host_view(self._latest(node['current_repairs'].values()) or node['last']),
+                'successful_count': node['finished_repairs'],
+                'failed_count': len(node['failed_repairs']),
+                'pending_count': node['pending_repairs'],
+                'steps': self.steps,
+            }
+        return statuses
+
+    @staticmethod
+    def _latest(repairs):
+        """
+        Most recently started of some repairs.
+
+        :param repairs: Iterable of RepairTask.
+
+        :rtype: RepairTask
+        :return: Repair task, or None.
+        """
+        return max(repairs, key=lambda repair: repair.time, default=None)
+
+    @staticmethod
+    def _repair_dict(task):
+        """
+        :param RepairTask task: Repair task, or None.
+
+        :rtype: dict
+        :return: Repair step dict of the status file, or None.
+        """
+        return task.to_dict() if task is not None else None
+
+    @staticmethod
+    def _repair_dicts(repairs):
+        """
+        :param dict repairs: Repair tasks by key.
+
+        :rtype: dict
+        :return: Repair step dicts by status file key.
+        """
+        return {task.status_key(): task.to_dict() for task in six.itervalues(repairs)}
+
+    @staticmethod
+    def _tasks(repairs):
+        """
+        :param dict repairs: Repair step dicts of the status file, by status file key.
+
+        :rtype: dict
+        :return: Repair tasks by key.
+        """
+        tasks = (RepairTask.from_dict(repair) for repair in six.itervalues(repairs) if repair)
+        return {task.key: task for task in tasks}
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a repair status snapshot and replay any journal records written
+        after it.
+
+        :param str filename: Status filename.
+
+        :rtype: dict
+        :return: Repair status, in the snapshot format.
+        """
+        f = open(filename, 'r')
+        status = json.load(f)
+        f.close()
+        repair_status = cls()
+        repair_status._from_output_status(status)
+        repair_status.journal_seq = status.get('journal_seq', 0)
+        journal_filename = cls.journal_filename(filename)
+        if os.path.exists(journal_filename):
+            with open(journal_filename, 'r') as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final record from an interrupted write.
+                        logging.warning('Ignoring unreadable repair status journal record: %s', line.strip())
+                        break
+                    if record['seq'] <= repair_status.journal_seq:
+                        continue
+                    repair_status._apply(record)
+                    repair_status.journal_seq = record['seq']
+        return repair_status.to_dict()
+
+    @staticmethod
+    def journal_filename(filename):
+        """
+        Name of the journal belonging to a status file.
+
+        :param str filename: Status filename.
+
+        :rtype: str
+        :return: Journal filename.
+        """
+        return filename + '.journal'
+
+    def _record(self, record):
+        """
+        Apply a state transition and append it to the journal.
+
+        :param dict record: Journal record.
+        """
+        with self.lock:
+            record['time'] = time.time()
+            self._apply(record)
+            if not self.filename:
+                return
+            self.journal_seq += 1
+            record['seq'] = self.journal_seq
+            started = time.time()
+            if self.journal is None:
+                self.journal = open(self.journal_filename(self.filename), 'a')
+            self.journal.write(json.dumps(record, default=RepairTask.to_list) + '\n')
+            self.journal.flush()
+            self.journal_records += 1
+            self.timings.observe('journal', time.time() - started)
+            self._mark_dirty()
+
+    def _mark_dirty(self):
+        """
+        Note an unwritten change and make sure a snapshot write follows it,
+        no sooner than flush_interval seconds after the previous one.  With a
+        flush_interval of zero the snapshot is only written once the journal
+        holds compact_interval records.
+        """
+        self.dirty = True
+        self.unwritten_changes += 1
+        if self.flush_interval <= 0:
+            if self.journal_records >= self.compact_interval:
+                self.write()
+            return
+        delay = self.last_flush + self.flush_interval - time.time()
+        if delay <= 0 and self.journal_records >= self.compact_interval:
+            self.write()
+        elif self.flush_timer is None:
+            self.flush_timer = threading.Timer(max(0, delay), self.flush)
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
+
+    def _apply(self, record):
+        """
+        Apply a journal record to the in-memory status.
+
+        :param dict record: Journal record.
+        """
+        event = record['event']
+        task = self._record_task(record)
+        k = task.key if task is not None else record.get('key')
+        if event == 'pending':
+            if k not in self.pending_repairs:
+                self.keyspace_pending[self._keyspace(task)] += 1
+            self.pending_repairs[k] = task
+        elif event == 'plan':
+            if record['plan'] is None:
+                self.plans.pop(k, None)
+            else:
+                self.plans[k] = record['plan']
+        elif event == 'concurrency':
+            self.concurrency = record['concurrency']
+        elif event == 'scheduling':
+            self.scheduling = record['scheduling']
+        elif event == 'run_timings':
+            self.timings.run.update(record['run_timings'])
+        elif event == 'plan_file':
+            self.plan_file = record['plan_file']
+        elif event == 'progress':
+            self.progress = StepProgress(record['total'], plan=record.get('plan'))
+        elif event == 'step_done':
+            self.progress.mark(record['index'], record['success'])
+        elif event == 'start':
+            self.current_repairs[k] = task
+        elif event == 'success':
+            repair = self.current_repairs.pop(k, None)
+            pending = self.pending_repairs.pop(k, None)
+            if pending is not None:
+                self.keyspace_pending[self._keyspace(pending)] -= 1
+            if self.progress is None and (repair or pending or task):
+                self.finished_repairs[k] = repair or pending or task
+            self.keyspace_repairs[self._keyspace(repair or pending or task), 'success'] += 1
+            self.successful_count += 1
+        elif event == 'fail':
+            self.current_repairs.pop(k, None)
+            if self.pending_repairs.pop(k, None) is not None:
+                self.keyspace_pending[self._keyspace(task)] -= 1
+            self.failed_repairs[k] = task
+            self.keyspace_repairs[self._keyspace(task), 'failure'] += 1
+            self.failed_count += 1
+        if record.get('timings'):
+            self.timings.observe_repair(record['timings'])
+        self.updated = record['time']
+
+    @staticmethod
+    def _keyspace(task):
+        """
+        :param RepairTask task: Step, or None.
+
+        :rtype: str
+        :return: Keyspace of the step for the per-keyspace counts.
+        """
+        return (task.keyspace if task is not None else None) or '<all>'
+
+    def _count_keyspaces(self):
+        """
+        Count the pending, finished and failed steps of every keyspace, after
+        loading them from a status file.
+        """
+        self.keyspace_pending = collections.Counter(self._keyspace(task) for task in self.pending_repairs.values())
+        self.keyspace_repairs = collections.Counter()
+        for repairs, result in ((self.finished_repairs, 'success'), (self.failed_repairs, 'failure')):
+            self.keyspace_repairs.update((self._keyspace(task), result) for task in repairs.values())
+
+    def _record_task(self, record):
+        """
+        Repair task a journal record is about.  Journals written before steps
+        were RepairTasks carry a repair dict instead, or for a success only
+        the status file key of the step.
+
+        :param dict record: Journal record.
+
+        :rtype: RepairTask
+        :return: Repair task, or None for records not about a step.
+        """
+        task = record.get('task')
+        if isinstance(task, list):
+            return RepairTask.from_list(task)
+        if task is not None:
+            return task
+        if record.get('repair'):
+            return RepairTask.from_dict(record['repair'])
+        if record['event'] == 'success':
+            for task in six.itervalues(self.current_repairs):
+                if task.status_key() == record['key']:
+                    return task
+        return None
+
+    def _truncate_journal(self):
+        """
+        Empty the journal once its records are part of a snapshot.
+        """
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(self.journal_filename(self.filename), 'w')
+        self.journal_records = 0
+
+    def _from_output_status(self, status):
+        """
+        Load data from existing output status file.
+
+        :param dict status: Status output data.
+        """
+        self.started = status['started']
+        self.updated = status['updated']
+        self.finished = status['finished']
+        self.last_resumed_at = status['last_resumed_at']
+        self.failed_repairs = self._tasks(status['failed_repairs'])
+        self.pending_repairs = self._tasks(status['pending_repairs'])
+        self.plans = status.get('plans', {})
+        self.concurrency = status.get('concurrency')
+        self.scheduling = status.get('scheduling')
+        self.plan_file = status.get('plan_file')
+        self.progress = StepProgress.from_dict(status['progress']) if status.get('progress') else None
+        self.hosts = status.get('hosts')
+        self.timings = PhaseTimings.from_dict(status['timings']) if status.get('timings') else PhaseTimings()
+        self.current_repairs = self._tasks(status['current_repairs'])
+        self.finished_repairs = self._tasks(status['finished_repairs'])
+        self.successful_count = status['successful_count']
+        self.failed_count = status['failed_count']
+        self._count_keyspaces()
+        self.journal_seq = status.get('journal_seq', 0)
+        self.writes_saved = status.get('writes_saved', 0)
+
+
+def format_label_value(value):
+    """Escape a metric label value.
+    :param value: Label value.
+    :returns: str
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics(repair_status, completion_since=None, openmetrics=False):
+    """Render the live state of a repair as Prometheus text, or as
+    OpenMetrics text.  The status is read without taking its lock, copying
+    each container with a single call first, so that a scrape never waits
+    for a status file write.
+    :param RepairStatus repair_status: Repair status.
+    :param completion_since: (time, finished repairs) to work the completion rate out from, or None.
+    :param openmetrics: Render OpenMetrics rather than Prometheus text format 0.0.4.
+    :returns: str
+    """
+    lines = []
+
+    def family(name, kind, description, samples):
+        # The Prometheus text format names a counter after its samples, OpenMetrics without the _total
+        family_name = name if openmetrics or kind != 'counter' else name + '_total'
+        lines.append('# HELP {0} {1}'.format(family_name, description))
+        lines.append('# TYPE {0} {1}'.format(family_name, kind))
+        for suffix, labels, value in samples:
+            labels = ','.join('{0}="{1}"'.format(label, format_label_value(label_value))
+                              for label, label_value in labels)
+            lines.append('{0}{1}{2} {3}'.format(name, suffix, '{' + labels + '}' if labels else '', value))
+
+    successful_count, failed_count = repair_status.successful_count, repair_status.failed_count
+    family('range_repair_repairs', 'counter', 'Finished nodetool repair calls.',
+           [('_total', [('result', 'success')], successful_count),
+            ('_total', [('result', 'failure')], failed_count)])
+    family('range_repair_running_repairs', 'gauge', 'Repair sessions in flight.',
+           [('', [], len(repair_status.current_repairs))])
+    family('range_repair_pending_steps', 'gauge', 'Steps not finished or failed yet.',
+           [('', [], repair_status.pending_count())])
+    if completion_since is not None:
+        since, finished = completion_since
+        elapsed = time.time() - since
+        rate = (successful_count + failed_count - finished) / elapsed if elapsed > 0 else 0
+        family('range_repair_completion_rate', 'gauge', 'Repairs finished per second since the endpoint started.',
+               [('', [], '{0:.6f}'.format(rate))])
+    family('range_repair_keyspace_repairs', 'counter', 'Finished nodetool repair calls by keyspace.',
+           [('_total', [('keyspace', keyspace), ('result', result)], count)
+            for (keyspace, result), count in sorted(list(repair_status.keyspace_repairs.items()))])
+    family('range_repair_keyspace_pending_repairs', 'gauge', 'Pending nodetool repair calls by keyspace.',
+           [('', [('keyspace', keyspace)], count)
+            for keyspace, count in sorted(list(repair_status.keyspace_pending.items()))])
+    if repair_status.concurrency is not None:
+        family('range_repair_concurrency', 'gauge', 'Steps allowed to run at once by --adaptive-workers.',
+               [('', [], repair_status.concurrency)])
+
+    timings = repair_status.timings
+    family('range_repair_retries', 'counter', 'Retried nodetool repair calls.', [('_total', [], timings.retries)])
+    family('range_repair_run_phase_seconds', 'gauge', 'Seconds spent on topology discovery and planning.',
+           [('', [('phase', phase)], seconds) for phase, seconds in sorted(list(timings.run.items()))])
+    samples = []
+    for phase, histogram in sorted(list(timings.phases.items())):
+        cumulative = 0
+        for bound, count in zip(TIMING_BUCKETS + (None,), list(histogram['counts'])):
+            cumulative += count
+            samples.append(('_bucket', [('phase', phase), ('le', '+Inf' if bound is None else repr(float(bound)))],
+                            cumulative))
+        samples.append(('_sum', [('phase', phase)], histogram['sum']))
+        samples.append(('_count', [('phase', phase)], cumulative))
+    family('range_repair_phase_seconds', 'histogram', 'Seconds nodetool repair calls spent in each phase.', samples)
+    if openmetrics:
+        lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves render_metrics on /metrics for MetricsServer.
+    """
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+        body = render_metrics(self.server.repair_status, self.server.completion_since, openmetrics).encode('utf-8')
+        self.send_response(200)
+        if openmetrics:
+            self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+        else:
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('metrics: ' + format, *args)
+
+
+class MetricsServer(object):
+    """
+    HTTP endpoint serving the live metrics of a repair from memory, on a
+    daemon thread, so that monitoring does not have to read the status file.
+    """
+
+    def __init__(self, address, port, repair_status):
+        """
+        Init.
+
+        :param str address: Address to listen on.
+        :param int port: Port to listen on, 0 for any free port.
+        :param RepairStatus repair_status: Repair status.
+        """
+        self.httpd = ThreadingHTTPServer((address, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.repair_status = repair_status
+        self.httpd.completion_since = (time.time(), repair_status.successful_count + repair_status.failed_count)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        logging.info('Serving repair metrics on http://{0}:{1}/metrics'.format(self.httpd.server_address[0],
+                                                                              self.port))
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+
+def start_metrics_server(options, repair_status):
+    """Serve the metrics of a repair if --metrics-port is set.
+    :param options: OptionParser result
+    :param RepairStatus repair_status: Repair status.
+    :returns: MetricsServer, or None
+    """
+    if options.metrics_port is None:
+        return None
+    server = MetricsServer(options.metrics_address, options.metrics_port, repair_status)
+    server.start()
+    return server
+
+
+class CommandBackend(object):
+    """
+    Runs nodetool commands on behalf of run_command.
+    """
+
+    def run(self, *command, timings=None):
+        """
+        Execute a command and return the output.
+
+        :param command: the command to be run and all of the arguments
+        :param dict timings: Seconds by phase, to add the spawn and nodetool time of the command to.
+
+        :rtype: tuple
+        :return: success_boolean, command_string, stdout, stderr
+        """
+        raise NotImplementedError()
+
+    def stream(self, *command):
+        """
+        Execute a command and iterate over its output one line at a time.
+        Backends that cannot stream return the lines of the full output.
+
+        :param command: the command to be run and all of the arguments
+
+        :rtype: iterator
+        :return: Lines of stdout, without line endings, with a close method.
+                 Raises once the lines are exhausted if the command failed.
+        """
+        success, cmd, stdout, stderr = self.run(*command)
+        if not success:
+            raise Exception("{0} failed: {1}".format(cmd, stderr))
+        return (line for line in stdout.splitlines())
+
+    def close(self):
+        """
+        Release anything the backend holds on to.
+        """
+        pass
+
+
+class ProcessBackend(CommandBackend):
+    """
+    Start a new shell, and so a new nodetool JVM, for every command.
+    """
+
+    def run(self, *command, timings=None):
+        cmd = " ".join(map(str, command))
+        logging.debug("run_command: " + cmd)
+        started = time.time()
+        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, universal_newlines=True)
+        spawned = time.time()
+        stdout, stderr = proc.communicate()
+        add_timing(timings, 'spawn', spawned - started)
+        add_timing(timings, 'nodetool', time.time() - spawned)
+        return proc.returncode == 0, cmd, stdout, stderr
+
+    def stream(self, *command):
+        cmd = " ".join(map(str, command))
+        logging.debug("stream_command: " + cmd)
+        # stderr goes to a file so that a chatty command cannot block on a
+        # full pipe while stdout is being read
+        stderr = tempfile.TemporaryFile(mode='w+')
+        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                                stderr=stderr, universal_newlines=True)
+        return CommandLines(cmd, proc, stderr)
+
+
+class CommandLines(six.Iterator):
+    """
+    Iterate over the stdout of a running command, one line at a time.
+    """
+
+    def __init__(self, cmd, proc, stderr):
+        self.cmd = cmd
+        self.proc = proc
+        self.lines = iter(proc.stdout)
+        self.stderr = stderr
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self.lines, None)
+        if line is not None:
+            return line.rstrip('\n')
+        returncode = self.proc.wait()
+        self.stderr.seek(0)
+        stderr = self.stderr.read()
+        self.close()
+        if returncode != 0:
+            raise Exception("{0} failed: {1}".format(self.cmd, stderr))
+        raise StopIteration
+
+    def close(self):
+        """
+        Stop the command if it is still running and release its pipes.
+        """
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc.stdout.close()
+        self.stderr.close()
+
+
+class SessionBackend(CommandBackend):
+    """
+    Send every command to one long-lived helper process, so the JVM start and
+    JMX handshake are paid once instead of once per command.
+
+    The helper reads one JSON request per line on stdin:
+
+        {"id": 1, "args": ["nodetool", "-h", "host", "-p", "7199", "ring"]}
+
+    and answers on stdout with any number of output chunks followed by a
+    final record carrying the return code, one JSON object per line:
+
+        {"id": 1, "stdout": "partial output"}
+        {"id": 1, "returncode": 0, "stdout": "rest of the output", "stderr": ""}
+
+    Requests may be answered in any order.  A helper is started lazily in
+    each process that uses the backend.
+    """
+
+    def __init__(self, helper):
+        """
+        Init.
+
+        :param str helper: Command line that starts the helper.
+        """
+        self.helper = helper
+        self.proc = None
+        self.pid = None
+        self.next_id = 0
+        self.pending = {}
+        # lock guards the helper and the pending requests; write_lock only
+        # serialises requests on stdin, so a caller blocked writing never
+        # stops the reader thread from draining the helper's output.
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    def run(self, *command, timings=None):
+        cmd = " ".join(map(str, command))
+        logging.debug("run_command (session): " + cmd)
+        started = time.time()
+        done = threading.Event()
+        with self.lock:
+            self._ensure_started()
+            self.next_id += 1
+            request_id = self.next_id
+            response = {'done': done, 'stdout': [], 'stderr': '', 'returncode': None}
+            self.pending[request_id] = response
+            proc = self.proc
+        try:
+            with self.write_lock:
+                proc.stdin.write(json.dumps({'id': request_id, 'args': shlex.split(cmd)}) + '\n')
+                proc.stdin.flush()
+        except (IOError, OSError, ValueError) as e:
+            with self.lock:
+                self.pending.pop(request_id, None)
+            return False, cmd, '', 'Session helper unavailable: {0}'.format(e)
+        sent = time.time()
+        done.wait()
+        add_timing(timings, 'spawn', sent - started)
+        add_timing(timings, 'nodetool', time.time() - sent)
+        return response['returncode'] == 0, cmd, ''.join(response['stdout']), response['stderr']
+
+    def close(self):
+        with self.lock:
+            proc = self.proc
+            self.proc = None
+        if proc is not None and self.pid == os.getpid():
+            proc.stdin.close()
+            proc.wait()
+
+    def _ensure_started(self):
+        """
+        Start the helper if this process does not have one yet.  A forked
+        worker must not share its parent's pipes, so it gets its own.
+        """
+        if self.proc is not None and self.pid == os.getpid():
+            return
+        logging.debug("Starting nodetool session helper: " + self.helper)
+        self.proc = subprocess.Popen(shlex.split(self.helper), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     universal_newlines=True)
+        self.pid = os.getpid()
+        self.pending = {}
+        reader = threading.Thread(target=self._read_responses, args=(self.proc,))
+        reader.daemon = True
+        reader.start()
+
+    def _read_responses(self, proc):
+        """
+        Hand helper output to the waiting callers until the helper exits.
+
+        :param proc: Helper process.
+        """
+        for line in proc.stdout:
+            message = json.loads(line)
+            with self.lock:
+                response = self.pending.get(message['id'])
+                if response is None:
+                    continue
+                response['stdout'].append(message.get('stdout', ''))
+                if 'returncode' in message:
+                    response['stderr'] = message.get('stderr', '')
+                    response['returncode'] = message['returncode']
+                    del self.pending[message['id']]
+                    response['done'].set()
+        # The helper went away: fail whatever it did not answer, and start a
+        # new helper for the next command.
+        with self.lock:
+            if self.proc is proc:
+                for response in self.pending.values():
+                    response['stderr'] = 'Session helper exited'
+                    response['returncode'] = -1
+                    response['done'].set()
+                self.pending = {}
+                self.proc = None
+        proc.wait()
+
+
+# The backend run_command uses, see configure_command_backend.
+command_backend = ProcessBackend()
+
+
+def configure_command_backend(options):
+    """Select the command backend requested on the command line.  Calling
+    this again with the same options keeps the existing backend.
+    :param options: OptionParser result
+    :returns: None
+    """
+    global command_backend
+    if options.command_backend == 'session':
+        if not (isinstance(command_backend, SessionBackend) and command_backend.helper == options.session_helper):
+            command_backend.close()
+            command_backend = SessionBackend(options.session_helper)
+    elif not isinstance(command_backend, ProcessBackend):
+        command_backend.close()
+        command_backend = ProcessBackend()
+
+
+def run_command(*command, timings=None):
+    """Execute a shell command and return the output
+    :param command: the command to be run and all of the arguments
+    :param dict timings: Seconds by phase, to add the spawn and nodetool time of the command to.
+    :returns: success_boolean, command_string, stdout, stderr
+    """
+    return command_backend.run(*command, timings=timings)
+
+
+def stream_command(*command):
+    """Execute a shell command and iterate over its output line by line.
+    The command is started before this returns.
+    :param command: the command to be run and all of the arguments
+    :returns: iterator over lines of stdout
+    """
+    return command_backend.stream(*command)
+
+
+async def run_command_async(*command, timings=None):
+    """Execute a command without blocking the event loop and return the output.
+    The command line is split the same way the shell splits the one run by
+    run_command, but no shell is started.
+    :param command: the command to be run and all of the arguments
+    :param dict timings: Seconds by phase, to add the spawn and nodetool time of the command to.
+    :returns: success_boolean, command_string, stdout, stderr
+    """
+    if not isinstance(command_backend, ProcessBackend):
+        # AsyncioExecutor sizes the default executor to --workers
+        return await asyncio.get_event_loop().run_in_executor(
+            None, functools.partial(run_command, *command, timings=timings))
+    cmd = " ".join(map(str, command))
+    logging.debug("run_command_async: " + cmd)
+    started = time.time()
+    proc = await asyncio.create_subprocess_exec(*shlex.split(cmd), stdout=subprocess.PIPE,
+                                                stderr=subprocess.PIPE)
+    spawned = time.time()
+    stdout, stderr = await proc.communicate()
+    add_timing(timings, 'spawn', spawned - started)
+    add_timing(timings, 'nodetool', time.time() - spawned)
+    return proc.returncode == 0, cmd, stdout.decode(), stderr.decode()
+
+
+def repair_range(options, start, end, step, nodeposition, repair_status=None, queued=None):
+    """Repair a keyspace/columnfamily between a given token range with nodetool
+    :param options: OptionParser result
+    :param start: Beginning token in the range to repair (formatted string)
+    :param end: Ending token in the range to repair (formatted string)
+    :param step: The step we're executing (for logging purposes)
+    :param nodeposition: string to indicate which node this particular step is for.
+    :param RepairStatus repair_status: Repair status.
+    :param queued: Seconds the step waited for a worker.
+    :returns: whether every repair succeeded, seconds spent running nodetool repair
+    """
+    success, duration = True, 0
+    for keyspace, column_families in expand_repair_range(options, start, end, step, nodeposition):
+        ok, seconds = _repair_range(options, start, end, step, nodeposition, keyspace, column_families, repair_status,
+                                    queued)
+        success, duration, queued = success and ok, duration + seconds, None
+    return success, duration
+
+
+async def async_repair_range(options, start, end, step, nodeposition, repair_status=None, queued=None):
+    """Coroutine version of repair_range, for the asyncio executor.
+    :param options: OptionParser result
+    :param start: Beginning token in the range to repair (formatted string)
+    :param end: Ending token in the range to repair (formatted string)
+    :param step: The step we're executing (for logging purposes)
+    :param nodeposition: string to indicate which node this particular step is for.
+    :param RepairStatus repair_status: Repair status.
+    :param queued: Seconds the step waited for a worker.
+    :returns: whether every repair succeeded, seconds spent running nodetool repair
+    """
+    if options.exclude_step:
+        # Excluding a single keyspace runs nodetool cfstats.
+        jobs = await asyncio.get_event_loop().run_in_executor(
+            None, expand_repair_range, options, start, end, step, nodeposition)
+    else:
+        jobs = expand_repair_range(options, start, end, step, nodeposition)
+    success, duration = True, 0
+    for keyspace, column_families in jobs:
+        ok, seconds = await _async_repair_range(options, start, end, step, nodeposition, keyspace, column_families,
+                                                repair_status, queued)
+        success, duration, queued = success and ok, duration + seconds, None
+    return success, duration
+
+
+def expand_repair_range(options, start, end, step, nodeposition):
+    """Work out the nodetool repair calls needed for one step, honouring --exclude-step
+    :param options: OptionParser result
+    :param start: Beginning token in the range to repair (formatted string)
+    :param end: Ending token in the range to repair (formatted string)
+    :param step: The step we're executing (for logging purposes)
+    :param nodeposition: string to indicate which node this particular step is for.
+    :returns: list of (keyspace, column_families) to repair
+    """
+    if options.exclude_step:
+        (excluded, exclude_step) = is_excluded(options, start, end, step, nodeposition)
+        if excluded == 1:
+            logging.debug(
+                "{nodeposition} step {step:04d} skipping range ({start}, {end}) for keyspace {keyspace}".format(
+                    step=step,
+                    start=start,
+                    end=end,
+                    nodeposition=nodeposition,
+                    keyspace=options.keyspace or "<all>"))
+            return []
+        elif excluded == 2:
+            logging.info(
+                'Running individual repair commands for each keyspace to exclude {0} {1}'.format(
+                    exclude_step['keyspace'],
+                    exclude_step['column_family'] or ''))
+            jobs = []
+            for keyspace, column_families in six.iteritems(enumerate_keyspaces(options)):
+                if keyspace == exclude_step['keyspace']:
+                    if exclude_step['column_family']:
+                        logging.info('Repairing all column families except {0} for keyspace {1}'.format(
+                            exclude_step['column_family'],
+                            keyspace))
+                        cf_to_repair = [cf for cf in column_families if cf != exclude_step['column_family']]
+                        jobs.append((keyspace, cf_to_repair))
+                        continue
+                    else:
+                        logging.debug(
+                            "{nodeposition} step {step:04d} skipping range ({start}, {end}) for keyspace {keyspace}".format(
+                                step=step,
+                                start=start,
+                                end=end,
+                                nodeposition=nodeposition,
+                                keyspace=keyspace))
+                        continue
+                jobs.append((keyspace, options.columnfamily))
+            return jobs
+    # Normal repair_range
+    return [(options.keyspace, options.columnfamily)]
+
+
+def build_repair_command(options, start, end, keyspace=None, column_families=None):
+    """Build the nodetool repair command for a range
+    :param options: OptionParser result
+    :param start: Beginning token in the range to repair (formatted string)
+    :param end: Ending token in the range to repair (formatted string)
+    :param keyspace: Keyspace to repair.
+    :param column_families: List of column families to repair.
+    :returns: list of command arguments
+    """
+    cmd = [options.nodetool, "-h", options.host, "-p", options.port, "repair"]
+    if options.full: cmd.append('-full')
+    if keyspace: cmd.append(keyspace)
+    cmd.extend(column_families or options.columnfamily)
+
+    # -local flag cannot be used in conjunction with -pr
+    if options.local:
+        cmd.extend([options.local])
+    else:
+        cmd.extend(["-pr"])
+
+    cmd.extend([options.par, options.inc, options.snapshot,
+                 "-st", start, "-et", end])
+    return cmd
+
+
+def _repair_range(options, start, end, step, nodeposition, keyspace=None, column_families=None, repair_status=None,
+                  queued=None):
+    """Repair a keyspace/columnfamily between a given token range with nodetool
+    :param options: OptionParser result
+    :param start: Beginning token in the range to repair (formatted string)
+    :param end: Ending token in the range to repair (formatted string)
+    :param step: The step we're executing (for logging purposes)
+    :param nodeposition: string to indicate which node this particular step is for.
+    :param keyspace: Keyspace to repair.
+    :param column_families: List of column families to repair.
+    :param RepairStatus repair_status: Repair status.
+    :param queued: Seconds the step waited for a worker.
+    :returns: whether the repair succeeded, seconds spent running nodetool repair
+    """
+    logging.debug(
+        "{nodeposition} step {step:04d} repairing range ({start}, {end}) for keyspace {keyspace}".format(
+            step=step,
+            start=start,
+            end=end,
+            nodeposition=nodeposition,
+            keyspace=keyspace or "<all>"))
+
+    cmd = build_repair_command(options, start, end, keyspace, column_families)
+    cmd_str = ' '.join(map(str, cmd))
+
+    if repair_status:
+        repair_status.repair_start(cmd_str, step, start, end, nodeposition, keyspace, column_families)
+
+    stderr = None
+    timings = {} if queued is None else {'queued': queued}
+    if not options.dry_run:
+        seconds_to_sleep = random.uniform(0, options.max_sleep_before_run)
+        logging.info("Sleeping for {0} seconds before run.".format(seconds_to_sleep))
+        started = time.time()
+        time.sleep(seconds_to_sleep)
+        timings['sleep'] = time.time() - started
+
+        retry_options = ExponentialBackoffRetryerConfig(options.max_tries, options.initial_sleep,
+            options.sleep_factor, options.max_sleep)
+        retryer = ExponentialBackoffRetryer(retry_options, lambda x: x[0], run_command)
+        started = time.time()
+        success, cmd, _, stderr = retryer(*cmd, timings=timings)
+        duration = time.time() - started
+        timings['backoff'] = retryer.slept
+        timings['retries'] = retryer.tries - 1
+    else:
+        print("{step:04d}/{nodeposition}".format(nodeposition=nodeposition, step=step), " ".join([str(x) for x in cmd]))
+        success = True
+        duration = 0
+    _finish_repair_range(success, cmd, cmd_str, stderr, step, start, end, nodeposition, keyspace, column_families,
+                         repair_status, duration, timings)
+    return success, duration
+
+
+async def _async_repair_range(options, start, end, step, nodeposition, keyspace=None, column_families=None,
+                              repair_status=None, queued=None):
+    """Coroutine version of _repair_range, for the asyncio executor.
+    :param options: OptionParser result
+    :param start: Beginning token in the range to repair (formatted string)
+    :param end: Ending token in the range to repair (formatted string)
+    :param step: The step we're executing (for logging purposes)
+    :param nodeposition: string to indicate which node this particular step is for.
+    :param keyspace: Keyspace to repair.
+    :param column_families: List of column families to repair.
+    :param RepairStatus repair_status: Repair status.
+    :param queued: Seconds the step waited for a worker.
+    :returns: whether the repair succeeded, seconds spent running nodetool repair
+    """
+    logging.debug(
+        "{nodeposition} step {step:04d} repairing range ({start}, {end}) for keyspace {keyspace}".format(
+            step=step,
+            start=start,
+            end=end,
+            nodeposition=nodeposition,
+            keyspace=keyspace or "<all>"))
+
+    cmd = build_repair_command(options, start, end, keyspace, column_families)
+    cmd_str = ' '.join(map(str, cmd))
+
+    if repair_status:
+        repair_status.repair_start(cmd_str, step, start, end, nodeposition, keyspace, column_families)
+
+    stderr = None
+    timings = {} if queued is None else {'queued': queued}
+    if not options.dry_run:
+        seconds_to_sleep = random.uniform(0, options.max_sleep_before_run)
+        logging.info("Sleeping for {0} seconds before run.".format(seconds_to_sleep))
+        started = time.time()
+        await asyncio.sleep(seconds_to_sleep)
+        timings['sleep'] = time.time() - started
+
+        retry_options = ExponentialBackoffRetryerConfig(options.max_tries, options.initial_sleep,
+            options.sleep_factor, options.max_sleep)
+        retryer = AsyncExponentialBackoffRetryer(retry_options, lambda x: x[0], run_command_async)
+        started = time.time()
+        success, cmd, _, stderr = await retryer(*cmd, timings=timings)
+        duration = time.time() - started
+        timings['backoff'] = retryer.slept
+        timings['retries'] = retryer.tries - 1
+    else:
+        print("{step:04d}/{nodeposition}".format(nodeposition=nodeposition, step=step), " ".join([str(x) for x in cmd]))
+        success = True
+        duration = 0
+    _finish_repair_range(success, cmd, cmd_str, stderr, step, start, end, nodeposition, keyspace, column_families,
+                         repair_status, duration, timings)
+    return success, duration
+
+
+def _finish_repair_range(success, cmd, cmd_str, stderr, step, start, end, nodeposition, keyspace, column_families,
+                         repair_status, duration=0, timings=None):
+    """Record and log the outcome of a repair step
+    :param success: Whether the repair succeeded.
+    :param cmd: Command that was run.
+    :param cmd_str: Command string recorded in the repair status.
+    :param stderr: Error output of the command.
+    :param step: The step we're executing (for logging purposes)
+    :param start: Beginning token in the range to repair (formatted string)
+    :param end: Ending token in the range to repair (formatted string)
+    :param nodeposition: string to indicate which node this particular step is for.
+    :param keyspace: Keyspace to repair.
+    :param column_families: List of column families to repair.
+    :param RepairStatus repair_status: Repair status.
+    :param duration: Seconds nodetool repair ran for.
+    :param dict timings: Seconds the repair spent in each phase, see PhaseTimings.
+    :returns: None
+    """
+    if timings:
+        # Microseconds are plenty, and keep the journal records short
+        timings = {phase: round(seconds, 6) for phase, seconds in six.iteritems(timings)}
+    if not success:
+        if repair_status:
+            repair_status.repair_fail(cmd_str, step, start, end, nodeposition, keyspace, column_families, timings)
+        logging.error("FAILED: {nodeposition} step {step:04d} {cmd}".format(nodeposition=nodeposition, step=step, cmd=cmd))
+        logging.error(stderr)
+        return
+    else:
+        if repair_status:
+            repair_status.repair_success(cmd_str, step, start, end, nodeposition, keyspace, column_families, timings)
+    logging.debug("{nodeposition} step {step:04d} complete in {duration:.1f}s".format(
+        nodeposition=nodeposition, step=step, duration=duration))
+    return
+
+def setup_logging(option_group):
+    """Sets up logging in a syslog format by log level
+    :param option_group: options as returned by the OptionParser
+    """
+    stderr_log_format = "%(levelname) -10s %(asctime)s %(funcName) -20s line:%(lineno) -5d: %(message)s"
+    file_log_format = "%(asctime)s - %(levelname)s - %(message)s"
+    logger = logging.getLogger()
+    if option_group.debug:
+        logger.setLevel(level=logging.DEBUG)
+    elif option_group.verbose:
+        logger.setLevel(level=logging.INFO)
+    else:
+        logger.setLevel(level=logging.WARNING)
+
+    handlers = []
+    if option_group.syslog:
+        handlers.append(logging.handlers.SysLogHandler(facility=option_group.syslog))
+        # Use standard format here because timestamp and level will be added by syslogd.
+    if option_group.logfile:
+        handlers.append(logging.FileHandler(option_group.logfile))
+        handlers[0].setFormatter(logging.Formatter(file_log_format))
+    if not handlers:
+        handlers.append(logging.StreamHandler())
+        handlers[0].setFormatter(logging.Formatter(stderr_log_format))
+    for handler in handlers:
+        logger.addHandler(handler)
+    return
+
+
+def repair(options):
+    """Repair a keyspace/columnfamily by breaking each token range into $start_steps ranges
+    :param options.keyspace: Cassandra keyspace to repair
+    :param options.host: (optional) Hostname to pass to nodetool
+    :param options.port: (optional) JMX Port to pass to nodetool
+    :param options.steps: Number of sub-ranges to split primary range in to
+    :param options.workers: Number of workers to use
+    """
+    if options.plan_file:
+        return repair_plan_file(options)
+    tokens = TokenContainer(options)
+    planning_started = time.time()
+    if options.cluster:
+        hosts = [(host, tokens.for_host(address)) for host, address in cluster_hosts(options, tokens)]
+        logging.info("Repairing {0} hosts: {1}".format(len(hosts), ', '.join(host for host, _ in hosts)))
+    else:
+        hosts = [(None, tokens)]
+    if options.compile_plan:
+        return compile_plan(options, tokens, hosts)
+
+    repair_status = RepairStatus()
+    signal.signal(signal.SIGTERM, exit_on_signal)
+    metrics_server = start_metrics_server(options, repair_status)
+    try:
+        # TODO: Modifying options.resume to use dictionary instead of offset.
+        if options.resume:
+            repair_status.resume(options, tokens)
+            steps = resumed_steps(repair_status, options.per_table)
+            if repair_status.progress is not None:
+                if options.cluster or options.target_step_duration or options.per_table:
+                    raise Exception('Cannot resume, the repair status is in the compact format, which cannot be used '
+                                    'with --cluster, --target-step-duration or --per-table')
+                # Steps are regenerated in the same order and skipped by index
+                steps = PlannedSteps(options, tokens)
+                repair_status.progress.check_plan(len(steps), plan_fingerprint(options, hosts))
+                steps = ProgressStepPlan(steps, repair_status)
+            elif options.per_table:
+                steps = TableStepPlan(options, steps)
+            elif options.target_step_duration or repair_status.plans:
+                steps = DynamicStepPlan(options, tokens, repair_status, steps)
+                for nodeposition, plan in repair_status.plans.items():
+                    steps.add_plan(nodeposition, dict(plan))
+        else:
+            repair_status.start(options, [host for host, _ in hosts] if options.cluster else None)
+            if options.status_format == 'compact':
+                steps = PlannedSteps(options, tokens)
+                repair_status.track_progress(len(steps), plan_fingerprint(options, hosts))
+                steps = ProgressStepPlan(steps, repair_status)
+            elif options.target_step_duration:
+                steps = DynamicStepPlan(options, tokens, repair_status)
+                for host, host_tokens in hosts:
+                    steps.add_host_ranges(options.offset, host_tokens, host)
+            elif options.per_table:
+                tables = tokens.timed_phase('cfstats', lambda: repair_tables(options))
+                steps = TableStepPlan(options, interleave(*[
+                    per_table_steps(options, host_tokens, repair_status, host, tables) for host, host_tokens in hosts]))
+            else:
+                steps = interleave(*[
+                    planned_steps(options, host_tokens, repair_status, host) for host, host_tokens in hosts])
+        if not isinstance(steps, StepPlan):
+            # Generating a step records it as pending, which is what --resume
+            # goes by, so take every step before any of them runs.
+            steps = StepPlan(list(steps))
+        if options.replica_aware:
+            steps = ReplicaStepPlan(options, build_replica_map(options, tokens), steps, repair_status)
+        run_timings = dict(tokens.discovery_timings)
+        run_timings['planning'] = time.time() - planning_started - run_timings.get('cfstats', 0)
+        if 'total' in run_timings:
+            run_timings['discovery'] = run_timings.pop('total')
+        logging.info("Planning took {0:.3f}s".format(run_timings['planning']))
+        repair_status.set_run_timings(run_timings)
+        run_repair_steps(options, steps, repair_status)
+        repair_status.finish()
+    finally:
+        repair_status.flush()
+        if metrics_server is not None:
+            metrics_server.stop()
+    return
+
+
+def compile_plan(options, tokens, hosts):
+    """Write every step of the hosts' primary ranges to options.compile_plan,
+    for later runs with --plan-file.
+    :param options: OptionParser result
+    :param TokenContainer tokens: Tokens of the whole ring.
+    :param list hosts: (host, TokenContainer) of every host, host None for a
+                       single host repair.
+    :returns: None
+    """
+    width = 16 if tokens.RANGE_MAX >= 2**63 else 8
+    count = CompiledPlan.write(options.compile_plan, width, [(host, len(t.host_ranges)) for host, t in hosts],
+                               interleave(*[((index,) + step for step in host_sub_range_tokens(options, host_tokens))
+                                            for index, (host, host_tokens) in enumerate(hosts)]))
+    logging.info("Compiled {0} steps into {1}".format(count, options.compile_plan))
+    return
+
+
+def repair_plan_file(options):
+    """Run the steps of a plan compiled with --compile-plan.  The ring is
+    only read again for --replica-aware.
+    :param options: OptionParser result
+    :returns: None
+    """
+    plan = CompiledPlan(options.plan_file)
+    repair_status = RepairStatus()
+    signal.signal(signal.SIGTERM, exit_on_signal)
+    metrics_server = start_metrics_server(options, repair_status)
+    try:
+        if options.resume:
+            repair_status.resume(options, None)
+            if repair_status.progress is not None:
+                repair_status.progress.check_plan(len(plan), plan.fingerprint(options))
+                steps = ProgressStepPlan(plan, repair_status)
+            else:
+                steps = CompiledStepPlan(options, plan, repair_status)
+        else:
+            repair_status.start(options, plan.hosts if plan.hosts != [None] else None)
+            repair_status.set_plan_file(options.plan_file, len(plan))
+            if options.status_format == 'compact':
+                repair_status.track_progress(len(plan), plan.fingerprint(options))
+                steps = ProgressStepPlan(plan, repair_status)
+            else:
+                steps = CompiledStepPlan(options, plan)
+        if options.replica_aware:
+            steps = ReplicaStepPlan(options, build_replica_map(options, TokenContainer(options)), steps, repair_status)
+        run_repair_steps(options, steps, repair_status)
+        repair_status.finish()
+    finally:
+        repair_status.flush()
+        plan.close()
+        if metrics_server is not None:
+            metrics_server.stop()
+    return
+
+
+def write_profile(profiler, filename):
+    """Stop profiling, write the statistics to a file and log the functions
+    that took the most time.
+    :param cProfile.Profile profiler: Running profiler.
+    :param filename: Statistics file.
+    :returns: None
+    """
+    profiler.disable()
+    profiler.dump_stats(filename)
+    report = six.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(20)
+    logging.info("Profile written to {0}:\n{1}".format(filename, report.getvalue()))
+
+
+def exit_on_signal(signum, frame):
+    """Signal handler that turns a signal into a normal interpreter exit, so
+    cleanup such as flushing the repair status runs.
+    :param signum: Signal number.
+    :param frame: Current stack frame.
+    """
+    logging.warning('Received signal {0}, exiting'.format(signum))
+    sys.exit(128 + signum)
+
+
+def planned_steps(options, tokens, repair_status, host=None):
+    """Generate every repair step of the host's primary ranges, recording each
+    one as pending before it is handed out.
+    :param options: OptionParser result
+    :param TokenContainer tokens: Tokens.
+    :param RepairStatus repair_status: Repair status.
+    :param host: Host, for a --cluster repair.
+    :returns: start, end, step, nodeposition
+    """
+    for start, end, step, nodeposition in host_sub_ranges(options, tokens, host):
+        repair_status.add_pending_repair(
+            RepairTask('', step, start, end, nodeposition, options.keyspace, options.columnfamily))
+        yield start, end, step, nodeposition
+
+
+def plan_fingerprint(options, hosts):
+    """Fingerprint of the steps host_sub_ranges generates for some hosts,
+    from the options, the keyspace and column families every step repairs,
+    and the host ranges the steps are cut from.
+    :param options: OptionParser result
+    :param list hosts: (host, TokenContainer) of every host, host None for a
+                       single host repair.
+    :returns: hex digest
+    """
+    plan = [options.steps, options.offset, options.keyspace, options.columnfamily,
+            [[host, [[str(start), str(end)] for start, end in tokens.host_ranges]] for host, tokens in hosts]]
+    return hashlib.sha1(json.dumps(plan).encode('utf-8')).hexdigest()
+
+
+def planned_key(options, start, end, step, nodeposition):
+    """Key of a step of planned_steps in the repair status.
+    :param options: OptionParser result
+    :param start: Beginning token in the range to repair (formatted string)
+    :param end: Ending token in the range to repair (formatted string)
+    :param step: The step number.
+    :param nodeposition: Node position of the step.
+    :returns: key tuple
+    """
+    return RepairTask.identity(step, start, end, nodeposition, options.keyspace, options.columnfamily)
+
+
+def host_sub_ranges(options, tokens, host=None):
+    """Generate every sub-range of the host's primary ranges, skipping the
+    first options.offset ranges.
+    :param options: OptionParser result
+    :param TokenContainer tokens: Tokens.
+    :param host: Host, for a --cluster repair.
+    :returns: start, end, step, nodeposition
+    """
+    for count, (range_start, range_termination) in offset_host_ranges(options, tokens):
+        nodeposition = format_nodeposition(count, len(tokens.host_ranges), host)
+        for start, end, step in tokens.sub_range_generator(range_start, range_termination, options.steps):
+            yield start, end, step, nodeposition
+
+
+def host_sub_range_tokens(options, tokens):
+    """Generate the sub-ranges of host_sub_ranges with their tokens left
+    unformatted, and the range number in place of the node position.
+    :param options: OptionParser result
+    :param TokenContainer tokens: Tokens.
+    :returns: start token, end token, step, range number
+    """
+    for count, (range_start, range_termination) in offset_host_ranges(options, tokens):
+        for start, end, step in tokens.sub_range_tokens(range_start, range_termination, options.steps):
+            yield start, end, step, count
+
+
+def offset_host_ranges(options, tokens):
+    """Generate the host's primary ranges, skipping the first options.offset.
+    :param options: OptionParser result
+    :param TokenContainer tokens: Tokens.
+    :returns: range number, from 1, and (start, end) of the range
+    """
+    for token_num, host_range in enumerate(tokens.host_ranges):
+        if token_num < options.offset:
+            logging.info(
+                "[{count}/{total}] skipping token..".format(
+                    count=token_num + 1,
+                    total=len(tokens.host_ranges)))
+            continue
+        yield token_num + 1, host_range
+
+
+def per_table_steps(options, tokens, repair_status, host=None, tables=None):
+    """Generate a repair step for every table and every sub-range of the
+    host's primary ranges, recording each one as pending before it is handed
+    out.  Steps come range by range, with every table of a range in turn.
+    :param options: OptionParser result
+    :param TokenContainer tokens: Tokens.
+    :param RepairStatus repair_status: Repair status.
+    :param host: Host, for a --cluster repair.
+    :param tables: Tables to repair, if already known, as returned by repair_tables.
+    :returns: start, end, step, nodeposition, keyspace, column_families
+    """
+    if tables is None:
+        tables = repair_tables(options)
+    logging.info('Repairing {0} tables one at a time'.format(len(tables)))
+    for start, end, step, nodeposition in host_sub_ranges(options, tokens, host):
+        for keyspace, table in tables:
+            if is_table_excluded(options, step, nodeposition, keyspace, table):
+                logging.debug(
+                    "{nodeposition} step {step:04d} skipping range ({start}, {end}) for table {table}".format(
+                        step=step, start=start, end=end, nodeposition=nodeposition,
+                        table=keyspace + '.' + table))
+                continue
+            column_families = [table]
+            repair_status.add_pending_repair(
+                RepairTask('', step, start, end, nodeposition, keyspace, column_families))
+            yield start, end, step, nodeposition, keyspace, column_families
+
+
+def repair_tables(options):
+    """List the tables --per-table repairs: those of --columnfamily, or else
+    every table of --keyspace, or else every table of every keyspace that is
+    not local to each node.
+    :param options: OptionParser result
+    :returns: list of (keyspace, table)
+    """
+    if options.keyspace and options.columnfamily:
+        return [(options.keyspace, table) for table in options.columnfamily]
+    tables = []
+    for keyspace, keyspace_tables in sorted(six.iteritems(enumerate_keyspaces(options))):
+        if keyspace in LOCAL_KEYSPACES or (options.keyspace and keyspace != options.keyspace):
+            continue
+        tables.extend((keyspace, table) for table in keyspace_tables)
+    return tables
+
+
+def cluster_hosts(options, tokens):
+    """Work out the hosts a --cluster repair covers: those of --hosts, or else
+    every member of the ring (of --datacenter, if given).
+    :param options: OptionParser result
+    :param TokenContainer tokens: Tokens, with the ring owners.
+    :returns: list of (host, ring address)
+    """
+    if not options.hosts:
+        return [(address, address) for address in tokens.ring_nodes]
+    hosts = []
+    for host in (host for value in options.hosts for host in value.split(',') if host):
+        address = host if host in tokens.ring_nodes else socket.gethostbyname(host)
+        if address not in tokens.ring_nodes:
+            raise Exception("{0} ({1}) is not a member of the ring".format(host, address))
+        hosts.append((host, address))
+    return hosts
+
+
+def interleave(*iterables):
+    """Take an item from each iterable in turn, until all of them are exhausted.
+    :param iterables: Iterables.
+    :returns: items
+    """
+    iterators = collections.deque(iter(iterable) for iterable in iterables)
+    while iterators:
+        iterator = iterators.popleft()
+        for item in iterator:
+            yield item
+            iterators.append(iterator)
+            break
+
+
+def resumed_steps(repair_status, per_table=False):
+    """Generate the repair steps still pending in a resumed repair status.
+    :param RepairStatus repair_status: Repair status.
+    :param per_table: Whether the steps were planned by per_table_steps.
+    :returns: start, end, step, nodeposition, and with per_table keyspace, column_families
+    """
+    for pending in list(repair_status.gp().values()):
+        if per_table:
+            yield (pending.start, pending.end, pending.step, pending.nodeposition,
+                   pending.keyspace, list(pending.column_families))
+        else:
+            yield pending.start, pending.end, pending.step, pending.nodeposition
+
+
+class StepPlan(object):
+    """
+    Hands repair steps to run_repair_steps, here from a fixed iterable.
+    """
+
+    # Whether step_done has to hear about a step soon after it finishes.  If
+    # so, only options.workers steps are handed to the executor at a time.
+    feedback = False
+
+    def __init__(self, steps=()):
+        """
+        Init.
+
+        :param steps: Iterable of (start, end, step, nodeposition).
+        """
+        self.steps = iter(steps)
+
+    def next_step(self):
+        """
+        Take the next step to run.
+
+        :rtype: tuple
+        :return: start, end, step, nodeposition, or None when there are no more steps.
+        """
+        return next(self.steps, None)
+
+    def step_done(self, step, success, duration):
+        """
+        Take note of a finished step.
+
+        :param tuple step: start, end, step, nodeposition.
+        :param bool success: Whether every repair of the step succeeded.
+        :param float duration: Seconds spent running nodetool repair.
+        """
+        pass
+
+
+class DynamicStepPlan(StepPlan):
+    """
+    Cut the primary ranges into steps as the repair goes, so that steps take
+    about options.target_step_duration seconds.
+
+    Every range starts out cut into options.steps slices.  When a step
+    succeeds, the width of the next slices of its range is scaled by
+    target / duration: a range holding a lot of data gets cut finer, while
+    slices of an almost empty range get merged.  Ranges take turns, so the
+    outcome of a step is usually known before the next slice of its range
+    is cut.
+
+    How far every range has got is kept in RepairStatus.plans, so that a
+    resumed repair carries on with the adjusted widths.
+    """
+
+    feedback = True
+    # Bound how much a single step can change the width of its range.
+    MAX_WIDTH_CHANGE = 4.0
+
+    def __init__(self, options, tokens, repair_status, steps=()):
+        """
+        Init.
+
+        :param options: OptionParser result
+        :param TokenContainer tokens: Tokens.
+        :param RepairStatus repair_status: Repair status.
+        :param steps: Steps to run before any range is cut, such as the
+                      pending steps of a resumed repair.
+        """
+        super(DynamicStepPlan, self).__init__(steps)
+        self.target = options.target_step_duration
+        self.steps_per_range = options.steps
+        self.tokens = tokens
+        self.repair_status = repair_status
+        self.keyspace = options.keyspace
+        self.column_families = options.columnfamily
+        self.ring_size = tokens.RANGE_MAX - tokens.RANGE_MIN + 1
+        self.plans = {}
+        self.turns = collections.deque()
+        self.running = {}
+
+    def add_host_ranges(self, offset=0, tokens=None, host=None):
+        """
+        Plan the primary range of every host token.
+
+        :param int offset: Number of host tokens to skip.
+        :param TokenContainer tokens: Tokens of the host, if not self.tokens.
+        :param host: Host, for a --cluster repair.
+        """
+        tokens = tokens or self.tokens
+        for token_num, (range_start, range_termination) in enumerate(tokens.host_ranges):
+            if token_num < offset:
+                continue
+            nodeposition = format_nodeposition(token_num + 1, len(tokens.host_ranges), host)
+            distance = (range_termination - range_start) % self.ring_size or self.ring_size
+            width = max(1, distance // self.steps_per_range)
+            self.add_plan(nodeposition, {
+                'start': range_start,
+                'end': range_termination,
+                'distance': distance,
+                'increment': width,
+                'cursor': 0,
+                'width': width,
+            })
+            self.repair_status.update_plan(nodeposition, dict(self.plans[nodeposition]))
+
+    def add_plan(self, nodeposition, plan):
+        """
+        Add a range to cut.
+
+        :param nodeposition: Node position of the range.
+        :param dict plan: start and end token, distance between them, cursor
+                          (offset of the first token not handed out yet), width
+                          of the next slice and increment (width of the
+                          options.steps slices the range started out with).
+        """
+        self.plans[nodeposition] = plan
+        self.turns.append(nodeposition)
+
+    def next_step(self):
+        step = super(DynamicStepPlan, self).next_step()
+        if step is not None:
+            return step
+        if not self.turns:
+            return None
+        nodeposition = self.turns.popleft()
+        plan = self.plans[nodeposition]
+        width = plan['width']
+        if plan['distance'] - plan['cursor'] < width * 3 // 2:
+            # Take the tail with the last slice rather than leave a sliver.
+            width = plan['distance'] - plan['cursor']
+        offset = plan['cursor']
+        plan['cursor'] += width
+        # Slices keep the step number of the original slice they start in.
+        step_number = min(self.steps_per_range, offset // plan['increment'] + 1)
+        start = self.tokens.format(self.token(plan, offset))
+        end = self.tokens.format(self.token(plan, plan['cursor']))
+        self.repair_status.add_pending_repair(
+            RepairTask('', step_number, start, end, nodeposition, self.keyspace, self.column_families))
+        if plan['cursor'] < plan['distance']:
+            self.repair_status.update_plan(nodeposition, dict(plan))
+            self.turns.append(nodeposition)
+        else:
+            self.repair_status.update_plan(nodeposition, None)
+            del self.plans[nodeposition]
+        step = start, end, step_number, nodeposition
+        self.running[step] = width
+        return step
+
+    def step_done(self, step, success, duration):
+        width = self.running.pop(step, None)
+        plan = self.plans.get(step[3])
+        if not (self.target and success and width and plan):
+            return
+        factor = self.target / max(duration, 0.001)
+        factor = min(self.MAX_WIDTH_CHANGE, max(1 / self.MAX_WIDTH_CHANGE, factor))
+        plan['width'] = max(1, int(width * factor))
+        logging.info("{nodeposition} step {step:04d} took {duration:.1f}s, next width {width}".format(
+            nodeposition=step[3], step=step[2], duration=duration, width=plan['width']))
+
+    def token(self, plan, offset):
+        """
+        Token at an offset into a range, wrapping around the end of the ring.
+
+        :param dict plan: Range plan.
+        :param int offset: Offset from the start token.
+
+        :rtype: int
+        :return: Token.
+        """
+        token = plan['start'] + offset
+        if token > self.tokens.RANGE_MAX:
+            token -= self.ring_size
+        return token
+
+
+class TableStepPlan(StepPlan):
+    """
+    Run per-table steps with at most options.table_concurrency steps of a
+    table at once, so that one large table cannot take up every worker.
+
+    With options.table_order 'range', steps go range by range, moving on to
+    the tables of the next sub-range as soon as those of the current one are
+    started; this spreads the load over all tables.  With 'table', every
+    sub-range of a table goes before the next table, so repairs of a table
+    follow each other while its data is still cached.
+    """
+
+    feedback = True
+
+    def __init__(self, options, steps):
+        """
+        Init.
+
+        :param options: OptionParser result
+        :param steps: Iterable of (start, end, step, nodeposition, keyspace,
+                      column_families), range by range.
+        """
+        super(TableStepPlan, self).__init__()
+        self.limit = options.table_concurrency
+        self.table_order = options.table_order
+        # Steps of every table in arrival order, tables in order of appearance
+        self.queues = collections.OrderedDict()
+        self.running = collections.Counter()
+        for seq, step in enumerate(steps):
+            self.queues.setdefault(self.table(step), collections.deque()).append((seq, step))
+
+    @staticmethod
+    def table(step):
+        """
+        :param tuple step: start, end, step, nodeposition, keyspace, column_families.
+
+        :return: Key of the table a step repairs.
+        """
+        return step[4], tuple(step[5])
+
+    def next_step(self):
+        best = None
+        for table, queue in self.queues.items():
+            if not queue or self.running[table] >= self.limit:
+                continue
+            if self.table_order == 'table':
+                best = table
+                break
+            if best is None or queue[0][0] < self.queues[best][0][0]:
+                best = table
+        if best is None:
+            return None
+        _, step = self.queues[best].popleft()
+        if not self.queues[best]:
+            del self.queues[best]
+        self.running[best] += 1
+        return step
+
+    def step_done(self, step, success, duration):
+        self.running[self.table(step)] -= 1
+
+
+class ReplicaMap(object):
+    """
+    Endpoints holding a replica of every range of the ring.
+    """
+
+    def __init__(self, ends, replicas):
+        """
+        Init.
+
+        :param list ends: Sorted end token of every range of the ring.
+        :param list replicas: Tuple of endpoints of the range ending at each of ends.
+        """
+        self.ends = ends
+        self.ranges = replicas
+        self.cache = {}
+
+    @classmethod
+    def from_ring(cls, tokens, replication_factor):
+        """
+        Place replicas the way SimpleStrategy does, on the owner of a range
+        and the next replication_factor - 1 distinct nodes of the ring.  Racks
+        are not taken into account.
+
+        :param TokenContainer tokens: Tokens, with ring owners.
+        :param int replication_factor: Replicas of every range.
+
+        :rtype: ReplicaMap
+        """
+        owners = tokens.ring_owners
+        count = len(owners)
+        replicas = []
+        for i in range(count):
+            endpoints = []
+            for j in range(count):
+                owner = owners[(i + j) % count]
+                if owner not in endpoints:
+                    endpoints.append(owner)
+                    if len(endpoints) == replication_factor:
+                        break
+            replicas.append(tuple(tokens.ring_nodes[owner] for owner in endpoints))
+        return cls(list(tokens.ring_tokens), replicas)
+
+    @classmethod
+    def from_describering(cls, lines):
+        """
+        Read the replicas of every range from nodetool describering output.
+
+        :param lines: Iterable over the lines of describering output.
+
+        :rtype: ReplicaMap
+        """
+        ranges = []
+        for line in lines:
+            match = DESCRIBERING_RANGE.search(line)
+            if match:
+                endpoints = tuple(endpoint.strip() for endpoint in match.group(2).split(',') if endpoint.strip())
+                ranges.append((longish(match.group(1)), endpoints))
+        ranges.sort(key=lambda r: r[0])
+        return cls([end for end, _ in ranges], [endpoints for _, endpoints in ranges])
+
+    def replicas(self, start, end):
+        """
+        Endpoints holding a replica of any token of a sub-range, which may
+        span several ranges of the ring when ranges were coalesced.
+
+        :param start: First token of the sub-range, exclusive.
+        :param end: Last token of the sub-range.
+
+        :rtype: tuple
+        :return: Endpoints, empty if the ring is unknown.
+        """
+        count = len(self.ends)
+        if not count:
+            return ()
+        start, end = longish(start), longish(end)
+        first = bisect_left(self.ends, start + 1)
+        last = bisect_left(self.ends, end)
+        if start >= end:
+            # The sub-range wraps around the end of the ring
+            last += count
+        key = first, last
+        if key not in self.cache:
+            endpoints = []
+            for i in range(first, last + 1):
+                for endpoint in self.ranges[i % count]:
+                    if endpoint not in endpoints:
+                        endpoints.append(endpoint)
+            self.cache[key] = tuple(endpoints)
+        return self.cache[key]
+
+
+class ReplicaStepPlan(StepPlan):
+    """
+    Hand out the steps of another plan only while every replica of their
+    range runs fewer than options.max_sessions_per_node repair sessions, so
+    that concurrent sessions do not build Merkle trees on the same nodes.
+
+    Steps that have to wait are held back, grouped by replicas, and handed out
+    ahead of newer steps as soon as their replicas are free.  A plan that
+    adapts to feedback loses the chance to resize a step once it is held back,
+    so at most options.workers of its steps are held back at a time.
+    """
+
+    feedback = True
+
+    def __init__(self, options, replica_map, plan, repair_status=None):
+        """
+        Init.
+
+        :param options: OptionParser result
+        :param ReplicaMap replica_map: Replicas of every range.
+        :param StepPlan plan: Steps to run.
+        :param RepairStatus repair_status: Where to record the scheduling
+                                           statistics once every step is done.
+        """
+        super(ReplicaStepPlan, self).__init__()
+        self.replica_map = replica_map
+        self.plan = plan
+        self.limit = options.max_sessions_per_node
+        self.lookahead = options.workers if plan.feedback else None
+        self.repair_status = repair_status
+        self.busy = collections.Counter()
+        # Held back steps with the time they started waiting, by replicas
+        self.held = collections.OrderedDict()
+        self.held_count = 0
+        # Statistics
+        self.running = 0
+        self.peak = 0
+        self.first_start = None
+        self.last_change = None
+        self.session_seconds = 0.0
+        self.blocked_steps = 0
+        self.blocked_seconds = 0.0
+        self.reported = False
+
+    def next_step(self):
+        now = time.time()
+        step = self.take_held(now)
+        while step is None and (self.lookahead is None or self.held_count < self.lookahead):
+            step = self.plan.next_step()
+            if step is None:
+                break
+            replicas = self.replica_map.replicas(step[0], step[1])
+            if not self.is_free(replicas):
+                self.held.setdefault(replicas, collections.deque()).append((step, now))
+                self.held_count += 1
+                self.blocked_steps += 1
+                step = None
+        if step is None:
+            if not self.running and not self.reported:
+                self.report()
+            return None
+        self.account(now)
+        for endpoint in self.replica_map.replicas(step[0], step[1]):
+            self.busy[endpoint] += 1
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        if self.first_start is None:
+            self.first_start = now
+        return step
+
+    def step_done(self, step, success, duration):
+        self.account(time.time())
+        for endpoint in self.replica_map.replicas(step[0], step[1]):
+            self.busy[endpoint] -= 1
+        self.running -= 1
+        self.plan.step_done(step, success, duration)
+
+    def is_free(self, replicas):
+        """
+        :param tuple replicas: Endpoints.
+
+        :return: Whether every endpoint runs fewer sessions than the limit.
+        """
+        return all(self.busy[endpoint] < self.limit for endpoint in replicas)
+
+    def take_held(self, now):
+        """
+        Take the oldest held back step whose replicas are free.
+
+        :param float now: Current time.
+
+        :return: Step, or None.
+        """
+        for replicas, queue in self.held.items():
+            if self.is_free(replicas):
+                step, since = queue.popleft()
+                if not queue:
+                    del self.held[replicas]
+                self.held_count -= 1
+                self.blocked_seconds += now - since
+                return step
+        return None
+
+    def account(self, now):
+        """
+        Add up the session time since the last step started or finished.
+
+        :param float now: Current time.
+        """
+        if self.last_change is not None:
+            self.session_seconds += self.running * (now - self.last_change)
+        self.last_change = now
+
+    def stats(self):
+        """
+        :rtype: dict
+        :return: Average and peak number of sessions running at once, and
+                 the steps held back on busy replicas with their total wait.
+        """
+        elapsed = (self.last_change - self.first_start) if self.first_start is not None else 0
+        return {
+            'average_parallelism': round(self.session_seconds / elapsed, 2) if elapsed else 0,
+            'peak_parallelism': self.peak,
+            'blocked_steps': self.blocked_steps,
+            'blocked_seconds': round(self.blocked_seconds, 3),
+        }
+
+    def report(self):
+        """
+        Log the scheduling statistics and record them in the repair status.
+        """
+        self.reported = True
+        stats = self.stats()
+        logging.info("Replica-aware scheduling: {average_parallelism} sessions at once on average, "
+                     "{peak_parallelism} at most; {blocked_steps} steps waited {blocked_seconds}s "
+                     "for busy replicas".format(**stats))
+        if self.repair_status is not None:
+            self.repair_status.set_scheduling(stats)
+
+
+class CompiledPlan(object):
+    """
+    Repair steps compiled into a file of fixed-width records, read through a
+    read-only memory mapping so that any step can be looked up by index
+    without loading the plan, and the pages are shared by every process
+    reading the same file.
+
+    The file holds a header (magic, token width in bytes, metadata length,
+    step count), JSON metadata (hosts, number of ranges of each host) and
+    one record per step: host index, range number, step number, start and
+    end token.  Murmur3 tokens take 8 bytes; RandomPartitioner tokens do not
+    fit in 64 bits and are stored as 16 byte high and low halves.
+    """
+
+    MAGIC = b'RRPLAN01'
+    HEADER = struct.Struct('<8sIIQ')
+    RECORDS = {8: struct.Struct('<IIIqq'), 16: struct.Struct('<IIIqQqQ')}
+    FORMATS = {8: "{0:+021d}", 16: "{0:039d}"}
+
+    def __init__(self, filename):
+        """
+        Init.
+
+        :param str filename: Plan file written by CompiledPlan.write.
+        """
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.width, metadata_length, self.count = self.HEADER.unpack_from(self.map, 0)
+        if magic != self.MAGIC or self.width not in self.RECORDS:
+            self.map.close()
+            raise Exception('{0} is not a compiled repair plan'.format(filename))
+        offset = self.HEADER.size
+        metadata = json.loads(self.map[offset:offset + metadata_length].decode('utf-8'))
+        self.hosts = metadata['hosts']
+        self.ranges = metadata['ranges']
+        self.record = self.RECORDS[self.width]
+        self.token_format = self.FORMATS[self.width]
+        self.offset = offset + metadata_length
+
+    @classmethod
+    def write(cls, filename, width, hosts, steps):
+        """
+        Compile steps into a plan file.  The file is written next to its
+        final name and renamed over it.
+
+        :param str filename: Plan file.
+        :param int width: Bytes per token, 8 or 16.
+        :param list hosts: (host, number of ranges) of every host, host None
+                           for a single host repair.
+        :param steps: Iterable of (host index, start, end, step, nodeposition),
+                      or with the range number in place of the node position.
+
+        :rtype: int
+        :return: Number of steps written.
+        """
+        record = cls.RECORDS[width]
+        metadata = json.dumps({'hosts': [host for host, _ in hosts],
+                               'ranges': [ranges for _, ranges in hosts]}).encode('utf-8')
+        tmp_filename = filename + '.tmp'
+        count = 0
+        with open(tmp_filename, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, width, len(metadata), 0))
+            f.write(metadata)
+            for host, start, end, step, nodeposition in steps:
+                if isinstance(nodeposition, six.integer_types):
+                    count_in_host = nodeposition
+                else:
+                    count_in_host = int(split_nodeposition(nodeposition)[1].split('/')[0])
+                tokens = (longish(start), longish(end))
+                if width == 16:
+                    tokens = (tokens[0] >> 64, tokens[0] & 0xffffffffffffffff,
+                              tokens[1] >> 64, tokens[1] & 0xffffffffffffffff)
+                f.write(record.pack(host, count_in_host, step, *tokens))
+                count += 1
+            f.seek(0)
+            f.write(cls.HEADER.pack(cls.MAGIC, width, len(metadata), count))
+        os.rename(tmp_filename, filename)
+        return count
+
+    def __len__(self):
+        return self.count
+
+    def fingerprint(self, options):
+        """
+        :param options: OptionParser result, for the keyspace and column
+                        families every step of the plan repairs.
+
+        :rtype: str
+        :return: Hex digest of the whole plan file and what it repairs.
+        """
+        digest = hashlib.sha1(self.map)
+        digest.update(json.dumps([options.keyspace, options.columnfamily]).encode('utf-8'))
+        return digest.hexdigest()
+
+    def __getitem__(self, index):
+        """
+        :param int index: Step index, from 0.
+
+        :rtype: tuple
+        :return: start, end, step, nodeposition
+        """
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        fields = self.record.unpack_from(self.map, self.offset + index * self.record.size)
+        host, count, step = fields[:3]
+        if self.width == 16:
+            start, end = (fields[3] << 64) | fields[4], (fields[5] << 64) | fields[6]
+        else:
+            start, end = fields[3:]
+        return (self.token_format.format(start), self.token_format.format(end), step,
+                format_nodeposition(count, self.ranges[host], self.hosts[host]))
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def close(self):
+        self.map.close()
+
+
+class CompiledStepPlan(StepPlan):
+    """
+    Hand out the steps of a CompiledPlan, reading each one only when it is
+    about to run, skipping those a resumed repair already finished.  Only
+    options.workers steps are handed to the executor at a time, so that the
+    plan is never held in memory as a whole.
+    """
+
+    feedback = True
+
+    def __init__(self, options, plan, repair_status=None):
+        """
+        Init.
+
+        :param options: OptionParser result
+        :param CompiledPlan plan: Plan.
+        :param RepairStatus repair_status: Status of a resumed repair, whose
+                                           finished and failed steps are skipped.
+        """
+        super(CompiledStepPlan, self).__init__(self.remaining(options, plan, repair_status))
+
+    @staticmethod
+    def remaining(options, plan, repair_status):
+        """
+        :param options: OptionParser result
+        :param CompiledPlan plan: Plan.
+        :param RepairStatus repair_status: Status of a resumed repair, or None.
+
+        :returns: start, end, step, nodeposition of every step left to run.
+        """
+        for step in plan:
+            if repair_status is not None:
+                k = planned_key(options, *step)
+                if k in repair_status.finished_repairs or k in repair_status.failed_repairs:
+                    continue
+            yield step
+
+
+class PlannedSteps(object):
+    """
+    Every step of the host's primary ranges, held the way CompiledPlan holds
+    them in its file: tokens in int64 arrays (lists for RandomPartitioner
+    tokens, which do not fit) and range numbers in place of node positions.
+    The arrays are filled a range at a time from the bounds sub_range_bounds
+    strides, and a step is only formatted when it is read, as
+    ProgressStepPlan hands it out.
+    """
+
+    def __init__(self, options, tokens):
+        """
+        Init.
+
+        :param options: OptionParser result
+        :param TokenContainer tokens: Tokens.
+        """
+        self.ranges = len(tokens.host_ranges)
+        self.token_format = tokens.FORMAT_TEMPLATE
+        wide = tokens.RANGE_MAX >= 2**63
+        self.starts, self.ends = ([], []) if wide else (array('q'), array('q'))
+        self.step_numbers = array('I')
+        self.range_numbers = array('I')
+        for count, (range_start, range_termination) in offset_host_ranges(options, tokens):
+            bounds = tokens.sub_range_bounds(range_start, range_termination, options.steps)
+            bounds = list(bounds) if wide else array('q', bounds)
+            self.starts.extend(bounds[:-1])
+            self.ends.extend(bounds[1:])
+            self.step_numbers.extend(range(1, len(bounds)))
+            self.range_numbers.extend(itertools.repeat(count, len(bounds) - 1))
+
+    def __len__(self):
+        return len(self.step_numbers)
+
+    def __getitem__(self, index):
+        """
+        :param int index: Step index, from 0.
+
+        :rtype: tuple
+        :return: start, end, step, nodeposition
+        """
+        if not 0 <= index < len(self.step_numbers):
+            raise IndexError(index)
+        return (self.token_format.format(self.starts[index]), self.token_format.format(self.ends[index]),
+                self.step_numbers[index], format_nodeposition(self.range_numbers[index], self.ranges))
+
+
+class ProgressStepPlan(StepPlan):
+    """
+    Hand out the steps of a plan by index and record each finished one in
+    the completion bitmap of the repair status, instead of keeping pending
+    and finished repairs.  Steps the bitmap marks as finished or failed are
+    skipped, which is all a resumed repair has to do.
+    """
+
+    feedback = True
+
+    def __init__(self, steps, repair_status):
+        """
+        Init.
+
+        :param steps: Sequence of (start, end, step, nodeposition) in plan
+                      order, such as a list, PlannedSteps or a CompiledPlan.
+        :param RepairStatus repair_status: Repair status tracking progress.
+        """
+        super(ProgressStepPlan, self).__init__()
+        self.steps = steps
+        self.repair_status = repair_status
+        self.next_index = 0
+        # Index of every running step, by identity of the step tuple
+        self.running = {}
+
+    def next_step(self):
+        progress = self.repair_status.progress
+        while self.next_index < len(self.steps) and progress.is_settled(self.next_index):
+            self.next_index += 1
+        if self.next_index >= len(self.steps):
+            return None
+        step = self.steps[self.next_index]
+        self.running[id(step)] = self.next_index
+        self.next_index += 1
+        return step
+
+    def step_done(self, step, success, duration):
+        self.repair_status.step_done(self.running.pop(id(step)), success)
+
+
+class Concurrency(object):
+    """
+    Number of steps run_repair_steps keeps running at once, here fixed.
+    """
+
+    def __init__(self, level):
+        """
+        Init.
+
+        :param int level: Steps to run at once.
+        """
+        self.level = level
+
+    def step_started(self):
+        """
+        Take note of a step handed to the executor.
+
+        :return: Ticket to pass to step_done.
+        """
+        return None
+
+    def step_done(self, ticket, success, duration):
+        """
+        Take note of a finished step.
+
+        :param ticket: What step_started returned for the step.
+        :param bool success: Whether every repair of the step succeeded.
+        :param float duration: Seconds spent running nodetool repair.
+        """
+        pass
+
+
+class AdaptiveConcurrency(Concurrency):
+    """
+    Additive increase, multiplicative decrease of the number of steps running
+    at once, between one and ceiling.
+
+    The level grows by one after every level successful steps, that is once
+    per round of steps.  A failed step, or one that took longer than
+    max_latency (by default SPIKE_FACTOR times the average successful step),
+    halves it.  Steps started before a decrease ran at the old level, so
+    their outcome adjusts nothing.
+    """
+
+    SPIKE_FACTOR = 3.0
+    # Successful steps to average before a relative latency spike counts
+    WARMUP_STEPS = 5
+
+    def __init__(self, ceiling, max_latency=None, repair_status=None):
+        """
+        Init.
+
+        :param int ceiling: Most steps to run at once.
+        :param float max_latency: Step duration that counts as a latency spike,
+                                  or None to go by the average step duration.
+        :param RepairStatus repair_status: Repair status the level is reported to.
+        """
+        super(AdaptiveConcurrency, self).__init__(1)
+        self.ceiling = ceiling
+        self.max_latency = max_latency
+        self.repair_status = repair_status
+        self.successes = 0
+        self.average = None
+        self.samples = 0
+        self.started = 0
+        self.recovery = 0
+        if repair_status:
+            repair_status.set_concurrency(self.level)
+        logging.info("Adaptive concurrency: starting with 1 of at most {0} workers".format(ceiling))
+
+    def step_started(self):
+        self.started += 1
+        return self.started
+
+    def step_done(self, ticket, success, duration):
+        spike = success and self.is_spike(duration)
+        if success and not spike:
+            self.samples += 1
+            self.average = duration if self.average is None else self.average + (duration - self.average) / 8.0
+        if ticket <= self.recovery:
+            return
+        if not success or spike:
+            self.successes = 0
+            self.recovery = self.started
+            reason = 'step failed' if not success else 'step took {0:.1f}s'.format(duration)
+            self.set_level(max(1, self.level // 2), reason)
+            return
+        self.successes += 1
+        if self.successes >= self.level:
+            self.successes = 0
+            self.set_level(min(self.ceiling, self.level + 1), 'steps succeeding')
+
+    def is_spike(self, duration):
+        """
+        Whether a successful step took too long.
+
+        :param float duration: Seconds spent running nodetool repair.
+
+        :rtype: bool
+        """
+        if self.max_latency:
+            return duration > self.max_latency
+        return self.samples >= self.WARMUP_STEPS and duration > self.average * self.SPIKE_FACTOR
+
+    def set_level(self, level, reason):
+        """
+        Change the number of steps to run at once.
+
+        :param int level: Steps to run at once.
+        :param str reason: Why, for the log.
+        """
+        if level == self.level:
+            return
+        logging.info("Adaptive concurrency: {0} -> {1} workers ({2})".format(self.level, level, reason))
+        self.level = level
+        if self.repair_status:
+            self.repair_status.set_concurrency(level)
+
+
+class QueueRepairStatus(object):
+    """
+    Worker side of the repair status.  Status changes are sent to the parent
+    process as small tuples over a queue, where aggregate_status_events
+    applies them to the real RepairStatus.
+    """
 
-    def _from_output_status(self, status):
+    def __init__(self, status_queue):
         """
-        Load data from existing output status file.
+        Init.
 
-        :param dict status: Status output data.
+        :param status_queue: Queue read by the parent process.
         """
-        self.started = status['started']
-        self.updated = status['updated']
-        self.finished = status['finished']
-        self.last_resumed_at = status['last_resumed_at']
-        self.failed_repairs = status['failed_repairs']
-        self.pending_repairs = status['pending_repairs']
-        self.current_repairs = status['current_repairs']
-        self.finished_repairs = status['finished_repairs']
-        self.successful_count = status['successful_count']
-        self.failed_count = status['failed_count']
+        self.status_queue = status_queue
 
-    @staticmethod
-    def _build_repair_dict(cmd, step, start, end, nodeposition, keyspace=None, column_families=None):
-        """
-        Build a standard repair step dict.
+    def repair_start(self, *args):
+        self.status_queue.put(('repair_start', args))
 
-        :param cmd: Repair command.
-        :param step: Step number.
-        :param start: Start range.
-        :param end: End range.
-        :param nodeposition: Node position.
-        :param keyspace: Keyspace being repaired.
-        :param column_families: Column families being repaired.
+    def repair_fail(self, *args):
+        self.status_queue.put(('repair_fail', args))
 
-        :rtype: dict
-        :return: Dict of repair step info.
-        """
-        return {
-            'time': datetime.now().isoformat(),
-            'step': step,
-            'start': start,
-            'end': end,
-            'nodeposition': nodeposition,
-            'keyspace': keyspace or '<all>',
-            'column_families': column_families or '<all>',
-            'cmd': cmd
-        }
+    def repair_success(self, *args):
+        self.status_queue.put(('repair_success', args))
 
 
-class TestManager(BaseManager):
-    pass
-TestManager.register('RepairStatus', RepairStatus)
+def aggregate_status_events(status_queue, repair_status):
+    """Apply status events sent by workers until a None sentinel arrives.
+    :param status_queue: Queue written by QueueRepairStatus instances.
+    :param RepairStatus repair_status: Repair status.
+    """
+    while True:
+        event = status_queue.get()
+        if event is None:
+            return
+        method, args = event
+        getattr(repair_status, method)(*args)
 
 
-def run_command(*command):
-    """Execute a shell command and return the output
-    :param command: the command to be run and all of the arguments
-    :returns: success_boolean, command_string, stdout, stderr
-    """
-    cmd = " ".join(map(str, command))
-    logging.debug("run_command: " + cmd)
-    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE, universal_newlines=True)
-    stdout, stderr = proc.communicate()
-    return proc.returncode == 0, cmd, stdout, stderr
+# Set in each worker by init_worker, so the options are pickled once per
+# worker process instead of once per step.
+worker_options = None
+worker_status = None
+# Copies of worker_options for the hosts of a --cluster repair
+worker_host_options = {}
 
 
-def repair_range(options, start, end, step, nodeposition, repair_status=None):
-    """Repair a keyspace/columnfamily between a given token range with nodetool
+def init_worker(options, status):
+    """Initializer for repair workers.
     :param options: OptionParser result
+    :param status: RepairStatus, or QueueRepairStatus in worker processes.
+    """
+    global worker_options, worker_status
+    worker_options = options
+    worker_status = status
+    worker_host_options.clear()
+    configure_command_backend(options)
+
+
+def step_options(nodeposition):
+    """Options for running a step: worker_options, with --host set to the
+    host of the step in a --cluster repair.
+    :param nodeposition: string to indicate which node this particular step is for.
+    :returns: OptionParser result
+    """
+    host, _ = split_nodeposition(nodeposition)
+    if host is None:
+        return worker_options
+    options = worker_host_options.get(host)
+    if options is None:
+        options = copy.copy(worker_options)
+        options.host = host
+        worker_host_options[host] = options
+    return options
+
+
+def repair_step(start, end, step, nodeposition, keyspace=None, column_families=None, submitted=None):
+    """Repair one step in a worker.
     :param start: Beginning token in the range to repair (formatted string)
     :param end: Ending token in the range to repair (formatted string)
     :param step: The step we're executing (for logging purposes)
     :param nodeposition: string to indicate which node this particular step is for.
-    :param RepairStatus repair_status: Repair status.
-    :returns: None
+    :param keyspace: Keyspace of a per-table step.
+    :param column_families: Column families of a per-table step.
+    :param submitted: When the step was handed to the executor.
+    :returns: whether every repair succeeded, seconds spent running nodetool repair
     """
-    if options.exclude_step:
-        (excluded, exclude_step) = is_excluded(options, start, end, step, nodeposition)
-        if excluded == 1:
-            logging.debug(
-                "{nodeposition} step {step:04d} skipping range ({start}, {end}) for keyspace {keyspace}".format(
-                    step=step,
-                    start=start,
-                    end=end,
-                    nodeposition=nodeposition,
-                    keyspace=options.keyspace or "<all>"))
-            return
-        elif excluded == 2:
-            logging.info(
-                'Running individual repair commands for each keyspace to exclude {0} {1}'.format(
-                    exclude_step['keyspace'],
-                    exclude_step['column_family'] or ''))
-            for keyspace, column_families in enumerate_keyspaces(options).iteritems():
-                if keyspace == exclude_step['keyspace']:
-                    if options.exclude_step['column_family']:
-                        logging.info('Repairing all column families except {0} for keyspace {1}'.format(
-                            exclude_step['column_family'],
-                            keyspace))
-                        cf_to_repair = [cf for cf in column_families if cf != exclude_step['column_family']]
-                        _repair_range(options, start, end, step, nodeposition, keyspace, cf_to_repair, repair_status)
-                        continue
-                    else:
-                        logging.debug(
-                            "{nodeposition} step {step:04d} skipping range ({start}, {end}) for keyspace {keyspace}".format(
-                                step=step,
-                                start=start,
-                                end=end,
-                                nodeposition=nodeposition,
-                                keyspace=keyspace))
-                        continue
-                _repair_range(options, start, end, step, nodeposition, keyspace, options.columnfamily, repair_status)
-            return
-    # Normal repair_range
-    _repair_range(options, start, end, step, nodeposition, options.keyspace, options.columnfamily, repair_status)
+    queued = None if submitted is None else max(0, time.time() - submitted)
+    options = step_options(nodeposition)
+    if keyspace is not None:
+        return _repair_range(options, start, end, step, nodeposition, keyspace, column_families, worker_status, queued)
+    return repair_range(options, start, end, step, nodeposition, worker_status, queued)
 
-def _repair_range(options, start, end, step, nodeposition, keyspace=None, column_families=None, repair_status=None):
-    """Repair a keyspace/columnfamily between a given token range with nodetool
-    :param options: OptionParser result
+
+async def async_repair_step(start, end, step, nodeposition, keyspace=None, column_families=None, submitted=None):
+    """Repair one step on the asyncio executor.
     :param start: Beginning token in the range to repair (formatted string)
     :param end: Ending token in the range to repair (formatted string)
     :param step: The step we're executing (for logging purposes)
     :param nodeposition: string to indicate which node this particular step is for.
-    :param keyspace: Keyspace to repair.
-    :param column_families: List of column families to repair.
-    :param RepairStatus repair_status: Repair status.
-    :returns: None
+    :param keyspace: Keyspace of a per-table step.
+    :param column_families: Column families of a per-table step.
+    :param submitted: When the step was handed to the executor.
+    :returns: whether every repair succeeded, seconds spent running nodetool repair
     """
-    logging.debug(
-        "{nodeposition} step {step:04d} repairing range ({start}, {end}) for keyspace {keyspace}".format(
-            step=step,
-            start=start,
-            end=end,
-            nodeposition=nodeposition,
-            keyspace=keyspace or "<all>"))
-
-    cmd = [options.nodetool, "-h", options.host, "-p", options.port, "repair"]
-    if options.full: cmd.append('-full')
-    if keyspace: cmd.append(keyspace)
-    cmd.extend(column_families or options.columnfamily)
-
-    # -local flag cannot be used in conjunction with -pr
-    if options.local:
-        cmd.extend([options.local])
-    else:
-        cmd.extend(["-pr"])
-
-    cmd.extend([options.par, options.inc, options.snapshot,
-                 "-st", start, "-et", end])
-    cmd_str = ' '.join(map(str, cmd))
-
-    if repair_status:
-        repair_status.repair_start(cmd_str, step, start, end, nodeposition, keyspace, column_families)
+    queued = None if submitted is None else max(0, time.time() - submitted)
+    options = step_options(nodeposition)
+    if keyspace is not None:
+        return await _async_repair_range(options, start, end, step, nodeposition, keyspace, column_families,
+                                         worker_status, queued)
+    return await async_repair_range(options, start, end, step, nodeposition, worker_status, queued)
 
-    if not options.dry_run:
-        seconds_to_sleep = random.uniform(0, options.max_sleep_before_run)
-        logging.info("Sleeping for {0} seconds before run.".format(seconds_to_sleep))
-        time.sleep(seconds_to_sleep)
-
-        retry_options = ExponentialBackoffRetryerConfig(options.max_tries, options.initial_sleep,
-            options.sleep_factor, options.max_sleep)
-        retryer = ExponentialBackoffRetryer(retry_options, lambda x: x[0], run_command)
-        success, cmd, _, stderr = retryer(*cmd)
-    else:
-        print("{step:04d}/{nodeposition}".format(nodeposition=nodeposition, step=step), " ".join([str(x) for x in cmd]))
-        success = True
-    if not success:
-        if repair_status:
-            repair_status.repair_fail(cmd_str, step, start, end, nodeposition, keyspace, column_families)
-        logging.error("FAILED: {nodeposition} step {step:04d} {cmd}".format(nodeposition=nodeposition, step=step, cmd=cmd))
-        logging.error(stderr)
-        return
-    else:
-        if repair_status:
-            repair_status.repair_success(cmd_str, step, start, end, nodeposition, keyspace, column_families)
-    logging.debug("{nodeposition} step {step:04d} complete".format(nodeposition=nodeposition,step=step))
-    return
 
-def setup_logging(option_group):
-    """Sets up logging in a syslog format by log level
-    :param option_group: options as returned by the OptionParser
+class AsyncioExecutor(object):
+    """
+    Executor that runs coroutines on an event loop in a background thread.
+    At most max_workers coroutines run at once; the others wait on a
+    semaphore, which costs nothing like a parked thread or process.  submit()
+    returns a concurrent.futures.Future, so callers treat it like the other
+    executors.
+
+    Blocking calls the coroutines hand to the loop's default executor, such
+    as commands sent to a session helper, get a thread pool of max_workers
+    threads of their own, so they are not capped by the size of the default
+    pool.
     """
-    stderr_log_format = "%(levelname) -10s %(asctime)s %(funcName) -20s line:%(lineno) -5d: %(message)s"
-    file_log_format = "%(asctime)s - %(levelname)s - %(message)s"
-    logger = logging.getLogger()
-    if option_group.debug:
-        logger.setLevel(level=logging.DEBUG)
-    elif option_group.verbose:
-        logger.setLevel(level=logging.INFO)
-    else:
-        logger.setLevel(level=logging.WARNING)
-
-    handlers = []
-    if option_group.syslog:
-        handlers.append(logging.handlers.SysLogHandler(facility=option_group.syslog))
-        # Use standard format here because timestamp and level will be added by syslogd.
-    if option_group.logfile:
-        handlers.append(logging.FileHandler(option_group.logfile))
-        handlers[0].setFormatter(logging.Formatter(file_log_format))
-    if not handlers:
-        handlers.append(logging.StreamHandler())
-        handlers[0].setFormatter(logging.Formatter(stderr_log_format))
-    for handler in handlers:
-        logger.addHandler(handler)
-    return
 
+    def __init__(self, max_workers):
+        """
+        Init.
 
-def repair(options):
-    """Repair a keyspace/columnfamily by breaking each token range into $start_steps ranges
-    :param options.keyspace: Cassandra keyspace to repair
-    :param options.host: (optional) Hostname to pass to nodetool
-    :param options.port: (optional) JMX Port to pass to nodetool
-    :param options.steps: Number of sub-ranges to split primary range in to
-    :param options.workers: Number of workers to use
-    """
-    tokens = TokenContainer(options)
+        :param int max_workers: Maximum number of coroutines running at once.
+        """
+        self.blocking = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.blocking)
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.semaphore = asyncio.run_coroutine_threadsafe(self._create_semaphore(max_workers), self.loop).result()
+
+    async def _create_semaphore(self, max_workers):
+        return asyncio.Semaphore(max_workers)
+
+    async def _bounded(self, coroutine_function, *args, **kwargs):
+        async with self.semaphore:
+            return await coroutine_function(*args, **kwargs)
+
+    def submit(self, coroutine_function, *args, **kwargs):
+        """
+        Schedule a coroutine.
 
-    worker_pool = multiprocessing.Pool(options.workers)
-    manager = TestManager()
-    manager.start()
-    repair_status = manager.RepairStatus()
+        :param coroutine_function: Coroutine function to call.
+        :param args: Arguments to pass to it.
+        :param kwargs: Keyword arguments to pass to it.
 
-    # TODO: Modifying options.resume to use dictionary instead of offset.
-    if options.resume:
-        options.offset = repair_status.resume(options, tokens)
+        :rtype: concurrent.futures.Future
+        :return: Future for the coroutine's result.
+        """
+        return asyncio.run_coroutine_threadsafe(self._bounded(coroutine_function, *args, **kwargs), self.loop)
 
-        all_results = []
-        for g in repair_status.gp():
-            ga = repair_status.gp()[g]
-            nodeposition = ga['nodeposition']
-            start = ga['start']
-            end = ga['end']
-            step = ga['step']
-            args = (options, start, end, step, nodeposition, repair_status)
-            all_results.append(worker_pool.apply_async(repair_range, args))
+    def shutdown(self, wait=True):
+        """
+        Stop the event loop.
 
-        for r in list(all_results):
-            r.get()
+        :param bool wait: Wait for the loop thread to exit.
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if wait:
+            self.thread.join()
+            self.loop.close()
+        self.blocking.shutdown(wait)
 
-        repair_status.finish()
-        return
-    else:
-        repair_status.start(options)
+    def __enter__(self):
+        return self
 
-    # Store all results in one large list to prevent throttling by discrete step size.
-    all_results = []
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        return False
 
-    for token_num, host_token in enumerate(tokens.host_tokens):
-        range_termination = host_token
-        range_start = tokens.get_preceding_token(range_termination)
 
-        if token_num < options.offset:
-            logging.info(
-                "[{count}/{total}] skipping token..".format(
-                    count=token_num + 1,
-                    total=tokens.host_token_count))
-            continue
+def run_repair_steps(options, steps, repair_status):
+    """Run repair steps on options.workers workers, using the executor picked
+    by options.executor.
+    :param options: OptionParser result
+    :param steps: StepPlan, or iterable of (start, end, step, nodeposition).
+    :param RepairStatus repair_status: Repair status.
+    :returns: None
+    """
+    if not isinstance(steps, StepPlan):
+        # Generating a step records it as pending, which is what --resume
+        # goes by, so take every step before any of them runs.
+        steps = StepPlan(list(steps))
+    if options.adaptive_workers:
+        window = AdaptiveConcurrency(options.workers, options.max_step_latency, repair_status)
+    elif steps.feedback:
+        window = Concurrency(options.workers)
+    else:
+        window = None
+    if options.executor == 'thread':
+        # Workers only wait on nodetool, so threads can share the status.
+        executor = concurrent.futures.ThreadPoolExecutor(options.workers, initializer=init_worker,
+                                                         initargs=(options, repair_status))
+        with executor:
+            _run_on_executor(executor, repair_step, steps, window)
+        return
 
-        # TODO: Nice to have this outside of this loop so it is less confusing (this doesn't start within loop anymore.)
-        # logging.info(
-        #     "[{count}/{total}] repairing range ({token}, {termination}) in {steps} steps for keyspace {keyspace}".format(
-        #         count=token_num + 1,
-        #         total=tokens.host_token_count,
-        #         token=tokens.format(range_start),
-        #         termination=tokens.format(range_termination),
-        #         steps=options.steps,
-        #         keyspace=options.keyspace or "<all>"))
-
-        results = []
-        for start, end, step in tokens.sub_range_generator(range_start, range_termination, options.steps):
-            nodeposition = "{count}/{total}".format(count=token_num + 1, total=tokens.host_token_count)
-            args = (options, start, end, step, nodeposition, repair_status)
-            results.append(worker_pool.apply_async(repair_range, args))
+    if options.executor == 'asyncio':
+        init_worker(options, repair_status)
+        with AsyncioExecutor(options.workers) as executor:
+            _run_on_executor(executor, async_repair_step, steps, window)
+        return
 
-            # TODO: Confirm that the <all> value in this is used correctly in all cases.
-            if options.columnfamily:
-                column_families = str(options.columnfamily)
-            else:
-                column_families = '<all>'
-            k = create_key(step, start, end, nodeposition, str(options.keyspace), column_families)
-            pending_repair = RepairStatus._build_repair_dict(
-                '', step, start, end, nodeposition, str(options.keyspace), column_families)
-            repair_status.add_pending_repair(k, pending_repair)
+    status_queue = multiprocessing.Queue()
+    aggregator = threading.Thread(target=aggregate_status_events, args=(status_queue, repair_status))
+    aggregator.daemon = True
+    aggregator.start()
+    executor = concurrent.futures.ProcessPoolExecutor(options.workers, initializer=init_worker,
+                                                      initargs=(options, QueueRepairStatus(status_queue)))
+    try:
+        # Workers flush their end of the queue as they exit, so every status
+        # event is queued ahead of the sentinel.
+        with executor:
+            _run_on_executor(executor, repair_step, steps, window)
+    finally:
+        status_queue.put(None)
+        aggregator.join()
+    return
 
-        all_results += results
 
-    for r in list(all_results):
-        r.get()
+def _run_on_executor(executor, task, plan, window=None):
+    """Run every step of a plan on an executor and wait for all of them.
+    :param executor: concurrent.futures executor or AsyncioExecutor.
+    :param task: Function the executor runs for each step, with the time the
+                 step was submitted as submitted.
+    :param StepPlan plan: Steps to run.
+    :param Concurrency window: Number of steps handed to the executor at
+                               once, or None to hand it every step up front.
+    :returns: None
+    """
+    if window is None:
+        # Store all results in one large list to prevent throttling by discrete step size.
+        all_results = [(executor.submit(task, *step, submitted=time.time()), step)
+                       for step in iter(plan.next_step, None)]
+        for r, step in all_results:
+            plan.step_done(step, *r.result())
+        return
 
-    repair_status.finish()
-    return
+    running = {}
+    while True:
+        while len(running) < window.level:
+            step = plan.next_step()
+            if step is None:
+                break
+            running[executor.submit(task, *step, submitted=time.time())] = step, window.step_started()
+        if not running:
+            return
+        done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+        for r in done:
+            step, ticket = running.pop(r)
+            success, duration = r.result()
+            window.step_done(ticket, success, duration)
+            plan.step_done(step, success, duration)
 
 # Exclude Step Feature
 
@@ -760,11 +3939,11 @@ def is_excluded(options, start, end, step, nodeposition):
     step is excluded, 2 if only keyspace is excluded, and a second value with the exclude config if excluded or None if
     not excluded.
     """
-    current_node = nodeposition.split('/')[0]
+    current_node = split_nodeposition(nodeposition)[1].split('/')[0]
     for exclude_step in options.exclude_step:
-        if exclude_step['node'] == current_node and options.exclude_step['step'] == step:
-            if options.exclude_step['keyspace']:
-                if options.keyspace and options.keyspace == options.exclude_step['keyspace']:
+        if exclude_step['node'] == current_node and exclude_step['step'] == step:
+            if exclude_step['keyspace']:
+                if options.keyspace and options.keyspace == exclude_step['keyspace']:
                     return 1, exclude_step
                 elif not options.keyspace:
                     # No options.keyspace means all keyspaces, but we only want to exclude one keyspace
@@ -773,11 +3952,33 @@ def is_excluded(options, start, end, step, nodeposition):
                 return 1, exclude_step
     return 0, None
 
+def is_table_excluded(options, step, nodeposition, keyspace, table):
+    """Test if a table is excluded from a step by --exclude-step.
+    :param options: OptionParser result
+    :param step: The step we're executing
+    :param nodeposition: string to indicate which node this particular step is for.
+    :param keyspace: Keyspace of the table.
+    :param table: Table name.
+    :returns: True if excluded
+    """
+    current_node = split_nodeposition(nodeposition)[1].split('/')[0]
+    for exclude_step in options.exclude_step or []:
+        if exclude_step['node'] == current_node and exclude_step['step'] == step \
+                and exclude_step['keyspace'] in (None, keyspace) \
+                and exclude_step['column_family'] in (None, table):
+            return True
+    return False
+
 def enumerate_keyspaces(options):
     """Get a dict of all keyspaces and their column families.
     :param options: OptionParser result
     :returns: Dictionary of keyspace: [column families]
     """
+    cache = TopologyCache.from_options(options)
+    if cache:
+        keyspaces = cache.get('keyspaces')
+        if keyspaces is not None:
+            return keyspaces
     logging.info('running nodetool cfstats')
     cmd = [options.nodetool, "-h", options.host, "-p", options.port, "cfstats"]
     success, _, stdout, stderr = run_command(*cmd)
@@ -798,8 +3999,29 @@ def enumerate_keyspaces(options):
             keyspaces[keyspace].append(table)
     logging.info('Found {0} keyspaces'.format(len(keyspaces)))
     # logging.debug(keyspaces)
+    if cache:
+        cache.put('keyspaces', keyspaces)
     return keyspaces
 
+def build_replica_map(options, tokens):
+    """Find the replicas of every range, from the ring and
+    options.replication_factor, or else from nodetool describering.
+    :param options: OptionParser result
+    :param TokenContainer tokens: Tokens, with ring owners.
+    :returns: ReplicaMap
+    """
+    if options.replication_factor:
+        replica_map = ReplicaMap.from_ring(tokens, options.replication_factor)
+    else:
+        logging.info('running nodetool describering')
+        cmd = [options.nodetool, "-h", options.host, "-p", options.port, "describering", options.keyspace]
+        success, _, stdout, stderr = run_command(*cmd)
+        if not success:
+            raise Exception("Died in build_replica_map because: " + stderr)
+        replica_map = ReplicaMap.from_describering(stdout.splitlines())
+    logging.info('Found the replicas of {0} ranges'.format(len(replica_map.ends)))
+    return replica_map
+
 def parse_exclude_step(option, opt_str, value, parser):
     """Parse exclude_step arg.
     :param option: Option instance.
@@ -836,8 +4058,9 @@ def parse_exclude_step(option, opt_str, value, parser):
     existing_exclude_step.append(exclude_step)
     setattr(parser.values, option.dest, existing_exclude_step)
 
-def main():
-    """Validate arguments and initiate repair
+def build_option_parser():
+    """Build the command line option parser.
+    :returns: OptionParser
     """
     parser = OptionParser()
     parser.add_option("-k", "--keyspace", dest="keyspace", metavar="KEYSPACE",
@@ -853,9 +4076,24 @@ def main():
     parser.add_option("-P", "--port", dest="port", default=7199, type="int",
                       metavar="PORT", help="JMX port to use for nodetool commands [default: %default]")
 
+    parser.add_option("--cluster", dest="cluster", action='store_true', default=False,
+                      help="Repair the primary ranges of every host in --hosts, or of every member of the ring "
+                           "found through --host, from this process, with --workers steps running across all of them")
+
+    parser.add_option("--hosts", dest="hosts", action="append", metavar="HOST[,HOST...]",
+                      help="Hosts a --cluster repair covers, can appear multiple times [default: the whole ring]")
+
     parser.add_option("-s", "--steps", dest="steps", type="int", default=100,
                       metavar="STEPS", help="Number of discrete ranges [default: %default]")
 
+    parser.add_option("--target-step-duration", dest="target_step_duration", type="float", metavar="SECONDS",
+                      help="Cut ranges into steps as the repair goes, aiming for steps that take this many "
+                           "seconds. --steps sets how finely each range is cut at first")
+
+    parser.add_option("--coalesce-ranges", dest="coalesce_ranges", action='store_true', default=False,
+                      help="Repair primary ranges that follow each other in the ring as one range, split into "
+                           "--steps steps, instead of --steps steps each")
+
     parser.add_option("-o", "--offset", dest="offset", type="int", default=0,
                       metavar="OFFSET", help="Number of tokens to skip [default: %default]")
 
@@ -868,6 +4106,64 @@ def main():
     parser.add_option("-w", "--workers", dest="workers", type="int", default=1,
                       metavar="WORKERS", help="Number of workers to use for parallelism [default: %default]")
 
+    parser.add_option("--adaptive-workers", dest="adaptive_workers", action='store_true', default=False,
+                      help="Start with one worker and adjust the number of steps running at once, up to --workers: "
+                           "add one after every round of successful steps, halve on a failed step or on one slower "
+                           "than --max-step-latency")
+
+    parser.add_option("--max-step-latency", dest="max_step_latency", type="float", metavar="SECONDS",
+                      help="Step duration that makes --adaptive-workers back off "
+                           "[default: three times the average step duration]")
+
+    parser.add_option("--per-table", dest="per_table", action='store_true', default=False,
+                      help="Repair every table of --keyspace, or of every keyspace, with a separate step for each "
+                           "table and sub-range")
+
+    parser.add_option("--table-concurrency", dest="table_concurrency", type="int", default=1, metavar="N",
+                      help="Most --per-table steps of a single table to run at once [default: %default]")
+
+    parser.add_option("--table-order", dest="table_order", default="range", type="choice",
+                      choices=["range", "table"], metavar="ORDER",
+                      help="Order of --per-table steps: all tables of a sub-range before the next sub-range, or "
+                           "all sub-ranges of a table before the next table [default: %default]")
+
+    parser.add_option("--status-format", dest="status_format", default="full", type="choice",
+                      choices=["full", "compact"], metavar="FORMAT",
+                      help="Keep every step of --output-status as a pending and finished repair, or only keep a "
+                           "bitmap of finished steps and the failed and running repairs [default: %default]")
+
+    parser.add_option("--compile-plan", dest="compile_plan", metavar="FILENAME",
+                      help="Write every step to a compact binary plan file for --plan-file, and exit")
+
+    parser.add_option("--plan-file", dest="plan_file", metavar="FILENAME",
+                      help="Run the steps of a plan written with --compile-plan instead of reading the ring")
+
+    parser.add_option("--replica-aware", dest="replica_aware", action='store_true', default=False,
+                      help="Only start a step while every replica of its range runs fewer than "
+                           "--max-sessions-per-node repair sessions")
+
+    parser.add_option("--replication-factor", dest="replication_factor", type="int", metavar="N",
+                      help="Replicas of every range for --replica-aware, placed on the next nodes of the ring "
+                           "[default: ask nodetool describering about --keyspace]")
+
+    parser.add_option("--max-sessions-per-node", dest="max_sessions_per_node", type="int", default=1, metavar="N",
+                      help="Most --replica-aware repair sessions a node takes part in at once [default: %default]")
+
+    parser.add_option("--executor", dest="executor", default="process", type="choice",
+                      choices=["process", "thread", "asyncio"], metavar="EXECUTOR",
+                      help="Run workers as processes, as threads of this process, or as asyncio tasks driving "
+                           "nodetool subprocesses. Threads and asyncio start faster and use less memory, since "
+                           "workers only wait on nodetool [default: %default]")
+
+    parser.add_option("--command-backend", dest="command_backend", default="process", type="choice",
+                      choices=["process", "session"], metavar="BACKEND",
+                      help="How nodetool commands are run: a new process for every command, or a long-lived "
+                           "--session-helper process that accepts many commands over a pipe [default: %default]")
+
+    parser.add_option("--session-helper", dest="session_helper", metavar="COMMAND",
+                      help="Command that starts the helper used by --command-backend=session. No helper is "
+                           "shipped that keeps a JMX connection open; see the README")
+
     parser.add_option("-D", "--datacenter", dest="datacenter", default=None,
                       metavar="DATACENTER", help="Identify local datacenter [default: %default]")
 
@@ -912,6 +4208,36 @@ def main():
     parser.add_option("--output-status", dest="output_status",
                       help="Output (and update) a status file for each run")
 
+    parser.add_option("--status-compact-interval", dest="status_compact_interval", type="int",
+                      default=DEFAULT_STATUS_COMPACT_INTERVAL, metavar="N",
+                      help="With --status-flush-interval=0, number of status journal records to write before "
+                           "compacting them into the --output-status file [default: %default]")
+
+    parser.add_option("--status-flush-interval", dest="status_flush_interval", type="int",
+                      default=DEFAULT_STATUS_FLUSH_INTERVAL, metavar="MS",
+                      help="Milliseconds between rewrites of the --output-status file while it has unwritten changes. "
+                           "Zero rewrites it only every --status-compact-interval records [default: %default]")
+
+    parser.add_option("--topology-cache", dest="topology_cache", metavar="DIRECTORY",
+                      help="Cache the ring, host tokens and keyspaces found with nodetool in this directory")
+
+    parser.add_option("--topology-cache-ttl", dest="topology_cache_ttl", type="int", default=3600,
+                      metavar="SECONDS", help="Seconds a --topology-cache entry stays valid [default: %default]")
+
+    parser.add_option("--refresh-topology", dest="refresh_topology", action='store_true', default=False,
+                      help="Query nodetool even if --topology-cache has fresh entries, and update the cache")
+
+    parser.add_option("--metrics-port", dest="metrics_port", type="int", metavar="PORT",
+                      help="Serve live repair metrics in the Prometheus and OpenMetrics text formats on "
+                           "http://--metrics-address:PORT/metrics while the repair runs")
+
+    parser.add_option("--metrics-address", dest="metrics_address", default="127.0.0.1", metavar="ADDRESS",
+                      help="Address the --metrics-port endpoint listens on [default: %default]")
+
+    parser.add_option("--profile", dest="profile", metavar="FILENAME",
+                      help="Profile the main thread of the controller with cProfile and write the statistics to this "
+                           "file on exit, for python -m pstats")
+
     parser.add_option("--resume", dest="resume", action='store_true', default=False,
                       help="Resume a hung or canceled repair session, requires an existing --output-status file")
 
@@ -938,6 +4264,13 @@ def main():
 
     parser.add_option_group(expBackoffGroup)
 
+    return parser
+
+
+def main():
+    """Validate arguments and initiate repair
+    """
+    parser = build_option_parser()
     (options, args) = parser.parse_args()
 
     setup_logging(options)
@@ -961,7 +4294,57 @@ def main():
         logging.debug('--resume requires --output-status')
         sys.exit(1)
 
-    repair(options)
+    if options.target_step_duration and options.per_table:
+        parser.print_help()
+        logging.debug('--per-table cannot be used with --target-step-duration')
+        sys.exit(1)
+
+    if options.target_step_duration and options.exclude_step:
+        parser.print_help()
+        logging.debug('--exclude-step cannot be used with --target-step-duration')
+        sys.exit(1)
+
+    if options.plan_file and (options.compile_plan or options.target_step_duration or options.per_table):
+        parser.print_help()
+        logging.debug('--plan-file cannot be used with --compile-plan, --target-step-duration or --per-table')
+        sys.exit(1)
+
+    if options.compile_plan and (options.target_step_duration or options.per_table):
+        parser.print_help()
+        logging.debug('--compile-plan cannot be used with --target-step-duration or --per-table')
+        sys.exit(1)
+
+    if options.status_format == 'compact' and (options.cluster or options.target_step_duration or options.per_table):
+        parser.print_help()
+        logging.debug('--status-format=compact cannot be used with --cluster, --target-step-duration or --per-table')
+        sys.exit(1)
+
+    if options.replica_aware and not (options.replication_factor or options.keyspace):
+        parser.print_help()
+        logging.debug('--replica-aware requires --replication-factor or --keyspace')
+        sys.exit(1)
+
+    if options.max_sessions_per_node < 1:
+        parser.print_help()
+        logging.debug('--max-sessions-per-node must be at least 1')
+        sys.exit(1)
+
+    if options.command_backend == 'session' and not options.session_helper:
+        parser.print_help()
+        logging.debug('--command-backend=session requires --session-helper')
+        sys.exit(1)
+
+    configure_command_backend(options)
+    profiler = None
+    if options.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        repair(options)
+    finally:
+        if profiler is not None:
+            write_profile(profiler, options.profile)
+        command_backend.close()
     exit(0)
 
 
@@ -13,9 +13,11 @@ if __name__ == '__main__':
     with open(json_file_path) as json_file:
         data = json.load(json_file)
 
-    values['pending_repairs'] = len(data['pending_repairs'])
+    # With --status-format=compact, finished steps are only counted in a bitmap
+    progress = data.get('progress')
+    values['pending_repairs'] = data.get('pending_count', len(data['pending_repairs']))
     values['current_repairs'] = len(data['current_repairs'])
-    values['finished_repairs'] = len(data['finished_repairs'])
+    values['finished_repairs'] = progress['done_count'] if progress else len(data['finished_repairs'])
     values['failed_repairs'] = len(data['failed_repairs'])
 
     values_string = ','.join('{key}={value}'.format(key=k, value=values[k]) for k in values)
@@ -0,0 +1,89 @@
+#! /usr/bin/env python
+
+
+import os, sys, unittest, json, shutil, tempfile
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+sys.path.insert(0,os.path.abspath(__file__+"/../../src"))
+
+import range_repair
+
+
+def steps(count):
+    for i in range(count):
+        yield str(i), str(i + 1), i + 1, '1/1'
+
+
+class adaptive_concurrency_tests(unittest.TestCase):
+    def run_steps(self, concurrency, outcomes):
+        """Finish one round of steps per outcome, all with that outcome."""
+        levels = []
+        for success, duration in outcomes:
+            tickets = [concurrency.step_started() for _ in range(concurrency.level)]
+            for ticket in tickets:
+                concurrency.step_done(ticket, success, duration)
+            levels.append(concurrency.level)
+        return levels
+
+    def test_additive_increase_up_to_ceiling(self):
+        concurrency = range_repair.AdaptiveConcurrency(4)
+        self.assertEqual(concurrency.level, 1)
+        self.assertEqual(self.run_steps(concurrency, [(True, 1)] * 5), [2, 3, 4, 4, 4])
+        return
+
+    def test_multiplicative_decrease_on_failure(self):
+        concurrency = range_repair.AdaptiveConcurrency(16)
+        self.run_steps(concurrency, [(True, 1)] * 8)
+        self.assertEqual(concurrency.level, 9)
+        # Only the first failure of the round counts
+        self.assertEqual(self.run_steps(concurrency, [(False, 1)]), [4])
+        self.assertEqual(self.run_steps(concurrency, [(False, 1)]), [2])
+        return
+
+    def test_latency_spike(self):
+        concurrency = range_repair.AdaptiveConcurrency(16)
+        self.run_steps(concurrency, [(True, 10)] * 4)
+        self.assertEqual(concurrency.level, 5)
+        self.assertEqual(self.run_steps(concurrency, [(True, 31)]), [2])
+        # Slow, but not three times the average
+        self.assertEqual(self.run_steps(concurrency, [(True, 29)]), [3])
+        return
+
+    def test_max_latency(self):
+        concurrency = range_repair.AdaptiveConcurrency(16, max_latency=5)
+        self.assertEqual(self.run_steps(concurrency, [(True, 4), (True, 4), (True, 6)]), [2, 3, 1])
+        return
+
+    def test_level_is_recorded(self):
+        status = range_repair.RepairStatus()
+        concurrency = range_repair.AdaptiveConcurrency(2, repair_status=status)
+        self.assertEqual(status.concurrency, 1)
+        self.run_steps(concurrency, [(True, 1)])
+        self.assertEqual(status.concurrency, 2)
+        return
+
+
+class adaptive_run_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        return
+
+    def test_run_repair_steps(self):
+        options, _ = range_repair.build_option_parser().parse_args([
+            '--nodetool', 'true', '-k', 'ks', '-w', '3', '--executor', 'thread', '--adaptive-workers',
+            '--max-step-latency', '60',
+            '--max-sleep-before-run', '0', '--output-status', os.path.join(self.tmpdir, 'status.json')])
+        status = range_repair.RepairStatus()
+        status.start(options)
+        range_repair.run_repair_steps(options, steps(20), status)
+        status.finish()
+        with open(options.output_status) as f:
+            saved = json.load(f)
+        self.assertEqual(saved['successful_count'], 20)
+        self.assertEqual(saved['concurrency'], 3)
+        return
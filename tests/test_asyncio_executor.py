@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+
+
+import os, sys, unittest, asyncio, json, shutil, subprocess, tempfile, threading
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+sys.path.insert(0,os.path.abspath(__file__+"/../../src"))
+
+import range_repair
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+
+
+class asyncio_executor_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        return
+
+    def run_repair(self, *extra, **env):
+        cmd = [sys.executable, os.path.join(thisdir, '../src', 'range_repair.py'),
+               '--nodetool', os.path.join(thisdir, 'mock_nodetool_script'), '-s', '4', '-w', '40',
+               '--executor', 'asyncio', '--max-sleep-before-run', '0',
+               '--output-status', os.path.join(self.tmpdir, 'status.json')] + list(extra)
+        environment = dict(os.environ, MOCK_NODETOOL_MAX_SLEEP='1', **env)
+        subprocess.check_output(cmd, cwd=self.tmpdir, env=environment)
+        with open(os.path.join(self.tmpdir, 'logfile.count')) as f:
+            runs = f.readlines()
+        with open(os.path.join(self.tmpdir, 'status.json')) as f:
+            status = json.load(f)
+        return runs, status
+
+    def test_fake_nodetool(self):
+        runs, status = self.run_repair()
+        # 10 tokens * 4 steps
+        self.assertEqual(len(runs), 40)
+        self.assertEqual(status['successful_count'], 40)
+        self.assertEqual(status['pending_repairs'], {})
+        return
+
+    def test_fake_nodetool_failures_are_retried(self):
+        runs, status = self.run_repair('--max-tries', '2', '--initial-sleep', '0', MOCK_NODETOOL_FAIL='1')
+        self.assertEqual(len(runs), 80)
+        self.assertEqual(status['failed_count'], 40)
+        return
+
+    def test_concurrency_is_bounded(self):
+        running = [0]
+        peak = [0]
+
+        async def task():
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.01)
+            running[0] -= 1
+
+        with range_repair.AsyncioExecutor(3) as executor:
+            futures = [executor.submit(task) for _ in range(20)]
+            for future in futures:
+                future.result()
+        self.assertEqual(peak[0], 3)
+        return
+
+    def test_blocking_calls_get_a_thread_per_worker(self):
+        # Every call waits for all of the others, which only works if none
+        # of them is queued behind a smaller default thread pool.
+        barrier = threading.Barrier(40, timeout=10)
+
+        async def task():
+            await asyncio.get_event_loop().run_in_executor(None, barrier.wait)
+
+        with range_repair.AsyncioExecutor(40) as executor:
+            futures = [executor.submit(task) for _ in range(40)]
+            for future in futures:
+                future.result()
+        return
+
+
+class async_retry_tests(unittest.TestCase):
+    def test_retries_with_backoff(self):
+        outcomes = [False, False, True]
+        sleeps = []
+
+        async def executor():
+            return outcomes.pop(0)
+
+        async def sleeper(seconds):
+            sleeps.append(seconds)
+
+        config = range_repair.ExponentialBackoffRetryerConfig(5, 1, 2, 10)
+        retryer = range_repair.AsyncExponentialBackoffRetryer(config, lambda ok: ok, executor, sleeper)
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(loop.run_until_complete(retryer()), True)
+        finally:
+            loop.close()
+        self.assertEqual(sleeps, [1, 2])
+        return
@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+
+
+import os, sys, unittest, json, shutil, tempfile
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+sys.path.insert(0,os.path.abspath(__file__+"/../../src"))
+
+import range_repair
+
+ring = """
+Datacenter: dc1
+==========
+Address    Rack        Status State   Load            Owns                Token
+10.0.0.2   rack1       Up     Normal  54.87 KB        33.33%              0
+10.0.0.1   rack1       Up     Normal  54.87 KB        33.33%              -100
+10.0.0.3   rack1       Up     Normal  54.87 KB        33.33%              100
+10.0.0.1   rack1       Up     Normal  54.87 KB        33.33%              200
+"""
+
+
+class cluster_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.options, _ = range_repair.build_option_parser().parse_args([
+            '--cluster', '-s', '2', '--nodetool', 'true', '--max-sleep-before-run', '0', '-w', '3',
+            '--executor', 'thread', '--status-flush-interval', '0',
+            '--output-status', os.path.join(self.tmpdir, 'status.json')])
+        self.tokens = range_repair.TokenContainer.__new__(range_repair.TokenContainer)
+        self.tokens.options = self.options
+        self.tokens.local_nodes = []
+        self.tokens.ring_tokens = []
+        self.tokens.parse_ring_tokens(ring.splitlines())
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        return
+
+    def test_ring_owners(self):
+        self.assertEqual(list(self.tokens.ring_tokens), [-100, 0, 100, 200])
+        self.assertEqual([self.tokens.ring_nodes[owner] for owner in self.tokens.ring_owners],
+                         ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.1'])
+        return
+
+    def test_for_host(self):
+        tokens = self.tokens.for_host('10.0.0.1')
+        self.assertEqual(tokens.host_tokens, [-100, 200])
+        self.assertEqual(tokens.host_ranges, [(200, -100), (100, 200)])
+        self.assertEqual(self.tokens.for_host('10.0.0.3').host_ranges, [(0, 100)])
+        return
+
+    def test_cluster_hosts(self):
+        self.assertEqual(range_repair.cluster_hosts(self.options, self.tokens),
+                         [('10.0.0.2', '10.0.0.2'), ('10.0.0.1', '10.0.0.1'), ('10.0.0.3', '10.0.0.3')])
+        self.options.hosts = ['10.0.0.3,10.0.0.1']
+        self.assertEqual(range_repair.cluster_hosts(self.options, self.tokens),
+                         [('10.0.0.3', '10.0.0.3'), ('10.0.0.1', '10.0.0.1')])
+        self.options.hosts = ['127.0.0.1']
+        self.assertRaises(Exception, range_repair.cluster_hosts, self.options, self.tokens)
+        return
+
+    def test_nodeposition(self):
+        self.assertEqual(range_repair.format_nodeposition(3, 256), '3/256')
+        self.assertEqual(range_repair.format_nodeposition(3, 256, 'cass-1'), 'cass-1:3/256')
+        self.assertEqual(range_repair.split_nodeposition('cass-1:3/256'), ('cass-1', '3/256'))
+        self.assertEqual(range_repair.split_nodeposition('fe80::1:3/256'), ('fe80::1', '3/256'))
+        self.assertEqual(range_repair.split_nodeposition('3/256'), (None, '3/256'))
+        return
+
+    def test_step_options(self):
+        range_repair.init_worker(self.options, None)
+        self.assertIs(range_repair.step_options('1/2'), self.options)
+        options = range_repair.step_options('10.0.0.1:1/2')
+        self.assertEqual(options.host, '10.0.0.1')
+        self.assertIs(range_repair.step_options('10.0.0.1:2/2'), options)
+        self.assertNotEqual(self.options.host, '10.0.0.1')
+        return
+
+    def test_interleave(self):
+        self.assertEqual(list(range_repair.interleave('ab', 'cde', '')), ['a', 'c', 'b', 'd', 'e'])
+        return
+
+    def test_consolidated_status(self):
+        hosts = [(host, self.tokens.for_host(address)) for host, address in
+                 range_repair.cluster_hosts(self.options, self.tokens)]
+        status = range_repair.RepairStatus()
+        status.start(self.options, [host for host, _ in hosts])
+        steps = list(range_repair.interleave(*[
+            range_repair.planned_steps(self.options, host_tokens, status, host) for host, host_tokens in hosts]))
+        self.assertEqual([step[3] for step in steps[:3]], ['10.0.0.2:1/1', '10.0.0.1:1/2', '10.0.0.3:1/1'])
+        self.assertEqual(len(steps), 8)
+
+        # Run the steps of one host only
+        range_repair.run_repair_steps(self.options, [step for step in steps if step[3].startswith('10.0.0.1:')],
+                                      status)
+        status.write()
+        with open(self.options.output_status) as f:
+            saved = json.load(f)
+        self.assertEqual(saved['hosts'], ['10.0.0.2', '10.0.0.1', '10.0.0.3'])
+        self.assertEqual(sorted(saved['nodes']), ['10.0.0.1'])
+        node = saved['nodes']['10.0.0.1']
+        self.assertEqual(node['successful_count'], 4)
+        self.assertEqual(node['pending_count'], 0)
+        self.assertEqual(node['finished'], node['updated'])
+        self.assertEqual(node['failed_repairs'], {})
+        self.assertEqual(len(saved['pending_repairs']), 4)
+
+        # Part of another host
+        range_repair.run_repair_steps(self.options, steps[2:3], status)
+        node = status.node_statuses()['10.0.0.3']
+        self.assertEqual(node['finished'], None)
+        self.assertEqual(node['pending_count'], 1)
+        self.assertEqual(node['current_repair']['nodeposition'], '1/1')
+        return
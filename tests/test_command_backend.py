@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+
+
+import os, sys, unittest, json, shutil, subprocess, tempfile, threading
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+sys.path.insert(0,os.path.abspath(__file__+"/../../src"))
+
+import range_repair
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+helper = os.path.join(thisdir, 'fake_session_helper')
+
+
+class session_backend_tests(unittest.TestCase):
+    def setUp(self):
+        self.backend = range_repair.SessionBackend(helper)
+        return
+
+    def tearDown(self):
+        self.backend.close()
+        return
+
+    def test_round_trip(self):
+        success, cmd, stdout, stderr = self.backend.run('echo', 'hello', 'world')
+        self.assertTrue(success)
+        self.assertEqual(cmd, 'echo hello world')
+        self.assertEqual(stdout, 'hello world\n')
+        return
+
+    def test_failure(self):
+        success, _, _, _ = self.backend.run('false')
+        self.assertFalse(success)
+        return
+
+    def test_one_helper_for_all_commands(self):
+        pids = set()
+        for i in range(5):
+            pids.add(self.backend.run('echo', i)[3].split()[0])
+        self.assertEqual(len(pids), 1)
+        return
+
+    def test_concurrent_callers(self):
+        results = {}
+
+        def call(i):
+            results[i] = self.backend.run('echo', i)[2]
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, dict((i, '{0}\n'.format(i)) for i in range(20)))
+        return
+
+    def test_helper_exit_fails_pending(self):
+        os.environ['FAKE_SESSION_HELPER_DIE_AFTER'] = '2'
+        try:
+            self.assertTrue(self.backend.run('true')[0])
+            success, _, _, stderr = self.backend.run('true')
+            self.assertFalse(success)
+            self.assertEqual(stderr, 'Session helper exited')
+            # A new helper is started for the next command
+            self.assertTrue(self.backend.run('true')[0])
+        finally:
+            del os.environ['FAKE_SESSION_HELPER_DIE_AFTER']
+        return
+
+
+class session_repair_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        return
+
+    def test_repair_through_session(self):
+        cmd = [sys.executable, os.path.join(thisdir, '../src', 'range_repair.py'),
+               '--nodetool', os.path.join(thisdir, 'mock_nodetool_script'), '-s', '2', '-w', '4',
+               '--executor', 'thread', '--max-sleep-before-run', '0',
+               '--command-backend', 'session', '--session-helper', helper,
+               '--output-status', os.path.join(self.tmpdir, 'status.json')]
+        subprocess.check_output(cmd, cwd=self.tmpdir, env=dict(os.environ, MOCK_NODETOOL_MAX_SLEEP='0'))
+        with open(os.path.join(self.tmpdir, 'status.json')) as f:
+            status = json.load(f)
+        self.assertEqual(status['successful_count'], 20)
+        return
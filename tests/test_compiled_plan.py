@@ -0,0 +1,113 @@
+#! /usr/bin/env python
+
+
+import os, sys, unittest, json, mock, shutil, subprocess, tempfile
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+sys.path.insert(0,os.path.abspath(__file__+"/../../src"))
+
+import range_repair
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+
+
+class compiled_plan_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'plan.bin')
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        return
+
+    def test_round_trip(self):
+        steps = [(0, -(2**63), -5, 1, '1/2'), (1, -5, 2**63 - 1, 3, 'cass-2:2/2')]
+        self.assertEqual(range_repair.CompiledPlan.write(self.filename, 8, [('cass-1', 2), ('cass-2', 2)], steps), 2)
+        plan = range_repair.CompiledPlan(self.filename)
+        self.assertEqual(len(plan), 2)
+        self.assertEqual(plan[0], ('-09223372036854775808', '-00000000000000000005', 1, 'cass-1:1/2'))
+        self.assertEqual(list(plan)[1], ('-00000000000000000005', '+09223372036854775807', 3, 'cass-2:2/2'))
+        self.assertRaises(IndexError, plan.__getitem__, 2)
+        plan.close()
+        return
+
+    def test_random_partitioner(self):
+        steps = [(0, 0, 2**127 - 1, 1, '1/1'), (0, 2**64 + 7, 2**100, 2, '1/1')]
+        range_repair.CompiledPlan.write(self.filename, 16, [(None, 1)], steps)
+        plan = range_repair.CompiledPlan(self.filename)
+        self.assertEqual(plan[0], ('0' * 39, str(2**127 - 1).zfill(39), 1, '1/1'))
+        self.assertEqual([int(token) for token in plan[1][:2]], [2**64 + 7, 2**100])
+        plan.close()
+        return
+
+    def test_fingerprint_covers_keyspace(self):
+        range_repair.CompiledPlan.write(self.filename, 8, [(None, 1)], [(0, 0, 10, 1, '1/1')])
+        plan = range_repair.CompiledPlan(self.filename)
+        parser = range_repair.build_option_parser()
+        fingerprints = [plan.fingerprint(parser.parse_args(args)[0])
+                        for args in (['-k', 'ks'], ['-k', 'ks'], ['-k', 'other'], ['-k', 'ks', '-c', 't1'])]
+        plan.close()
+        self.assertEqual(fingerprints[0], fingerprints[1])
+        self.assertEqual(len(set(fingerprints)), 3)
+        return
+
+    def test_not_a_plan(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b'\0' * 64)
+        self.assertRaises(Exception, range_repair.CompiledPlan, self.filename)
+        return
+
+    def test_resume_skips_done_steps(self):
+        options, _ = range_repair.build_option_parser().parse_args(['-k', 'ks'])
+        steps = [(0, step * 10, step * 10 + 10, step, '1/1') for step in range(1, 4)]
+        range_repair.CompiledPlan.write(self.filename, 8, [(None, 1)], steps)
+        plan = range_repair.CompiledPlan(self.filename)
+        status = range_repair.RepairStatus()
+        status.finished_repairs[range_repair.planned_key(options, *plan[0])] = {}
+        status.failed_repairs[range_repair.planned_key(options, *plan[2])] = {}
+        step_plan = range_repair.CompiledStepPlan(options, plan, status)
+        self.assertEqual(list(iter(step_plan.next_step, None)), [plan[1]])
+        plan.close()
+        return
+
+    def test_compile_plan_rejects_unplannable_options(self):
+        for extra in (['--per-table'], ['--target-step-duration', '10']):
+            argv = ['range_repair.py', '-k', 'ks', '--compile-plan', self.filename] + extra
+            with mock.patch.object(sys, 'argv', argv), mock.patch.object(range_repair, 'repair') as repair, \
+                    mock.patch.object(range_repair, 'setup_logging'), mock.patch('sys.stdout'):
+                self.assertRaises(SystemExit, range_repair.main)
+            self.assertFalse(repair.called)
+        return
+
+    def test_compile_and_run(self):
+        cmd = [sys.executable, os.path.join(thisdir, '../src', 'range_repair.py'),
+               '--nodetool', os.path.join(thisdir, 'mock_nodetool_script'), '-s', '2', '-w', '4',
+               '--executor', 'thread', '--max-sleep-before-run', '0']
+        env = dict(os.environ, MOCK_NODETOOL_MAX_SLEEP='0')
+        subprocess.check_output(cmd + ['--compile-plan', self.filename], cwd=self.tmpdir, env=env)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'logfile.count')))
+        self.assertEqual(len(range_repair.CompiledPlan(self.filename)), 20)
+        subprocess.check_output(cmd + ['--plan-file', self.filename,
+                                       '--output-status', os.path.join(self.tmpdir, 'status.json')],
+                                cwd=self.tmpdir, env=env)
+        with open(os.path.join(self.tmpdir, 'logfile.count')) as f:
+            runs = f.readlines()
+        with open(os.path.join(self.tmpdir, 'status.json')) as f:
+            status = json.load(f)
+        self.assertEqual(len(runs), 20)
+        self.assertEqual(status['successful_count'], 20)
+        self.assertEqual(status['pending_repairs'], {})
+        self.assertEqual(status['plan_file'], {'filename': self.filename, 'steps': 20})
+        self.assertEqual(status['pending_count'], 0)
+        return
+
+    def test_plan_file_pending_count(self):
+        status = range_repair.RepairStatus()
+        status.set_plan_file(self.filename, 5)
+        self.assertEqual(status.to_dict()['pending_count'], 5)
+        status.repair_success('cmd', 1, 'a', 'b', '1/1', 'ks')
+        status.repair_fail('cmd', 2, 'b', 'c', '1/1', 'ks')
+        self.assertEqual(status.to_dict()['pending_count'], 3)
+        return
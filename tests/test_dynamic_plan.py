@@ -0,0 +1,126 @@
+#! /usr/bin/env python
+
+
+import os, sys, unittest, shutil, tempfile
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+sys.path.insert(0,os.path.abspath(__file__+"/../../src"))
+
+import range_repair
+
+
+def build_tokens(host_ranges):
+    tokens = range_repair.TokenContainer.__new__(range_repair.TokenContainer)
+    tokens.host_ranges = host_ranges
+    tokens.host_token_count = len(host_ranges)
+    return tokens
+
+
+class dynamic_plan_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.options, _ = range_repair.build_option_parser().parse_args([
+            '-k', 'ks', '-s', '10', '--target-step-duration', '10',
+            '--status-flush-interval', '0', '--output-status', os.path.join(self.tmpdir, 'status.json')])
+        self.status = range_repair.RepairStatus()
+        self.status.start(self.options)
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        return
+
+    def run_plan(self, plan, seconds_per_token, limit=None):
+        """Run steps, taking seconds_per_token[nodeposition] * width seconds each."""
+        steps = []
+        for step in iter(plan.next_step, None):
+            start, end, _, nodeposition = step
+            width = (int(end) - int(start)) % (2**64) or 2**64
+            steps.append(step)
+            plan.repair_status.repair_success('', step[2], start, end, nodeposition, 'ks')
+            plan.step_done(step, True, width * seconds_per_token[nodeposition])
+            if limit and len(steps) == limit:
+                break
+        return steps
+
+    def assertCovers(self, steps, start, end):
+        boundaries = [(int(s), int(e)) for s, e, _, _ in steps]
+        self.assertEqual(boundaries[0][0], start)
+        self.assertEqual(boundaries[-1][1], end)
+        for previous, current in zip(boundaries, boundaries[1:]):
+            self.assertEqual(previous[1], current[0])
+        return
+
+    def test_slow_range_is_split_and_fast_range_merged(self):
+        tokens = build_tokens([(0, 10**12), (10**12, 2 * 10**12)])
+        plan = range_repair.DynamicStepPlan(self.options, tokens, self.status)
+        plan.add_host_ranges()
+        # Range 1 holds 100 times more data than range 2; a first slice of
+        # range 1 takes 100s and one of range 2 takes 1s.
+        steps = self.run_plan(plan, {'1/2': 100.0 / 10**11, '2/2': 1.0 / 10**11})
+        slow = [step for step in steps if step[3] == '1/2']
+        fast = [step for step in steps if step[3] == '2/2']
+        self.assertCovers(slow, 0, 10**12)
+        self.assertCovers(fast, 10**12, 2 * 10**12)
+        self.assertGreater(len(slow), 50)
+        self.assertLess(len(fast), 10)
+        # Once converged, slices of the slow range take about 10s
+        start, end, _, _ = slow[-5]
+        self.assertAlmostEqual((int(end) - int(start)) * 100.0 / 10**11, 10, delta=1)
+        # Step numbers follow the slices the range started out with
+        self.assertEqual([step[2] for step in slow], sorted(step[2] for step in slow))
+        self.assertEqual(slow[-1][2], 10)
+        self.assertEqual(self.status.plans, {})
+        return
+
+    def test_wrap_around_range(self):
+        tokens = build_tokens([(2**63 - 100, -(2**63) + 100)])
+        plan = range_repair.DynamicStepPlan(self.options, tokens, self.status)
+        plan.add_host_ranges()
+        steps = self.run_plan(plan, {'1/1': 0.5})
+        self.assertCovers(steps, 2**63 - 100, -(2**63) + 100)
+        return
+
+    def test_plan_is_resumed(self):
+        tokens = build_tokens([(0, 10**12)])
+        plan = range_repair.DynamicStepPlan(self.options, tokens, self.status)
+        plan.add_host_ranges()
+        done = self.run_plan(plan, {'1/1': 100.0 / 10**11}, limit=5)
+        # Hand out one more step that never finishes
+        unfinished = plan.next_step()
+
+        status = range_repair.RepairStatus.load(self.options.output_status)
+        width = status['plans']['1/1']['width']
+        self.assertLess(width, 10**11 // 4)
+        self.assertEqual(len(status['pending_repairs']), 1)
+
+        self.options.resume = True
+        resumed_status = range_repair.RepairStatus()
+        resumed_status.resume(self.options, tokens)
+        plan = range_repair.DynamicStepPlan(self.options, tokens, resumed_status,
+                                            range_repair.resumed_steps(resumed_status))
+        for nodeposition, saved in resumed_status.plans.items():
+            plan.add_plan(nodeposition, dict(saved))
+        rest = self.run_plan(plan, {'1/1': 100.0 / 10**11})
+        self.assertEqual(rest[0], unfinished)
+        start, end, _, _ = rest[1]
+        self.assertEqual(int(end) - int(start), width)
+        self.assertCovers(done + rest, 0, 10**12)
+        return
+
+    def test_run_repair_steps(self):
+        tokens = build_tokens([(0, 10**6), (10**6, 2 * 10**6), (2 * 10**6, 0)])
+        self.options.nodetool = 'true'
+        self.options.max_sleep_before_run = 0
+        self.options.workers = 2
+        self.options.executor = 'thread'
+        plan = range_repair.DynamicStepPlan(self.options, tokens, self.status)
+        plan.add_host_ranges()
+        range_repair.run_repair_steps(self.options, plan, self.status)
+        self.status.finish()
+        # Steps take no time at all, so slices grow as fast as allowed
+        self.assertLess(self.status.successful_count, 30)
+        self.assertEqual(self.status.pending_repairs, {})
+        self.assertEqual(self.status.plans, {})
+        return
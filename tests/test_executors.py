@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+
+
+import os, sys, unittest, shutil, tempfile
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+sys.path.insert(0,os.path.abspath(__file__+"/../../src"))
+
+import range_repair
+
+
+def steps(count):
+    for i in range(count):
+        yield str(i), str(i + 1), i + 1, '1/1'
+
+
+class executor_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        return
+
+    def run_executor(self, executor, nodetool):
+        options, _ = range_repair.build_option_parser().parse_args([
+            '--nodetool', nodetool, '-k', 'ks', '-w', '3', '--executor', executor,
+            '--max-sleep-before-run', '0', '--status-flush-interval', '0', '--output-status', os.path.join(self.tmpdir, executor + '.json')])
+        status = range_repair.RepairStatus()
+        status.start(options)
+        range_repair.run_repair_steps(options, steps(10), status)
+        status.finish()
+        return status
+
+    def test_success_semantics_match(self):
+        process = self.run_executor('process', 'true')
+        thread = self.run_executor('thread', 'true')
+        self.assertEqual(thread.successful_count, 10)
+        self.assertEqual(sorted(thread.finished_repairs), sorted(process.finished_repairs))
+        self.assertEqual(thread.current_repairs, process.current_repairs)
+        return
+
+    def test_failure_semantics_match(self):
+        process = self.run_executor('process', 'false')
+        thread = self.run_executor('thread', 'false')
+        self.assertEqual(thread.failed_count, 10)
+        self.assertEqual(process.failed_count, 10)
+        self.assertEqual(sorted(thread.failed_repairs), sorted(process.failed_repairs))
+        return
+
+    def test_phase_timings_match(self):
+        for executor in ('process', 'thread'):
+            phases = self.run_executor(executor, 'true').timings.phases
+            for phase in ('queued', 'sleep', 'spawn', 'nodetool', 'backoff'):
+                self.assertEqual(phases[phase]['count'], 10)
+                self.assertEqual(sum(phases[phase]['counts']), 10)
+            self.assertTrue(phases['nodetool']['sum'] > 0)
+        return
@@ -0,0 +1,104 @@
+#! /usr/bin/env python
+
+
+import os, sys, unittest, shutil, tempfile
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+sys.path.insert(0,os.path.abspath(__file__+"/../../src"))
+
+import range_repair
+
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import Request, urlopen, HTTPError
+
+
+class FakeOptions: pass
+
+
+def samples(text):
+    return dict(line.rsplit(' ', 1) for line in text.splitlines() if line and not line.startswith('#'))
+
+
+class metrics_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        f = FakeOptions()
+        f.output_status = os.path.join(self.tmpdir, 'status.json')
+        f.logfile = None
+        f.steps = 2
+        f.status_compact_interval = 1000
+        f.status_flush_interval = 0
+        self.f = f
+        self.status = range_repair.RepairStatus()
+        self.status.start(f)
+        for step in (1, 2, 3):
+            self.status.add_pending_repair(range_repair.RepairTask('', step, 'a', 'b', '1/1', 'ks1'))
+        self.status.add_pending_repair(range_repair.RepairTask('', 1, 'a', 'b', '1/1', 'ks2'))
+        self.status.repair_start('cmd1', 1, 'a', 'b', '1/1', 'ks1')
+        self.status.repair_success('cmd1', 1, 'a', 'b', '1/1', 'ks1', None, {'nodetool': 2.0, 'retries': 2})
+        self.status.repair_start('cmd2', 2, 'a', 'b', '1/1', 'ks1')
+        self.status.repair_fail('cmd2', 2, 'a', 'b', '1/1', 'ks1', None, {'nodetool': 0.02, 'retries': 0})
+        self.status.repair_start('cmd3', 3, 'a', 'b', '1/1', 'ks1')
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        return
+
+    def test_prometheus_text(self):
+        text = range_repair.render_metrics(self.status)
+        values = samples(text)
+        self.assertIn('# TYPE range_repair_repairs_total counter', text)
+        self.assertEqual(values['range_repair_repairs_total{result="success"}'], '1')
+        self.assertEqual(values['range_repair_repairs_total{result="failure"}'], '1')
+        self.assertEqual(values['range_repair_running_repairs'], '1')
+        self.assertEqual(values['range_repair_pending_steps'], '2')
+        self.assertEqual(values['range_repair_retries_total'], '2')
+        self.assertEqual(values['range_repair_keyspace_repairs_total{keyspace="ks1",result="failure"}'], '1')
+        self.assertEqual(values['range_repair_keyspace_pending_repairs{keyspace="ks1"}'], '1')
+        self.assertEqual(values['range_repair_keyspace_pending_repairs{keyspace="ks2"}'], '1')
+        # Buckets are cumulative
+        self.assertEqual(values['range_repair_phase_seconds_bucket{phase="nodetool",le="0.05"}'], '1')
+        self.assertEqual(values['range_repair_phase_seconds_bucket{phase="nodetool",le="1.0"}'], '1')
+        self.assertEqual(values['range_repair_phase_seconds_bucket{phase="nodetool",le="5.0"}'], '2')
+        self.assertEqual(values['range_repair_phase_seconds_bucket{phase="nodetool",le="+Inf"}'], '2')
+        self.assertEqual(values['range_repair_phase_seconds_count{phase="nodetool"}'], '2')
+        self.assertNotIn('# EOF', text)
+        return
+
+    def test_openmetrics_text(self):
+        text = range_repair.render_metrics(self.status, openmetrics=True)
+        self.assertIn('# TYPE range_repair_repairs counter', text)
+        self.assertEqual(samples(text)['range_repair_repairs_total{result="success"}'], '1')
+        self.assertTrue(text.endswith('# EOF\n'))
+        return
+
+    def test_keyspaces_counted_on_resume(self):
+        self.status.write()
+        resumed = range_repair.RepairStatus()
+        resumed.resume(self.f, None)
+        self.assertEqual(resumed.keyspace_pending, self.status.keyspace_pending)
+        self.assertEqual(resumed.keyspace_repairs, self.status.keyspace_repairs)
+        return
+
+    def test_server(self):
+        options, _ = range_repair.build_option_parser().parse_args(['--metrics-port', '0'])
+        server = range_repair.start_metrics_server(options, self.status)
+        try:
+            url = 'http://127.0.0.1:{0}'.format(server.port)
+            response = urlopen(url + '/metrics')
+            self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+            self.assertIn('range_repair_completion_rate', response.read().decode('utf-8'))
+            response = urlopen(Request(url + '/metrics', headers={'Accept': 'application/openmetrics-text'}))
+            self.assertTrue(response.headers['Content-Type'].startswith('application/openmetrics-text'))
+            with self.assertRaises(HTTPError):
+                urlopen(url + '/')
+        finally:
+            server.stop()
+        self.assertIsNone(range_repair.start_metrics_server(range_repair.build_option_parser().parse_args([])[0],
+                                                            self.status))
+        return
@@ -0,0 +1,110 @@
+#! /usr/bin/env python
+
+
+import os, sys, unittest, mock, shutil, tempfile
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+sys.path.insert(0,os.path.abspath(__file__+"/../../src"))
+
+import range_repair
+
+keyspaces = {'system': ['local'], 'ks1': ['t1', 't2'], 'ks2': ['t3']}
+
+
+def build_tokens(host_ranges):
+    tokens = range_repair.TokenContainer.__new__(range_repair.TokenContainer)
+    tokens.host_ranges = host_ranges
+    tokens.host_token_count = len(host_ranges)
+    return tokens
+
+
+def job(table, start):
+    return str(start), str(start + 1), 1, '1/1', 'ks', [table]
+
+
+class table_step_plan_tests(unittest.TestCase):
+    def setUp(self):
+        self.options, _ = range_repair.build_option_parser().parse_args(['--per-table'])
+        self.jobs = [job(table, start) for start in range(3) for table in ('a', 'b')]
+        return
+
+    def take_all(self, plan):
+        steps = []
+        for step in iter(plan.next_step, None):
+            steps.append(step)
+            plan.step_done(step, True, 0)
+        return [(step[5][0], int(step[0])) for step in steps]
+
+    def test_range_order(self):
+        plan = range_repair.TableStepPlan(self.options, self.jobs)
+        self.assertEqual(self.take_all(plan), [('a', 0), ('b', 0), ('a', 1), ('b', 1), ('a', 2), ('b', 2)])
+        return
+
+    def test_table_order(self):
+        self.options.table_order = 'table'
+        plan = range_repair.TableStepPlan(self.options, self.jobs)
+        self.assertEqual(self.take_all(plan), [('a', 0), ('a', 1), ('a', 2), ('b', 0), ('b', 1), ('b', 2)])
+        return
+
+    def test_table_concurrency(self):
+        self.options.table_order = 'table'
+        plan = range_repair.TableStepPlan(self.options, self.jobs)
+        first, second = plan.next_step(), plan.next_step()
+        # Table a is at its limit, so table b goes next
+        self.assertEqual((first[5], second[5]), (['a'], ['b']))
+        self.assertEqual(plan.next_step(), None)
+        plan.step_done(second, True, 0)
+        self.assertEqual(plan.next_step()[5], ['b'])
+        self.options.table_concurrency = 2
+        plan = range_repair.TableStepPlan(self.options, self.jobs)
+        self.assertEqual([plan.next_step()[5] for _ in range(3)], [['a'], ['a'], ['b']])
+        return
+
+
+class per_table_steps_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.options, _ = range_repair.build_option_parser().parse_args([
+            '--per-table', '-s', '2', '--nodetool', 'true', '--max-sleep-before-run', '0',
+            '-w', '3', '--executor', 'thread', '--status-flush-interval', '0', '--output-status', os.path.join(self.tmpdir, 'status.json')])
+        self.status = range_repair.RepairStatus()
+        self.status.start(self.options)
+        self.tokens = build_tokens([(0, 100)])
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        return
+
+    def test_repair_tables(self):
+        with mock.patch.object(range_repair, 'enumerate_keyspaces', return_value=keyspaces):
+            self.assertEqual(range_repair.repair_tables(self.options), [('ks1', 't1'), ('ks1', 't2'), ('ks2', 't3')])
+            self.options.keyspace = 'ks1'
+            self.assertEqual(range_repair.repair_tables(self.options), [('ks1', 't1'), ('ks1', 't2')])
+        self.options.columnfamily = ['t2']
+        self.assertEqual(range_repair.repair_tables(self.options), [('ks1', 't2')])
+        return
+
+    def test_steps_are_pending_and_excluded(self):
+        self.options.exclude_step = [{'keyspace': 'ks1', 'column_family': 't2', 'node': '1', 'step': 2}]
+        with mock.patch.object(range_repair, 'enumerate_keyspaces', return_value=keyspaces):
+            steps = list(range_repair.per_table_steps(self.options, self.tokens, self.status))
+        self.assertEqual([(step[2], step[4], step[5]) for step in steps],
+                         [(1, 'ks1', ['t1']), (1, 'ks1', ['t2']), (1, 'ks2', ['t3']),
+                          (2, 'ks1', ['t1']), (2, 'ks2', ['t3'])])
+        self.assertEqual(len(self.status.pending_repairs), 5)
+        self.assertEqual(sorted(range_repair.resumed_steps(self.status, per_table=True)), sorted(steps))
+        return
+
+    def test_run_repair_steps(self):
+        with mock.patch.object(range_repair, 'enumerate_keyspaces', return_value=keyspaces):
+            plan = range_repair.TableStepPlan(
+                self.options, range_repair.per_table_steps(self.options, self.tokens, self.status))
+        range_repair.run_repair_steps(self.options, plan, self.status)
+        self.status.finish()
+        self.assertEqual(self.status.successful_count, 6)
+        self.assertEqual(self.status.pending_repairs, {})
+        self.assertEqual(sorted(repair.column_families for repair in self.status.finished_repairs.values()),
+                         [('t1',), ('t1',), ('t2',), ('t2',), ('t3',), ('t3',)])
+        return
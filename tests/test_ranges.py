@@ -96,6 +96,68 @@ class range_tests(unittest.TestCase):
             resultset.append(x[0])
         self.assertEqual(len(resultset), 6)
         return
+
+    def test_preceding_token(self):
+        t = range_repair.TokenContainer(self.f)
+        t.ring_tokens.extend([-100, 0, 50, 200])
+        self.assertEqual(t.get_preceding_token(50), 0)
+        self.assertEqual(t.get_preceding_token(51), 50)
+        self.assertEqual(t.get_preceding_token(200), 50)
+        self.assertEqual(t.get_preceding_token(1000), 200)
+        return
+
+    def test_preceding_token_wrap(self):
+        t = range_repair.TokenContainer(self.f)
+        t.ring_tokens.extend([-100, 0, 50, 200])
+        self.assertEqual(t.get_preceding_token(-100), 200)
+        self.assertEqual(t.get_preceding_token(-500), 200)
+        return
+
+    def test_host_ranges(self):
+        t = range_repair.TokenContainer(self.f)
+        t.ring_tokens.extend([-100, 0, 50, 200])
+        t.host_tokens.extend([-100, 50])
+        t.build_host_ranges()
+        self.assertEqual(t.host_ranges, [(200, -100), (0, 50)])
+        return
+
+    def test_coalesce_host_ranges(self):
+        t = range_repair.TokenContainer(self.f)
+        t.ring_tokens.extend([-100, 0, 50, 200, 300])
+        t.host_tokens.extend([0, 50, 200])
+        t.build_host_ranges()
+        # 3 ranges of 5 steps each become one range of 5 steps
+        self.assertEqual(t.coalesce_host_ranges(5), 10)
+        self.assertEqual(t.host_ranges, [(-100, 200)])
+        return
+
+    def test_coalesce_host_ranges_wrap(self):
+        t = range_repair.TokenContainer(self.f)
+        t.ring_tokens.extend([-100, 0, 50, 200])
+        t.host_tokens.extend([-100, 0, 200])
+        t.build_host_ranges()
+        t.coalesce_host_ranges(5)
+        self.assertEqual(t.host_ranges, [(50, 0)])
+        return
+
+    def test_coalesce_host_ranges_never_full_ring(self):
+        t = range_repair.TokenContainer(self.f)
+        t.ring_tokens.extend([-100, 0, 50, 200])
+        t.host_tokens.extend([-100, 0, 50, 200])
+        t.build_host_ranges()
+        t.coalesce_host_ranges(5)
+        self.assertEqual(t.host_ranges, [(200, 50), (50, 200)])
+        return
+
+    def test_coalesce_host_ranges_keeps_gaps(self):
+        t = range_repair.TokenContainer(self.f)
+        t.ring_tokens.extend([-100, 0, 50, 200])
+        t.host_tokens.extend([-100, 50])
+        t.build_host_ranges()
+        self.assertEqual(t.coalesce_host_ranges(5), 0)
+        self.assertEqual(t.host_ranges, [(200, -100), (0, 50)])
+        return
+
     def test_Murmur3_format_length(self):
         t = range_repair.TokenContainer(self.f)
         self.assertEqual(21, len(t.format(0)))
@@ -0,0 +1,353 @@
+#! /usr/bin/env python
+
+
+import os, sys, unittest, json, shutil, subprocess, tempfile, time
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+sys.path.insert(0,os.path.abspath(__file__+"/../../src"))
+
+import range_repair
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+
+
+class FakeOptions: pass
+
+
+class repair_status_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        f = FakeOptions()
+        f.output_status = os.path.join(self.tmpdir, 'status.json')
+        f.logfile = None
+        f.steps = 2
+        f.status_compact_interval = 1000
+        f.status_flush_interval = 0
+        self.f = f
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        return
+
+    def read_snapshot(self):
+        with open(self.f.output_status) as f:
+            return json.load(f)
+
+    def read_journal(self):
+        with open(range_repair.RepairStatus.journal_filename(self.f.output_status)) as f:
+            return [json.loads(line) for line in f]
+
+    def run_steps(self, status):
+        for step in (1, 2):
+            status.add_pending_repair(range_repair.RepairTask('', step, 'a', 'b', '1/1', 'ks'))
+        status.repair_start('cmd1', 1, 'a', 'b', '1/1', 'ks')
+        status.repair_success('cmd1', 1, 'a', 'b', '1/1', 'ks')
+        status.repair_start('cmd2', 2, 'a', 'b', '1/1', 'ks')
+        status.repair_fail('cmd2', 2, 'a', 'b', '1/1', 'ks')
+
+    def test_events_are_journaled(self):
+        status = range_repair.RepairStatus()
+        status.start(self.f)
+        self.run_steps(status)
+        self.assertEqual([r['event'] for r in self.read_journal()],
+                         ['pending', 'pending', 'start', 'success', 'start', 'fail'])
+        # The snapshot is not rewritten for every event
+        self.assertEqual(self.read_snapshot()['pending_repairs'], {})
+        return
+
+    def test_load_replays_journal(self):
+        status = range_repair.RepairStatus()
+        status.start(self.f)
+        self.run_steps(status)
+        loaded = range_repair.RepairStatus.load(self.f.output_status)
+        self.assertEqual(loaded['successful_count'], 1)
+        self.assertEqual(loaded['failed_count'], 1)
+        self.assertEqual(loaded['pending_repairs'], {})
+        self.assertEqual(list(loaded['finished_repairs'].values())[0]['cmd'], 'cmd1')
+        self.assertEqual(list(loaded['failed_repairs'].values())[0]['cmd'], 'cmd2')
+        return
+
+    def test_compaction(self):
+        self.f.status_compact_interval = 4
+        status = range_repair.RepairStatus()
+        status.start(self.f)
+        self.run_steps(status)
+        snapshot = self.read_snapshot()
+        self.assertEqual(snapshot['journal_seq'], 4)
+        self.assertEqual(snapshot['successful_count'], 1)
+        self.assertEqual(len(self.read_journal()), 2)
+        self.assertEqual(range_repair.RepairStatus.load(self.f.output_status)['failed_count'], 1)
+        status.finish()
+        self.assertEqual(self.read_journal(), [])
+        self.assertEqual(self.read_snapshot()['failed_count'], 1)
+        return
+
+    def test_load_skips_compacted_and_torn_records(self):
+        status = range_repair.RepairStatus()
+        status.start(self.f)
+        self.run_steps(status)
+        journal = range_repair.RepairStatus.journal_filename(self.f.output_status)
+        with open(journal) as f:
+            lines = f.readlines()
+        # Simulate a crash after the snapshot was written but before the
+        # journal was truncated, followed by a torn write.
+        status.write()
+        with open(journal, 'w') as f:
+            f.writelines(lines)
+            f.write('{"event": "succ')
+        loaded = range_repair.RepairStatus.load(self.f.output_status)
+        self.assertEqual(loaded['successful_count'], 1)
+        self.assertEqual(loaded['failed_count'], 1)
+        return
+
+    def test_resume(self):
+        status = range_repair.RepairStatus()
+        status.start(self.f)
+        self.run_steps(status)
+        resumed = range_repair.RepairStatus()
+        resumed.resume(self.f, None)
+        self.assertEqual(resumed.successful_count, 1)
+        self.assertEqual(self.read_snapshot()['failed_count'], 1)
+        self.assertTrue(self.read_snapshot()['last_resumed_at'])
+        return
+
+    def test_status_file_format(self):
+        status = range_repair.RepairStatus()
+        status.start(self.f)
+        status.add_pending_repair(range_repair.RepairTask('', 1, 'a', 'b', '1/1', None, None))
+        status.repair_start('cmd', 2, 'a', 'b', '1/1', 'ks', ['t1', 't2'])
+        status.write()
+        snapshot = self.read_snapshot()
+        self.assertEqual(list(snapshot['pending_repairs']), ['1_a_b_1/1_None_<all>'])
+        self.assertEqual(snapshot['pending_repairs']['1_a_b_1/1_None_<all>']['keyspace'], '<all>')
+        self.assertEqual(snapshot['pending_repairs']['1_a_b_1/1_None_<all>']['column_families'], '<all>')
+        self.assertEqual(list(snapshot['current_repairs']), ["2_a_b_1/1_ks_['t1', 't2']"])
+        self.assertEqual(snapshot['current_repair']['column_families'], "['t1', 't2']")
+        resumed = range_repair.RepairStatus()
+        resumed.resume(self.f, None)
+        self.assertEqual(sorted(resumed.current_repairs), sorted(status.current_repairs))
+        self.assertEqual(sorted(resumed.pending_repairs), sorted(status.pending_repairs))
+        self.assertEqual(self.read_snapshot()['current_repairs'], snapshot['current_repairs'])
+        return
+
+    def test_tasks_share_names(self):
+        tasks = [range_repair.RepairTask('', step, str(step), str(step + 1), '1/1', 'ks' + '1', ['t' + '1'])
+                 for step in range(2)]
+        self.assertIs(tasks[0].keyspace, tasks[1].keyspace)
+        self.assertIs(tasks[0].column_families, tasks[1].column_families)
+        self.assertEqual(tasks[0].key, range_repair.RepairTask.identity(0, '0', '1', '1/1', 'ks1', "['t1']"))
+        self.assertEqual(range_repair.RepairTask.from_list(tasks[0].to_list()).key, tasks[0].key)
+        return
+
+    def test_load_replays_journal_with_repair_dicts(self):
+        status = range_repair.RepairStatus()
+        status.start(self.f)
+        repair = range_repair.RepairTask('cmd1', 1, 'a', 'b', '1/1', 'ks').to_dict()
+        k = range_repair.create_key(1, 'a', 'b', '1/1', 'ks', [])
+        with open(range_repair.RepairStatus.journal_filename(self.f.output_status), 'w') as f:
+            f.write(json.dumps({'event': 'start', 'key': k, 'repair': repair, 'time': repair['time'], 'seq': 1}) + '\n')
+            f.write(json.dumps({'event': 'success', 'key': k, 'time': repair['time'], 'seq': 2}) + '\n')
+        loaded = range_repair.RepairStatus.load(self.f.output_status)
+        self.assertEqual(loaded['successful_count'], 1)
+        self.assertEqual(loaded['current_repairs'], {})
+        self.assertEqual(loaded['finished_repairs'], {k: repair})
+        return
+
+    def test_coalesced_flush(self):
+        self.f.status_flush_interval = 200
+        status = range_repair.RepairStatus()
+        status.start(self.f)
+        self.run_steps(status)
+        # Nothing is written until the flush interval has passed.
+        time.sleep(0.05)
+        self.assertNotEqual(self.read_snapshot()['failed_count'], 1)
+        time.sleep(0.4)
+        snapshot = self.read_snapshot()
+        self.assertEqual(snapshot['failed_count'], 1)
+        self.assertEqual(snapshot['successful_count'], 1)
+        self.assertTrue(snapshot['writes_saved'] > 0)
+        self.assertFalse(os.path.exists(self.f.output_status + '.tmp'))
+        return
+
+    def test_finish_flushes(self):
+        self.f.status_flush_interval = 60000
+        status = range_repair.RepairStatus()
+        status.start(self.f)
+        self.run_steps(status)
+        status.finish()
+        snapshot = self.read_snapshot()
+        self.assertEqual(snapshot['failed_count'], 1)
+        self.assertTrue(snapshot['finished'])
+        self.assertEqual(snapshot['writes_saved'], 5)
+        self.assertEqual(status.flush_timer, None)
+        return
+
+    def test_queue_events_are_aggregated(self):
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
+        status = range_repair.RepairStatus()
+        status.start(self.f)
+        status_queue = queue.Queue()
+        worker_status = range_repair.QueueRepairStatus(status_queue)
+        worker_status.repair_start('cmd1', 1, 'a', 'b', '1/1', 'ks', None)
+        worker_status.repair_success('cmd1', 1, 'a', 'b', '1/1', 'ks', None)
+        worker_status.repair_start('cmd2', 2, 'a', 'b', '1/1', 'ks', None)
+        worker_status.repair_fail('cmd2', 2, 'a', 'b', '1/1', 'ks', None)
+        status_queue.put(None)
+        range_repair.aggregate_status_events(status_queue, status)
+        self.assertEqual(status.successful_count, 1)
+        self.assertEqual(status.failed_count, 1)
+        self.assertEqual(status.current_repairs, {})
+        return
+
+    def test_progress_bitmap(self):
+        status = range_repair.RepairStatus()
+        status.start(self.f)
+        status.track_progress(20)
+        status.repair_start('cmd1', 1, 'a', 'b', '1/1', 'ks')
+        status.repair_success('cmd1', 1, 'a', 'b', '1/1', 'ks')
+        status.step_done(0, True)
+        status.step_done(9, True)
+        status.step_done(3, False)
+        self.assertEqual(status.finished_repairs, {})
+        # Replayed from the journal
+        loaded = range_repair.RepairStatus()
+        loaded._from_output_status(range_repair.RepairStatus.load(self.f.output_status))
+        self.assertEqual([i for i in range(20) if loaded.progress.is_done(i)], [0, 9])
+        self.assertEqual([i for i in range(20) if loaded.progress.is_settled(i)], [0, 3, 9])
+        self.assertEqual(loaded.progress.pending_count, 17)
+        # And from a snapshot
+        status.write()
+        snapshot = self.read_snapshot()
+        self.assertEqual(snapshot['pending_count'], 17)
+        self.assertEqual(snapshot['progress']['failed'], [3])
+        progress = range_repair.StepProgress.from_dict(snapshot['progress'])
+        self.assertEqual((progress.done_count, progress.failed), (2, set([3])))
+        return
+
+    def test_phase_timings(self):
+        status = range_repair.RepairStatus()
+        status.start(self.f)
+        status.set_run_timings({'ring': 0.5, 'planning': 0.25})
+        status.repair_start('cmd1', 1, 'a', 'b', '1/1', 'ks')
+        status.repair_success('cmd1', 1, 'a', 'b', '1/1', 'ks', None, {'queued': 0.002, 'nodetool': 12.0, 'retries': 1})
+        status.repair_start('cmd2', 2, 'a', 'b', '1/1', 'ks')
+        status.repair_fail('cmd2', 2, 'a', 'b', '1/1', 'ks', None, {'queued': 0.5, 'nodetool': 4000.0, 'retries': 0})
+        self.assertEqual(self.read_journal()[-1]['timings']['nodetool'], 4000.0)
+        # Replayed from the journal
+        timings = range_repair.RepairStatus.load(self.f.output_status)['timings']
+        self.assertEqual(timings['run'], {'ring': 0.5, 'planning': 0.25})
+        self.assertEqual(timings['retries'], 1)
+        nodetool = timings['phases']['nodetool']
+        self.assertEqual((nodetool['count'], nodetool['sum'], nodetool['max']), (2, 4012.0, 4000.0))
+        # 12 seconds is over the 10 second bucket, 4000 over every bucket
+        self.assertEqual(nodetool['counts'][timings['buckets'].index(30)], 1)
+        self.assertEqual(nodetool['counts'][-1], 1)
+        self.assertEqual(timings['phases']['queued']['counts'][timings['buckets'].index(0.005)], 1)
+        # And carried over a resume
+        status.write()
+        self.assertEqual(self.read_snapshot()['timings']['phases']['journal']['count'], 5)
+        resumed = range_repair.RepairStatus()
+        resumed.resume(self.f, None)
+        self.assertEqual(resumed.timings.phases['nodetool']['count'], 2)
+        self.assertEqual(resumed.timings.retries, 1)
+        return
+
+
+class compact_status_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cmd = [sys.executable, os.path.join(thisdir, '../src', 'range_repair.py'),
+                    '--nodetool', os.path.join(thisdir, 'mock_nodetool_script'), '-s', '2', '-w', '4',
+                    '--executor', 'thread', '--max-sleep-before-run', '0', '--status-format', 'compact',
+                    '--output-status', os.path.join(self.tmpdir, 'status.json')]
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        return
+
+    def run_repair(self, *extra):
+        subprocess.check_output(self.cmd + list(extra), cwd=self.tmpdir, env=dict(os.environ, MOCK_NODETOOL_MAX_SLEEP='0'))
+        with open(os.path.join(self.tmpdir, 'logfile.count')) as f:
+            runs = f.readlines()
+        with open(os.path.join(self.tmpdir, 'status.json')) as f:
+            status = json.load(f)
+        return runs, status
+
+    def test_compact_run(self):
+        runs, status = self.run_repair()
+        self.assertEqual(len(runs), 20)
+        self.assertEqual(status['successful_count'], 20)
+        self.assertEqual(status['progress']['done_count'], 20)
+        self.assertEqual(status['pending_count'], 0)
+        self.assertEqual(status['finished_repairs'], {})
+        self.assertEqual(status['pending_repairs'], {})
+        return
+
+    def start_status(self, total, plan=None):
+        f = type('FakeOptions', (object,), {})()
+        f.output_status = os.path.join(self.tmpdir, 'status.json')
+        f.logfile = None
+        f.steps = 2
+        f.status_compact_interval = 1000
+        f.status_flush_interval = 0
+        status = range_repair.RepairStatus()
+        status.start(f)
+        status.track_progress(total, plan)
+        return status
+
+    def test_resume_skips_done_steps(self):
+        status = self.start_status(20)
+        for index in range(5):
+            status.step_done(index, True)
+        status.step_done(7, False)
+        status.write()
+        runs, status = self.run_repair('--resume')
+        self.assertEqual(len(runs), 14)
+        self.assertEqual(status['progress']['done_count'], 19)
+        self.assertEqual(status['progress']['failed'], [7])
+        self.assertTrue(status['finished'])
+        return
+
+    def test_resume_refuses_a_different_plan(self):
+        self.start_status(20, 'fingerprint of another plan').write()
+        self.assertRaises(subprocess.CalledProcessError, self.run_repair, '--resume')
+        self.start_status(25).write()
+        self.assertRaises(subprocess.CalledProcessError, self.run_repair, '--resume')
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'logfile.count')))
+        return
+
+    def test_resume_refuses_a_different_keyspace(self):
+        runs, status = self.run_repair()
+        self.start_status(20, status['progress']['plan']).write()
+        self.assertRaises(subprocess.CalledProcessError, self.run_repair, '--resume', '-k', 'other_keyspace')
+        self.start_status(20, status['progress']['plan']).write()
+        self.assertRaises(subprocess.CalledProcessError, self.run_repair, '--resume', '-k', 'ks', '-c', 't1')
+        return
+
+    def test_resume_refuses_incompatible_options(self):
+        runs, status = self.run_repair()
+        os.remove(os.path.join(self.tmpdir, 'logfile.count'))
+        for extra in (['--per-table'], ['--target-step-duration', '10']):
+            self.start_status(20, status['progress']['plan']).write()
+            cmd = self.cmd + ['--resume'] + extra
+            cmd.remove('compact')
+            cmd.remove('--status-format')
+            with self.assertRaises(subprocess.CalledProcessError) as raised:
+                subprocess.check_output(cmd, cwd=self.tmpdir, stderr=subprocess.STDOUT)
+            self.assertIn(b'compact format', raised.exception.output)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'logfile.count')))
+        return
+
+    def test_resume_same_plan(self):
+        runs, status = self.run_repair()
+        self.assertEqual(len(status['progress']['plan']), 40)
+        self.start_status(20, status['progress']['plan']).write()
+        runs, status = self.run_repair('--resume')
+        self.assertEqual(len(runs), 20)
+        return
@@ -0,0 +1,150 @@
+#! /usr/bin/env python
+
+
+import os, sys, unittest, json, mock, shutil, tempfile
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+sys.path.insert(0,os.path.abspath(__file__+"/../../src"))
+
+import range_repair
+
+ring = """
+Datacenter: dc1
+==========
+Address    Rack        Status State   Load            Owns                Token
+10.0.0.1   rack1       Up     Normal  54.87 KB        25.00%              -200
+10.0.0.2   rack1       Up     Normal  54.87 KB        25.00%              -100
+10.0.0.3   rack1       Up     Normal  54.87 KB        25.00%              0
+10.0.0.4   rack1       Up     Normal  54.87 KB        25.00%              100
+"""
+
+describering = """Schema Version:1074419a-3e2b-3a7b-ae04-0ba1d4b6f4b2
+TokenRange:
+\tTokenRange(start_token:100, end_token:-200, endpoints:[10.0.0.1, 10.0.0.2], rpc_endpoints:[10.0.0.1, 10.0.0.2], endpoint_details:[EndpointDetails(host:10.0.0.1, datacenter:dc1, rack:rack1), EndpointDetails(host:10.0.0.2, datacenter:dc1, rack:rack1)])
+\tTokenRange(start_token:-100, end_token:0, endpoints:[10.0.0.3, 10.0.0.4], rpc_endpoints:[10.0.0.3, 10.0.0.4], endpoint_details:[])
+\tTokenRange(start_token:-200, end_token:-100, endpoints:[10.0.0.2, 10.0.0.3], rpc_endpoints:[10.0.0.2, 10.0.0.3], endpoint_details:[])
+\tTokenRange(start_token:0, end_token:100, endpoints:[10.0.0.4, 10.0.0.1], rpc_endpoints:[10.0.0.4, 10.0.0.1], endpoint_details:[])
+"""
+
+
+def options(*args):
+    opts, _ = range_repair.build_option_parser().parse_args(list(args))
+    return opts
+
+
+def ring_replicas(replication_factor=2):
+    tokens = range_repair.TokenContainer.__new__(range_repair.TokenContainer)
+    tokens.options = options('--replica-aware')
+    tokens.local_nodes = []
+    tokens.ring_tokens = []
+    tokens.parse_ring_tokens(ring.splitlines())
+    return range_repair.ReplicaMap.from_ring(tokens, replication_factor)
+
+
+class replica_map_tests(unittest.TestCase):
+    def test_from_ring(self):
+        replicas = ring_replicas()
+        self.assertEqual(replicas.ends, [-200, -100, 0, 100])
+        self.assertEqual(replicas.ranges, [('10.0.0.1', '10.0.0.2'), ('10.0.0.2', '10.0.0.3'),
+                                           ('10.0.0.3', '10.0.0.4'), ('10.0.0.4', '10.0.0.1')])
+        self.assertEqual(ring_replicas(9).ranges[0], ('10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4'))
+        return
+
+    def test_from_describering(self):
+        replicas = range_repair.ReplicaMap.from_describering(describering.splitlines())
+        self.assertEqual(replicas.ends, ring_replicas().ends)
+        self.assertEqual(replicas.ranges, ring_replicas().ranges)
+        return
+
+    def test_sub_ranges(self):
+        replicas = ring_replicas()
+        self.assertEqual(replicas.replicas('-0000000050', '-0000000010'), ('10.0.0.3', '10.0.0.4'))
+        self.assertEqual(replicas.replicas(-100, 0), ('10.0.0.3', '10.0.0.4'))
+        # Coalesced ranges
+        self.assertEqual(replicas.replicas(-150, -50), ('10.0.0.2', '10.0.0.3', '10.0.0.4'))
+        # Wrapping range
+        self.assertEqual(replicas.replicas(150, -250), ('10.0.0.1', '10.0.0.2'))
+        self.assertEqual(replicas.replicas(100, -200), ('10.0.0.1', '10.0.0.2'))
+        # Whole ring
+        self.assertEqual(len(replicas.replicas(0, 0)), 4)
+        self.assertEqual(range_repair.ReplicaMap([], []).replicas(0, 10), ())
+        return
+
+
+class replica_plan_tests(unittest.TestCase):
+    def plan(self, steps, limit=1, workers=4):
+        opts = options('--replica-aware', '-w', str(workers), '--max-sessions-per-node', str(limit))
+        self.status = mock.Mock()
+        return range_repair.ReplicaStepPlan(opts, ring_replicas(), range_repair.StepPlan(steps), self.status)
+
+    def test_conflicting_steps_wait(self):
+        steps = [(-200, -150, 1, '1/4'), (-150, -100, 2, '1/4'), (0, 50, 1, '3/4'), (-100, -50, 1, '2/4')]
+        plan = self.plan(steps)
+        # 10.0.0.2 is busy with the first step, so the third one goes next
+        self.assertEqual(plan.next_step(), steps[0])
+        self.assertEqual(plan.next_step(), steps[2])
+        self.assertEqual(plan.next_step(), None)
+        self.assertEqual(dict(plan.busy), {'10.0.0.2': 1, '10.0.0.3': 1, '10.0.0.4': 1, '10.0.0.1': 1})
+        plan.step_done(steps[0], True, 1)
+        self.assertEqual(plan.next_step(), steps[1])
+        self.assertEqual(plan.next_step(), None)
+        plan.step_done(steps[1], True, 1)
+        plan.step_done(steps[2], True, 1)
+        self.assertEqual(plan.next_step(), steps[3])
+        plan.step_done(steps[3], True, 1)
+        self.assertFalse(self.status.set_scheduling.called)
+        self.assertEqual(plan.next_step(), None)
+        stats = self.status.set_scheduling.call_args[0][0]
+        self.assertEqual(stats['peak_parallelism'], 2)
+        self.assertEqual(stats['blocked_steps'], 2)
+        return
+
+    def test_limit(self):
+        steps = [(-200, -150, 1, '1/4'), (-150, -100, 2, '1/4'), (-100, -50, 1, '2/4')]
+        plan = self.plan(steps, limit=2)
+        self.assertEqual([plan.next_step() for _ in range(3)], [steps[0], steps[1], None])
+        return
+
+    def test_lookahead_for_feedback_plans(self):
+        steps = [(-200, -150, 1, '1/4'), (-150, -100, 2, '1/4'), (-140, -130, 3, '1/4'), (0, 50, 1, '3/4')]
+        inner = range_repair.StepPlan(steps)
+        inner.feedback = True
+        plan = range_repair.ReplicaStepPlan(options('-w', '1'), ring_replicas(), inner)
+        self.assertEqual(plan.next_step(), steps[0])
+        self.assertEqual(plan.next_step(), None)
+        self.assertEqual(plan.held_count, 1)
+        return
+
+
+class replica_run_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        return
+
+    def test_run_repair_steps(self):
+        opts = options('--nodetool', 'true', '-k', 'ks', '-w', '4', '--executor', 'thread', '--replica-aware',
+                       '--max-sleep-before-run', '0', '--output-status', os.path.join(self.tmpdir, 'status.json'))
+        status = range_repair.RepairStatus()
+        status.start(opts)
+        steps = [(start, start + 10, 1, '1/1') for start in range(-300, 200, 10)]
+        plan = range_repair.ReplicaStepPlan(opts, ring_replicas(), range_repair.StepPlan(steps), status)
+        range_repair.run_repair_steps(opts, plan, status)
+        status.finish()
+        with open(opts.output_status) as f:
+            saved = json.load(f)
+        self.assertEqual(saved['successful_count'], len(steps))
+        self.assertLessEqual(saved['scheduling']['peak_parallelism'], 2)
+        return
+
+    def test_max_sessions_per_node_below_one_is_rejected(self):
+        argv = ['range_repair.py', '-k', 'ks', '--replica-aware', '--max-sessions-per-node', '0']
+        with mock.patch.object(sys, 'argv', argv), mock.patch.object(range_repair, 'repair') as repair, \
+                mock.patch.object(range_repair, 'setup_logging'), mock.patch('sys.stdout'):
+            self.assertRaises(SystemExit, range_repair.main)
+        self.assertFalse(repair.called)
+        return
@@ -67,3 +67,11 @@ class RetryTests(unittest.TestCase):
         retryer, sleeps = build_fake_retryer(10, 7, -1)
         self.assertEqual(retryer(), False)
         self.assertEqual(sleeps, [1, 2, 4, 8, 16, 32])
+
+    def test_tries_and_sleep_are_counted(self):
+        retryer, sleeps = build_fake_retryer(2, 5)
+        retryer()
+        self.assertEqual((retryer.tries, retryer.slept), (3, 3))
+        retryer, sleeps = build_fake_retryer(0, 5)
+        retryer()
+        self.assertEqual((retryer.tries, retryer.slept), (1, 0))
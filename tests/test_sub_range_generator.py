@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+
+
+import os, sys, unittest, random
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+sys.path.insert(0,os.path.abspath(__file__+"/../../src"))
+
+import range_repair
+
+
+def reference_sub_range_generator(self, start, stop, steps=100):
+    '''The list-based sub_range_generator the streaming version replaced.'''
+    step = 0
+    if stop > start:
+        if start+steps < stop+1:
+            step_increment = ((stop - start) // steps)
+            step_list = [self.format(x) for x in range(start, stop, step_increment)][0:steps]
+        else:
+            step += 1
+            yield self.format(start), self.format(stop), step
+            return
+    else:
+        distance = (self.RANGE_MAX - start) + (stop - self.RANGE_MIN)
+        if distance > steps-1:
+            step_increment = distance // steps
+            step_list = [self.format(x) for x in range(start, self.RANGE_MAX, step_increment)]
+            step_list.extend([self.format(x) for x in range(self.RANGE_MIN, stop, step_increment)])
+            if len(step_list) > steps-1:
+                step_list.pop()
+        else:
+            step += 1
+            yield self.format(start), self.format(stop), step
+            return
+    step_list.append(self.format(stop))
+    while len(step_list) > 1:
+        step += 1
+        yield step_list[0], step_list[1], step
+        step_list.pop(0)
+
+
+def build_tokens(random_partitioner=False):
+    tokens = range_repair.TokenContainer.__new__(range_repair.TokenContainer)
+    tokens.ring_tokens = [1] if random_partitioner else [-1]
+    tokens.host_tokens = []
+    tokens.check_for_MD5_tokens()
+    return tokens
+
+
+class sub_range_property_tests(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(1234)
+        return
+
+    def assertMatchesReference(self, tokens, start, stop, steps):
+        expected = list(reference_sub_range_generator(tokens, start, stop, steps))
+        actual = list(tokens.sub_range_generator(start, stop, steps))
+        self.assertEqual(actual, expected, 'start={0} stop={1} steps={2}'.format(start, stop, steps))
+        self.assertEqual(tokens.count_sub_ranges(start, stop, steps), len(expected))
+
+    def check_partitioner(self, tokens):
+        for _ in range(300):
+            steps = self.rng.choice([1, 2, 3, 7, 100, self.rng.randint(1, 500)])
+            start = self.rng.randint(tokens.RANGE_MIN, tokens.RANGE_MAX)
+            case = self.rng.randint(0, 3)
+            if case == 0:       # ordinary range
+                stop = self.rng.randint(start, tokens.RANGE_MAX)
+            elif case == 1:     # fewer tokens than steps
+                stop = start + self.rng.randint(0, steps)
+            elif case == 2:     # wrap-around range
+                stop = self.rng.randint(tokens.RANGE_MIN, start)
+            else:               # wrap-around close to the ends of the ring
+                start = tokens.RANGE_MAX - self.rng.randint(0, steps)
+                stop = tokens.RANGE_MIN + self.rng.randint(0, steps)
+            self.assertMatchesReference(tokens, start, stop, steps)
+
+    def test_Murmur3_matches_reference(self):
+        self.check_partitioner(build_tokens())
+
+    def test_Random_matches_reference(self):
+        self.check_partitioner(build_tokens(random_partitioner=True))
+
+    def test_wrap_single_step(self):
+        tokens = build_tokens()
+        for start, stop in [(tokens.RANGE_MAX, tokens.RANGE_MIN), (tokens.RANGE_MAX - 5, tokens.RANGE_MIN + 5), (10, -10)]:
+            for steps in range(1, 12):
+                self.assertMatchesReference(tokens, start, stop, steps)
+
+    def test_more_steps_than_tokens_stops(self):
+        tokens = build_tokens()
+        self.assertEqual(list(tokens.sub_range_generator(0, 3, steps=10)),
+                         [(tokens.format(0), tokens.format(3), 1)])
+
+    def test_is_lazy(self):
+        tokens = build_tokens()
+        generator = tokens.sub_range_generator(tokens.RANGE_MIN, tokens.RANGE_MAX, steps=10**15)
+        self.assertEqual(next(generator)[2], 1)
+        self.assertEqual(next(generator)[2], 2)
+
+    def test_count_does_not_format(self):
+        tokens = build_tokens()
+        tokens.format = None
+        self.assertEqual(tokens.count_sub_ranges(tokens.RANGE_MIN, tokens.RANGE_MAX, steps=10**15), 10**15)
+        wrap = list(build_tokens().sub_range_generator(tokens.RANGE_MAX - 5, tokens.RANGE_MIN + 5, steps=4))
+        self.assertEqual(tokens.count_sub_ranges(tokens.RANGE_MAX - 5, tokens.RANGE_MIN + 5, steps=4), len(wrap))
+
+    def test_tokens_match_formatted(self):
+        for tokens in (build_tokens(), build_tokens(random_partitioner=True)):
+            start, stop = tokens.RANGE_MAX - 1000, tokens.RANGE_MIN + 1000
+            self.assertEqual([(tokens.format(s), tokens.format(e), step)
+                              for s, e, step in tokens.sub_range_tokens(start, stop, 7)],
+                             list(tokens.sub_range_generator(start, stop, 7)))
+
+
+class planned_steps_tests(unittest.TestCase):
+    def build_host(self, random_partitioner=False):
+        rng = random.Random(99)
+        tokens = build_tokens(random_partitioner)
+        tokens.ring_tokens = sorted(set(rng.randint(tokens.RANGE_MIN, tokens.RANGE_MAX) for _ in range(12)))
+        tokens.host_tokens = sorted(rng.sample(tokens.ring_tokens, 5))
+        tokens.build_host_ranges()
+        return tokens
+
+    def check_plan(self, args, tokens):
+        options, _ = range_repair.build_option_parser().parse_args(args)
+        expected = list(range_repair.host_sub_ranges(options, tokens))
+        planned = range_repair.PlannedSteps(options, tokens)
+        self.assertEqual(len(planned), len(expected))
+        self.assertEqual([planned[index] for index in range(len(planned))], expected)
+        self.assertRaises(IndexError, planned.__getitem__, len(planned))
+        return planned
+
+    def test_Murmur3(self):
+        tokens = self.build_host()
+        self.assertEqual(self.check_plan(['-s', '3'], tokens).starts.typecode, 'q')
+        self.check_plan(['-s', '4', '--offset', '2'], tokens)
+
+    def test_Random(self):
+        self.check_plan(['-s', '3'], self.build_host(random_partitioner=True))
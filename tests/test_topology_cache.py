@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+
+
+import os, sys, unittest, mock, shutil, tempfile, time
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+sys.path.insert(0,os.path.abspath(__file__+"/../../src"))
+
+import range_repair
+
+
+class topology_cache_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.options, _ = range_repair.build_option_parser().parse_args([
+            '-H', 'db1', '--topology-cache', os.path.join(self.tmpdir, 'cache')])
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        return
+
+    def test_round_trip(self):
+        cache = range_repair.TopologyCache.from_options(self.options)
+        self.assertEqual(cache.get('tokens'), None)
+        cache.put('tokens', {'ring_tokens': [-(2**63), 2**63-1]})
+        cache = range_repair.TopologyCache.from_options(self.options)
+        self.assertEqual(cache.get('tokens'), {'ring_tokens': [-(2**63), 2**63-1]})
+        return
+
+    def test_disabled(self):
+        self.options.topology_cache = None
+        self.assertEqual(range_repair.TopologyCache.from_options(self.options), None)
+        return
+
+    def test_keyed_by_datacenter(self):
+        range_repair.TopologyCache.from_options(self.options).put('tokens', [1])
+        self.options.datacenter = 'dc2'
+        self.assertEqual(range_repair.TopologyCache.from_options(self.options).get('tokens'), None)
+        return
+
+    def test_ttl(self):
+        cache = range_repair.TopologyCache.from_options(self.options)
+        cache.put('tokens', [1])
+        with mock.patch.object(range_repair.time, 'time', return_value=time.time() + self.options.topology_cache_ttl + 1):
+            self.assertEqual(cache.get('tokens'), None)
+        return
+
+    def test_refresh(self):
+        range_repair.TopologyCache.from_options(self.options).put('tokens', [1])
+        self.options.refresh_topology = True
+        self.assertEqual(range_repair.TopologyCache.from_options(self.options).get('tokens'), None)
+        return
+
+    def test_load_topology(self):
+        cache = range_repair.TopologyCache.from_options(self.options)
+        tokens = range_repair.TokenContainer.__new__(range_repair.TokenContainer)
+        self.assertFalse(tokens.load_topology(cache))
+        cache.put('tokens', {'local_nodes': [], 'host_tokens': [5], 'ring_tokens': [-5, 5]})
+        self.assertTrue(tokens.load_topology(cache))
+        self.assertEqual(tokens.host_token_count, 1)
+        self.assertEqual(list(tokens.ring_tokens), [-5, 5])
+        return
+
+    def test_cached_keyspaces(self):
+        cfstats = 'Keyspace: ks1\n\t\tTable: t1\n\t\tTable: t2\n'
+        with mock.patch.object(range_repair, 'run_command', return_value=(True, 'cfstats', cfstats, '')) as run:
+            self.assertEqual(range_repair.enumerate_keyspaces(self.options), {'ks1': ['t1', 't2']})
+            self.assertEqual(range_repair.enumerate_keyspaces(self.options), {'ks1': ['t1', 't2']})
+            self.assertEqual(run.call_count, 1)
+        return
@@ -0,0 +1,118 @@
+#! /usr/bin/env python
+
+
+import os, sys, unittest, mock, threading
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+sys.path.insert(0,os.path.abspath(__file__+"/../../src"))
+
+import range_repair
+
+gossipinfo = """/10.0.0.1
+  DC:6:dc1
+/10.0.0.2
+  DC:6:dc2
+/10.0.0.3
+  DC:6:dc1
+"""
+
+info = """ID               : ad03a002
+Token            : -100
+Token            : 200
+"""
+
+ring = """
+Datacenter: dc1
+==========
+Address    Rack        Status State   Load            Owns                Token
+10.0.0.1   rack1       Up     Normal  54.87 KB        33.33%              -100
+10.0.0.2   rack1       Up     Normal  54.87 KB        33.33%              0
+10.0.0.3   rack1       Up     Normal  54.87 KB        33.33%              100
+10.0.0.1   rack1       Up     Normal  54.87 KB        33.33%              200
+"""
+
+
+def iter_lines(text):
+    return (line for line in text.splitlines())
+
+
+class topology_discovery_tests(unittest.TestCase):
+    def setUp(self):
+        self.options, _ = range_repair.build_option_parser().parse_args(['-D', 'dc1'])
+        self.tokens = range_repair.TokenContainer.__new__(range_repair.TokenContainer)
+        self.tokens.options = self.options
+        self.tokens.local_nodes = []
+        self.tokens.ring_tokens = []
+        self.tokens.host_tokens = []
+        self.tokens.discovery_timings = {}
+        return
+
+    def test_commands_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+        outputs = {'gossipinfo': gossipinfo, 'info': info}
+
+        def run_command(*cmd):
+            # Both commands block until the other one is running
+            barrier.wait()
+            return True, '', outputs[cmd[5]], ''
+
+        with mock.patch.object(range_repair, 'run_command', side_effect=run_command), \
+                mock.patch.object(range_repair, 'stream_command', return_value=iter_lines(ring)) as stream:
+            self.tokens.discover_topology()
+        self.assertEqual(stream.call_args[0][5], 'ring')
+        self.assertEqual(self.tokens.local_nodes, ['10.0.0.1', '10.0.0.3'])
+        self.assertEqual(self.tokens.host_tokens, [-100, 200])
+        self.assertEqual(list(self.tokens.ring_tokens), [-100, 100, 200])
+        self.assertEqual(sorted(self.tokens.discovery_timings), ['gossipinfo', 'info', 'ring', 'total'])
+        return
+
+    def test_no_datacenter_skips_gossipinfo(self):
+        self.options.datacenter = None
+        outputs = {'info': info}
+        with mock.patch.object(range_repair, 'run_command',
+                               side_effect=lambda *cmd: (True, '', outputs[cmd[5]], '')) as run, \
+                mock.patch.object(range_repair, 'stream_command', return_value=iter_lines(ring)):
+            self.tokens.discover_topology()
+        self.assertEqual([call[0][5] for call in run.call_args_list], ['info'])
+        self.assertEqual(list(self.tokens.ring_tokens), [-100, 0, 100, 200])
+        # Murmur3 tokens stay packed
+        self.assertEqual(self.tokens.ring_tokens.typecode, 'q')
+        return
+
+    def test_failure_is_raised(self):
+        outputs = {'gossipinfo': (True, '', gossipinfo, ''), 'info': (False, '', '', 'refused')}
+        with mock.patch.object(range_repair, 'run_command', side_effect=lambda *cmd: outputs[cmd[5]]), \
+                mock.patch.object(range_repair, 'stream_command', return_value=iter_lines(ring)):
+            with self.assertRaises(Exception) as raised:
+                self.tokens.discover_topology()
+        self.assertIn('get_host_tokens', str(raised.exception))
+        self.assertIn('refused', str(raised.exception))
+        return
+
+    def test_random_partitioner_tokens(self):
+        self.options.datacenter = None
+        self.tokens.parse_ring_tokens(iter_lines(ring.replace(' 200\n', ' 170141183460469231731687303715884105727\n')))
+        self.assertEqual(self.tokens.ring_tokens, [-100, 0, 100, 2**127 - 1])
+        return
+
+
+class stream_command_tests(unittest.TestCase):
+    def test_lines(self):
+        lines = range_repair.ProcessBackend().stream('printf', "'a\\nb\\n'")
+        self.assertEqual(list(lines), ['a', 'b'])
+        return
+
+    def test_failure_raises_at_end(self):
+        lines = range_repair.ProcessBackend().stream('echo a; echo oops >&2; exit 3')
+        self.assertEqual(next(lines), 'a')
+        with self.assertRaises(Exception) as raised:
+            next(lines)
+        self.assertIn('oops', str(raised.exception))
+        return
+
+    def test_close_stops_command(self):
+        lines = range_repair.ProcessBackend().stream('sleep', '30')
+        lines.close()
+        self.assertIsNotNone(lines.proc.returncode)
+        return